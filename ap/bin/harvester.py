@@ -1,12 +1,16 @@
 import logging
+import os
+from typing import Optional, Sequence
 
 
 from ap.harvester.manager import CollectorManager
 from ap.harvester.manager import Collectors
 from ap.harvester.log_handler import log_handler
 
+FINN_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'harvester', 'data')
 
-def mirror_smg(log_path: str = ''):
+
+def mirror_smg(log_path: str = '', locations: Optional[Sequence[str]] = None):
     """Main script for mirroring smg database.
 
     The purpose of this script is to setup collector activities for collecting timeseries
@@ -16,22 +20,34 @@ def mirror_smg(log_path: str = ''):
     the process to mirroring data from the smg database. The data is the marked with a specific url-path
     to a local shyft-container, and stored accordingly.
 
+    Args:
+        log_path: Directory of the log files.
+        locations: Optional finn.no locations to harvest, one collector instance each writing to
+            its own data directory. When None, a single collector harvests the default locations.
     Returns:
 
     """
+    instances = {}
+    for location in locations or ():
+        instances[f'finn_{location}'] = (Collectors.FINN_REALESTATE, dict(
+            wait_first=False, wakeup_freq=5, locations=(location,),
+            data_dir=os.path.join(FINN_DATA_DIR, location),
+        ))
+
     cm = CollectorManager(
         monitor_poll_freq=8.,
         logger=None,
         default_wait_first=False,
         default_wakeup_freq=None,
 
-        collectors={
+        collectors={} if instances else {
             Collectors.FINN_REALESTATE: dict(
                 wait_first=False, wakeup_freq=5,
                 exit_event=None, logger=logging.getLogger("Reservoir")
             ),
 
-        }
+        },
+        instances=instances,
     )
 
     try:
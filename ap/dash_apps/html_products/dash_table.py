@@ -3,32 +3,18 @@ import dash_core_components as dcc
 import dash_html_components as html
 
 import pandas as pd
-import sqlite3
 
-def lazy_sqlite_db_fetch():
-    # Write CSV with new lines
-    db_con = sqlite3.connect(database='/home/andreas/Desktop/Houseprices/ap/harvester/data/finn_table.db')
-    cursor = db_con.cursor()
-    ##cursor.execute("SELECT * FROM finn_info;")
-
-    cursor.execute("PRAGMA table_info(realestate)")
+from ap.sql_toolbox.sql_interface import SqlDb, SqlOptions
 
-    ##print()
-
-    table = cursor.fetchall()
-    colum_headers = " ".join([t[1] + "," for t in table])[:-1]
-    print(colum_headers)
+def lazy_sqlite_db_fetch():
+    # Read-only connection, never blocks (or is blocked by) the harvester writing in WAL mode
+    sql_db = SqlDb(db_path='/home/andreas/Desktop/Houseprices/ap/harvester/data/finn_table.db',
+                   options=SqlOptions(read_only=True))
 
     # to export as csv file
-    with open("./finn_table.csv", "wb") as write_file:
-        cursor = db_con.cursor()
-        write_file.write(colum_headers.encode())
-        write_file.write("\n".encode())
-        for row in cursor.execute("SELECT * FROM realestate"):
-            writeRow = " ".join([str(i) + "," for i in row])[:-1]
-            print(writeRow)
-            write_file.write(writeRow.encode())
-            write_file.write("\n".encode())
+    export = sql_db.write_to_csv(path="./finn_table.csv", table="realestate")
+    print(f"Exported {export.rows} rows")
+    sql_db.disconnect()
 
 
 def generate_table(dataframe, max_rows=10):
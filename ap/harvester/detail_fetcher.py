@@ -0,0 +1,251 @@
+"""Concurrent fetching of listing detail pages into a PageCache.
+
+DetailFetcher downloads the detail pages of listings on a bounded thread pool, limited per
+host like ap.harvester.fetcher.PageFetcher, and retries failed requests with jittered
+exponential backoff. Bodies are stored in a content-addressed ap.harvester.page_cache.PageCache
+by the calling thread, so pages can be parsed again after a parser change without
+downloading them again.
+
+DetailWorker runs a DetailFetcher in a thread of its own, fed by a bounded queue of urls, so
+an activity queues the detail pages of changed listings without waiting for them.
+"""
+
+import logging
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Condition, Thread
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from ap.harvester.fetcher import HostLimiter
+from ap.harvester.http_client import HttpError, default_client
+from ap.harvester.page_cache import PageCache
+
+# Result of DetailFetcher.fetch_many(), body is None and error is set if fetching url failed
+DetailResult = namedtuple('DetailResult', ['url', 'body', 'cached', 'error'])
+
+DETAIL_URL = "https://www.finn.no/realestate/homes/ad.html?finnkode={finn_id}"
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request is worth retrying: network errors, throttling and server errors."""
+    if isinstance(error, HttpError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, OSError)
+
+
+class DetailFetcher:
+    """Fetch detail pages concurrently into a PageCache.
+
+    Args:
+        cache: Cache storing the fetched pages.
+        fetch: Function returning the body of a url. Defaults to unconditional requests with
+            the shared HttpClient.
+        max_workers: Maximum number of concurrent requests in total.
+        per_host: Maximum number of concurrent requests to one host.
+        rate: Maximum number of requests started per second to one host, None for no limit.
+        retries: Number of times a failed request is retried, see is_retryable().
+        backoff: Base of the exponential backoff in seconds. Retry n waits a random duration
+            between zero and ``backoff * 2**n`` seconds, capped at max_backoff.
+        max_backoff: Maximum wait before a retry in seconds.
+        logger: Parent logger. When None, a logger named after the class is used.
+    """
+
+    def __init__(self, cache: PageCache, *, fetch: Optional[Callable[[str], bytes]] = None,
+                 max_workers: int = 4, per_host: int = 2, rate: Optional[float] = 2.,
+                 retries: int = 3, backoff: float = 1., max_backoff: float = 30.,
+                 logger: Optional[logging.Logger] = None) -> None:
+        assert max_workers > 0, f'{DetailFetcher.__name__} should use at least one worker'
+        self.cache = cache
+        self.fetch = fetch if fetch is not None else default_client().fetch_always
+        self._max_workers = max_workers
+        self._limiter = HostLimiter(per_host=per_host, rate=rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        if logger is None:
+            self._logger = logging.getLogger(DetailFetcher.__name__)
+        else:
+            self._logger = logger.getChild(DetailFetcher.__name__)
+
+    def close(self) -> None:
+        """Stop the worker threads, waiting for running fetches."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _fetch_with_retries(self, url: str) -> bytes:
+        attempt = 0
+        while True:
+            try:
+                return self._limiter.call(url, self.fetch)
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0., min(self.max_backoff, self.backoff * 2 ** attempt))
+                self._logger.debug(f'Retrying {url} in {delay:.1f} s after {e}')
+                time.sleep(delay)
+                attempt += 1
+
+    def fetch_many(self, urls: Iterable[str], *, refresh: bool = True) -> Iterator[DetailResult]:
+        """Fetch urls concurrently, storing each body in the cache, yielding results in completion order.
+
+        Args:
+            urls: The detail pages to fetch.
+            refresh: Whether to download pages already in the cache. When False, cached pages
+                are yielded from the cache first.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix=DetailFetcher.__name__)
+        futures: Dict[Future, str] = {}
+        for url in dict.fromkeys(urls):
+            body = None if refresh else self.cache.get(url)
+            if body is not None:
+                yield DetailResult(url=url, body=body, cached=True, error=None)
+            else:
+                futures[self._executor.submit(self._fetch_with_retries, url)] = url
+
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = futures.pop(future)
+                    try:
+                        body = future.result()
+                    except Exception as e:
+                        self._logger.warning(f'Could not fetch {url}: {e}')
+                        yield DetailResult(url=url, body=None, cached=False, error=e)
+                        continue
+                    self.cache.put(url, body)
+                    yield DetailResult(url=url, body=body, cached=False, error=None)
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class DetailWorker:
+    """Thread fetching queued detail pages with a DetailFetcher, see the module documentation.
+
+    Args:
+        fetcher: The fetcher, used by the worker thread only once started.
+        max_queued: Maximum number of urls waiting to be fetched, put() drops urls while full.
+        batch_size: Number of queued urls handed to the fetcher at a time.
+        retry_delay: Seconds to wait before the next batch after retryable failures, which are
+            queued again.
+        logger: Parent logger. When None, a logger named after the class is used.
+    """
+
+    def __init__(self, fetcher: DetailFetcher, *, max_queued: int = 1000, batch_size: int = 20,
+                 retry_delay: float = 30., logger: Optional[logging.Logger] = None) -> None:
+        assert batch_size > 0, f'{DetailWorker.__name__} should use a strictly positive batch_size'
+        self.fetcher = fetcher
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.fetched = 0
+        # queued urls, mapped to whether to download them again if cached
+        self._pending: Dict[str, bool] = {}
+        self._condition = Condition()
+        self._busy = False
+        self._exit = False
+        self._thread: Optional[Thread] = None
+
+        if logger is None:
+            self._logger = logging.getLogger(DetailWorker.__name__)
+        else:
+            self._logger = logger.getChild(DetailWorker.__name__)
+
+    def start(self) -> None:
+        """Start the worker thread, if not already running."""
+        if self.is_running():
+            return
+        self._exit = False
+        self._thread = Thread(name=DetailWorker.__name__, target=self._run, daemon=True)
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def put(self, url: str, refresh: bool) -> bool:
+        """Queue url, downloading it again if cached when refresh is set.
+
+        Returns:
+            False if the queue is full and url was dropped.
+        """
+        with self._condition:
+            if url not in self._pending and len(self._pending) >= self.max_queued:
+                return False
+            self._pending[url] = self._pending.get(url, False) or refresh
+            self._condition.notify()
+        return True
+
+    def pending(self) -> Dict[str, bool]:
+        """Return the queued urls, mapped to whether they are downloaded again if cached."""
+        with self._condition:
+            return dict(self._pending)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until nothing is queued nor being fetched, returning False if timeout seconds passed first."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._busy, timeout=timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the worker thread after the batch being fetched, leaving the rest queued."""
+        with self._condition:
+            self._exit = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _take(self) -> Optional[Dict[str, bool]]:
+        """Wait for queued urls and take a batch of them, None on exit."""
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._exit or self._pending)
+            if self._exit:
+                return None
+            batch = dict(list(self._pending.items())[:self.batch_size])
+            for url in batch:
+                del self._pending[url]
+            self._busy = True
+            return batch
+
+    def _run(self) -> None:
+        """Worker loop."""
+        try:
+            while True:
+                batch = self._take()
+                if batch is None:
+                    break
+                retry = self._fetch(batch)
+                if retry:
+                    for url, refresh in retry.items():
+                        self.put(url, refresh)
+                    with self._condition:
+                        self._condition.wait_for(lambda: self._exit, timeout=self.retry_delay)
+        finally:
+            # the pooled connection of the cache belongs to this thread
+            self.fetcher.cache.disconnect()
+
+    def _fetch(self, batch: Dict[str, bool]) -> Dict[str, bool]:
+        """Fetch a batch, returning the urls failing with retryable errors."""
+        fetched = 0
+        retry: Dict[str, bool] = {}
+        for refresh in (True, False):
+            urls = [url for url, refresh_url in batch.items() if refresh_url == refresh]
+            try:
+                for result in self.fetcher.fetch_many(urls, refresh=refresh):
+                    if result.error is None:
+                        fetched += 1
+                    elif is_retryable(result.error):
+                        retry[result.url] = refresh
+            except Exception:
+                self._logger.exception(f'Fetching {len(urls)} detail pages failed')
+        self.fetched += fetched
+        self._logger.info(f'Fetched {fetched} detail pages, {len(self._pending)} queued')
+        return retry
@@ -0,0 +1,116 @@
+"""Event loop thread multiplexing async collector activities.
+
+EventLoopRunner runs an asyncio event loop in a thread of its own, and ActivityTask runs an
+AsyncActivityABC activity as a task on it. An ActivityTask stands in for the thread of the
+activity, so the CollectorMonitor supervises, restarts and drops async activities like it does
+threaded ones, while hundreds of them share one thread.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import CancelledError, Future
+from threading import Event, Thread
+from typing import Callable, Coroutine, Optional
+
+from ap.harvester.harvester import AsyncActivityABC
+
+
+class EventLoopRunner:
+    """Thread running an asyncio event loop, see the module documentation.
+
+    Args:
+        name: Name of the thread.
+        logger: Parent logger. When None, a logger named after the class is used.
+    """
+
+    def __init__(self, *, name: str = 'EventLoopRunner', logger: Optional[logging.Logger] = None) -> None:
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[Thread] = None
+
+        if logger is None:
+            self._logger = logging.getLogger(EventLoopRunner.__name__)
+        else:
+            self._logger = logger.getChild(EventLoopRunner.__name__)
+
+    def start(self) -> None:
+        """Start the event loop thread, returning once the loop runs."""
+        if self.is_running():
+            return
+        started = Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(name=self.name, target=self._run, args=(started,), daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        """Schedule a coroutine on the loop, returning a future of its result.
+        Raises:
+            RuntimeError: If the loop is not running.
+        """
+        if not self.is_running():
+            raise RuntimeError(f'{self.name} is not running')
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Cancel the remaining tasks, letting them clean up, then stop the loop thread."""
+        if not self.is_running():
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=timeout)
+
+    def _run(self, started: Event) -> None:
+        """Event loop thread."""
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(started.set)
+        try:
+            self._loop.run_forever()
+            tasks = asyncio.all_tasks(self._loop)
+            if tasks:
+                self._logger.warning(f'Cancelling {len(tasks)} tasks still running')
+                for task in tasks:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        finally:
+            self._loop.close()
+
+
+class ActivityTask:
+    """An async activity running on an EventLoopRunner, standing in for the thread of the activity.
+
+    Args:
+        activity: The activity.
+        runner: The event loop to run the activity on, started if not running.
+        name: Name of the task.
+        on_exit: Optional function called from the loop thread when the activity exits.
+    """
+
+    def __init__(self, activity: AsyncActivityABC, runner: EventLoopRunner, *, name: str,
+                 on_exit: Optional[Callable[[], None]] = None) -> None:
+        self.activity = activity
+        self.runner = runner
+        self.name = name
+        self._on_exit = on_exit
+        self._future: Optional[Future] = None
+
+    def start(self) -> None:
+        """Schedule the activity on the event loop."""
+        self.runner.start()
+        self._future = self.runner.submit(self.activity.run())
+        if self._on_exit is not None:
+            self._future.add_done_callback(lambda _: self._on_exit())
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Wait until the activity exits, or timeout seconds passed."""
+        if self._future is not None:
+            try:
+                self._future.exception(timeout=timeout)
+            except (TimeoutError, CancelledError):
+                pass
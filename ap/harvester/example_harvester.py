@@ -1,20 +1,18 @@
 from bs4 import BeautifulSoup
-import urllib.request
 import csv
 from datetime import datetime
 
 from ap.harvester.harvester import ActivityABC
+from ap.harvester.http_client import default_client
 
 def get_soup():                                                
-    with urllib.request.urlopen('https://www.finn.no/realestate/homes/search.html?location=0.20003') as html_code: 
-        read_html = html_code.read()                                    
+    read_html = default_client().fetch_always('https://www.finn.no/realestate/homes/search.html?location=0.20003')
 
     soup = BeautifulSoup(read_html, "html.parser")    
     return soup
 
 def get_specific_soup(finn_code: str):
-    with urllib.request.urlopen(f"https://www.finn.no/realestate/homes/ad.html?finnkode={finn_code}") as html_code:
-        read_html = html_code.read()
+    read_html = default_client().fetch_always(f"https://www.finn.no/realestate/homes/ad.html?finnkode={finn_code}")
 
     soup = BeautifulSoup(read_html, "html.parser")
     return soup
@@ -75,4 +73,5 @@ def finn2():
         except:
             print(soup)
 
-finn2()
\ No newline at end of file
+if __name__ == "__main__":
+    finn2()
@@ -0,0 +1,186 @@
+"""Concurrent, rate limited fetching of paginated search results.
+
+PageFetcher downloads pages on a bounded thread pool while the calling thread parses the pages
+already downloaded. Requests to the same host are limited both in concurrency and in rate, so
+walking many result pages does not hammer the site. Pages are fetched with the shared
+ap.harvester.http_client.HttpClient by default, so unchanged pages are revalidated instead of
+downloaded and parsed again.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from ap.harvester.http_client import default_client
+
+# returns the body of a url, or None if it has not changed since it was last fetched
+Fetch = Callable[[str], Optional[bytes]]
+
+
+class HostLimiter:
+    """Limit the concurrency and request rate of each host.
+
+    Args:
+        per_host: Maximum number of concurrent requests to one host.
+        rate: Maximum number of requests started per second to one host, None for no limit.
+    """
+
+    def __init__(self, per_host: int = 2, rate: Optional[float] = None) -> None:
+        assert per_host > 0, f'{HostLimiter.__name__} should allow at least one request per host'
+        assert rate is None or rate > 0., f'{HostLimiter.__name__} should use a strictly positive rate'
+        self._per_host = per_host
+        self._interval = 0. if rate is None else 1. / rate
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.Semaphore] = {}
+        self._next_start: Dict[str, float] = {}
+
+    def _acquire(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self._per_host))
+        semaphore.acquire()
+        with self._lock:
+            # reserve the next start slot, then sleep outside the lock
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+        return semaphore
+
+    def call(self, url: str, fetch: Fetch) -> Optional[bytes]:
+        """Fetch url once the limits of its host allow it."""
+        semaphore = self._acquire(urlparse(url).netloc)
+        try:
+            return fetch(url)
+        finally:
+            semaphore.release()
+
+
+class PageFetcher:
+    """Fetch pages concurrently on a bounded thread pool.
+
+    Args:
+        max_workers: Maximum number of concurrent requests in total.
+        per_host: Maximum number of concurrent requests to one host.
+        rate: Maximum number of requests started per second to one host, None for no limit.
+        fetch: Function returning the body of a url, or None if it is unchanged since the last
+            fetch. Defaults to conditional requests with the shared HttpClient.
+    """
+
+    def __init__(self, *, max_workers: int = 4, per_host: int = 2, rate: Optional[float] = 2.,
+                 fetch: Optional[Fetch] = None) -> None:
+        assert max_workers > 0, f'{PageFetcher.__name__} should use at least one worker'
+        self._max_workers = max_workers
+        self._limiter = HostLimiter(per_host=per_host, rate=rate)
+        self.fetch = fetch if fetch is not None else default_client().fetch
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # whether each walked url was the end of its listing when last parsed
+        self._ends: Dict[str, bool] = {}
+
+    def _submit(self, url: str) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                thread_name_prefix=PageFetcher.__name__)
+        # look the fetch function up on every request, so it can be replaced on the instance
+        return self._executor.submit(self._limiter.call, url, self.fetch)
+
+    def close(self) -> None:
+        """Stop the worker threads, waiting for running fetches."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def fetch_all(self, urls: Iterable[str]) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """Fetch urls concurrently, yielding ``(url, body)`` in completion order, body is None for unchanged urls.
+
+        Raises:
+            Exception: The error of the first failed fetch, the remaining fetches are cancelled.
+        """
+        futures = {self._submit(url): url for url in urls}
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield futures.pop(future), future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def walk_pages(self, page_urls: Iterable[Callable[[int], str]], parse: Callable[[bytes], List[Any]], *,
+                   max_pages: int = 50, prefetch: int = 2) -> Iterator[Tuple[str, int, List[Any]]]:
+        """Walk paginated results, parsing fetched pages while the next pages download.
+
+        Pages of each listing are numbered from 1. Up to prefetch pages ahead are requested
+        per listing, and a listing ends at the first page parsing to no items, or after
+        max_pages pages. Pages beyond the end that were already requested are discarded.
+        Unchanged pages are not parsed again, the walk continues past them unless they were
+        the end of their listing when last parsed. A failed fetch is only raised once every
+        earlier page of its listing is known not to be the end.
+
+        Args:
+            page_urls: For each paginated listing, a function returning the url of a page number.
+            parse: Function parsing a page body into its items, called in the calling thread.
+            max_pages: Maximum number of pages fetched per listing.
+            prefetch: Number of pages requested ahead per listing.
+
+        Yields:
+            ``(url, page, items)`` of every changed non-empty page, in completion order.
+
+        Raises:
+            Exception: The error of the first failed fetch of a page before the end of its listing.
+        """
+        assert prefetch > 0, 'prefetch should be at least one page'
+        # per listing: url function, next page to request, last page to request
+        listings: List[List[Any]] = [[page_url, 1, max_pages] for page_url in page_urls]
+        futures: Dict[Future, Tuple[int, int, str]] = {}
+        # failed fetches not known to be beyond the end of their listing
+        failures: List[Tuple[int, int, Exception]] = []
+
+        def request_more(index: int, in_flight: int) -> None:
+            listing = listings[index]
+            while in_flight < prefetch and listing[1] <= listing[2]:
+                url = listing[0](listing[1])
+                futures[self._submit(url)] = (index, listing[1], url)
+                listing[1] += 1
+                in_flight += 1
+
+        for index in range(len(listings)):
+            request_more(index, 0)
+
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, page, url = futures.pop(future)
+                    listing = listings[index]
+                    if page > listing[2]:
+                        continue
+                    try:
+                        body = future.result()
+                    except Exception as e:
+                        failures.append((index, page, e))
+                        continue
+                    if body is None:
+                        items = None
+                        end = self._ends.get(url, False)
+                    else:
+                        items = parse(body)
+                        end = self._ends[url] = not items
+                    if end:
+                        listing[2] = page - 1
+                        for pending in [f for f, (i, p, _) in futures.items() if i == index and p > page]:
+                            pending.cancel()
+                        continue
+                    if items is not None:
+                        yield url, page, items
+                    request_more(index, sum(1 for i, _, _ in futures.values() if i == index))
+
+                for index, page, error in failures:
+                    if page <= listings[index][2] and not any(i == index and p < page for i, p, _ in futures.values()):
+                        raise error
+                failures = [(i, p, e) for i, p, e in failures if p <= listings[i][2]]
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,42 @@
+"""Fingerprints of scraped content, to skip work for content that did not change.
+
+A fingerprint is a short hash of the raw html of a scraped item. FingerprintIndex remembers
+the fingerprints of handled items, so a harvester can tell new and changed items, which go through
+extraction and persistence, from unchanged ones, which cost only the hash. Checking a fingerprint
+does not record it: the harvester adds it once the item is persisted, so items whose write failed
+are extracted again.
+"""
+
+import hashlib
+from typing import Set
+
+
+def fingerprint(content: bytes) -> bytes:
+    """Return the 128 bit fingerprint of content."""
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+class FingerprintIndex:
+    """Fingerprints of the content handled since the index was last cleared.
+
+    The index does not expire fingerprints by itself, the harvester clears it to handle every
+    item again, see FinnActivity.soup_alchemy().
+    """
+
+    def __init__(self) -> None:
+        self._seen: Set[bytes] = set()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def seen(self, key: bytes) -> bool:
+        """Return whether a fingerprint was added, without recording it, see add()."""
+        return key in self._seen
+
+    def add(self, key: bytes) -> None:
+        """Record a fingerprint, once the content it was computed from has been handled."""
+        self._seen.add(key)
+
+    def clear(self) -> None:
+        """Forget every fingerprint, so all content counts as changed."""
+        self._seen.clear()
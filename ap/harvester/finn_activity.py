@@ -1,15 +1,36 @@
 from bs4 import BeautifulSoup, element
-import urllib.request
+import multiprocessing
 import os
 import time
 
-from typing import Optional
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
 from threading import Event
 import logging
 
 from ap.harvester.sqlwork import RealEstate
 from ap.harvester.harvester import ActivityABC
-from ap.sql_toolbox.sql_interface import SqlTsDb, SqlTable
+from ap.harvester.fetcher import PageFetcher
+from ap.harvester.http_client import HttpClient
+from ap.harvester import finn_parser
+from ap.harvester.fingerprints import FingerprintIndex, fingerprint
+from ap.harvester.detail_fetcher import DETAIL_URL, DetailFetcher, DetailWorker
+from ap.harvester.page_cache import PageCache
+from ap.harvester.schedule import AdaptiveSchedule, TimeOfDayProfile, NIGHT_PROFILE
+from ap.sql_toolbox.sql_interface import SqlDb, SqlTable, SqlOptions
+from ap.sql_toolbox.backends import create_backend
+from ap.sql_toolbox.writer import get_writer
+from ap.sql_toolbox.retention import RollupEngine, DAY
+
+# every listing is parsed and its price written once per full walk period, even when unchanged
+FULL_WALK_PERIOD = DAY
+# heartbeat of unchanged prices, see SqlTsDb. Full walks start at least FULL_WALK_PERIOD apart but
+# take varying time, with a heartbeat of FULL_WALK_PERIOD the price of a walk finishing faster than
+# the one before would be skipped, leaving a listing two periods without a point
+PRICE_HEARTBEAT = FULL_WALK_PERIOD - 3600
 
 class NotValidSqM(Exception):
     pass
@@ -31,6 +52,34 @@ class FinnActivity(ActivityABC):
         logger: Parent logger object. The activity creates a child logger from the instance.
             The child logger name is created by using the name property with all spaces
             replaced with ``_``.
+        ts_backend: Name of the time series backend storing prices, see ap.sql_toolbox.backends.
+        ts_backend_args: Arguments to create the backend with. Only optional for the default
+            ``sqlite`` backend, which then writes change-only prices to ``finn_ts.db`` of data_dir.
+        locations: Finn location codes to search, every result page of each is walked.
+        search_url: Url of the search results page, the location and page are added as query.
+        max_pages: Maximum number of result pages fetched per location and action.
+        max_workers: Maximum number of concurrent page fetches.
+        per_host: Maximum number of concurrent page fetches from one host.
+        rate: Maximum number of page fetches started per second from one host, None for no limit.
+        html_parser: BeautifulSoup backend parser, ``html.parser`` or ``lxml`` if installed.
+        parse_workers: Number of processes parsing the changed result items of the pages,
+            0 to parse in the activity thread. Not available when the activity itself runs in a
+            daemonic process, see ap.harvester.manager.ExecutionMode.
+        fetch_details: Whether to fetch the detail pages of new and changed listings into the
+            page cache in ``finn_details`` of data_dir, on a DetailWorker thread.
+        detail_url: Url template of the detail pages, formatted with the finn_id.
+        detail_cache_bytes: Maximum size of the cached detail pages.
+        max_details: Maximum number of detail pages waiting to be fetched, the pages of further
+            changes are skipped until the queue has room.
+        http_client: Client fetching all pages, e.g. a RecordingClient or ReplayClient from
+            ap.harvester.replay. Defaults to a new HttpClient.
+        data_dir: Directory of the databases, csv export and detail page cache. Defaults to
+            the ``data`` directory of this package.
+        min_wait: Minimum seconds between actions.
+        max_wait: Maximum seconds between actions, see AdaptiveSchedule.
+        target_changes: Number of new or changed listings to let accumulate between actions.
+        jitter: Maximum relative random deviation of the wait between actions.
+        profile: Time-of-day profile stretching the wait at quiet hours, None to disable.
 
     Attributes:
 
@@ -38,7 +87,17 @@ class FinnActivity(ActivityABC):
 
     def __init__(self, *,
                  wait_first: bool, wakeup_freq: Optional[float],
-                 exit_event: Event, logger, stair_case: bool = True) -> None:
+                 exit_event: Event, logger, stair_case: bool = True,
+                 ts_backend: str = 'sqlite', ts_backend_args: Optional[Dict[str, Any]] = None,
+                 locations: Sequence[str] = ('0.20003',),
+                 search_url: str = 'https://www.finn.no/realestate/homes/search.html',
+                 max_pages: int = 50, max_workers: int = 4, per_host: int = 2,
+                 rate: Optional[float] = 2., html_parser: str = 'html.parser', parse_workers: int = 0,
+                 fetch_details: bool = True, detail_url: str = DETAIL_URL,
+                 detail_cache_bytes: int = 512 * 1024 * 1024, max_details: int = 1000,
+                 http_client: Optional[HttpClient] = None, data_dir: Optional[str] = None,
+                 min_wait: float = 20., max_wait: float = 600., target_changes: float = 5.,
+                 jitter: float = 0.1, profile: Optional[TimeOfDayProfile] = NIGHT_PROFILE) -> None:
         super().__init__(
             exit_event=exit_event, logger=logger,
             wait_first=wait_first, wakeup_freq=wakeup_freq)
@@ -48,8 +107,50 @@ class FinnActivity(ActivityABC):
         self.module_map = None
 
         self.module_map = None
+        self.ts_backend = ts_backend
+        self.ts_backend_args = ts_backend_args
         self.sql_ts_db = None
         self.sql_table = None
+        self.ts_writer = None
+        self.table_writer = None
+        self.rollups = None
+        self._next_rollup = 0.
+        self.locations = list(locations)
+        self.search_url = search_url
+        self.max_pages = max_pages
+        self.html_parser = html_parser
+        self.parse_workers = parse_workers
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+        # keep-alive connections and page validators are kept between actions
+        self.http = http_client if http_client is not None else HttpClient(logger=self.logger)
+        self.fetcher = PageFetcher(max_workers=max_workers, per_host=per_host, rate=rate, fetch=self.http.fetch)
+        self._next_full_walk = 0.
+        # fingerprints of the result items handled since the last full walk, unchanged items are not parsed again
+        self.fingerprints = FingerprintIndex()
+        # fingerprint of the result item of each listing returned by the last soup_alchemy()
+        self._listing_fingerprints: Dict[int, bytes] = {}
+        # writes still to be confirmed per fingerprint and action, a fingerprint is added once none are left
+        self._unconfirmed: Dict[Tuple[bytes, int], int] = {}
+        # fingerprints and actions of the written items, appended by the writer threads
+        self._confirmed: Deque[Tuple[bytes, int]] = deque()
+        self._actions = 0
+        # set by the writer threads when a write fails, the pages of its items are then fetched again
+        self._write_failed = Event()
+
+        self.fetch_details = fetch_details
+        self.detail_url = detail_url
+        self.detail_cache_bytes = detail_cache_bytes
+        self.max_details = max_details
+        self._max_workers = max_workers
+        self._per_host = per_host
+        self._rate = rate
+        self.details: Optional[DetailWorker] = None
+        self.data_dir = data_dir if data_dir is not None else os.path.join(os.path.dirname(__file__), 'data')
+
+        # fields of every listing seen since startup, the number of changes drives the schedule
+        self._versions: Dict[int, tuple] = {}
+        self.schedule = AdaptiveSchedule(min_wait=min_wait, max_wait=max_wait, target_changes=target_changes,
+                                         jitter=jitter, profile=profile)
 
     @property
     def name(self) -> str:
@@ -57,28 +158,149 @@ class FinnActivity(ActivityABC):
 
     def startup(self) -> None:
         """Perform needed startup actions before the activity polling loop."""
-        path_to_folder = os.path.dirname(__file__)
-        db_path = os.path.join(path_to_folder, 'data', 'finn_ts.db')
-        table_path = os.path.join(path_to_folder, 'data', 'finn_table.db')
-
-        self.sql_ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT")
-        self.sql_table = SqlTable(db_path=table_path)
+        os.makedirs(self.data_dir, exist_ok=True)
+        db_path = os.path.join(self.data_dir, 'finn_ts.db')
+        table_path = os.path.join(self.data_dir, 'finn_table.db')
+
+        # WAL lets the dash apps and models read while we write, see SqlOptions
+        options = SqlOptions(journal_mode="WAL", synchronous="NORMAL")
+        if self.ts_backend_args is None and self.ts_backend == 'sqlite':
+            # asking prices rarely change, only record changes and a heartbeat written by the full walks
+            ts_backend_args = dict(db_path=db_path, category="price", sql_type="INT", options=options,
+                                   dedup=True, heartbeat=PRICE_HEARTBEAT)
+        else:
+            ts_backend_args = self.ts_backend_args if self.ts_backend_args is not None else {}
+        self.sql_ts_db = create_backend(self.ts_backend, **ts_backend_args)
+        self.sql_table = SqlTable(db_path=table_path, options=options)
         categories = {"finn_id": "INT", "address": "VARCHAR(30)", "price": "INT", "sq_m": "INT"}
-        self.sql_table.create_table(table_name="finn_info", categories=categories)
+        self.sql_table.create_table(table_name="finn_info", categories=categories, unique_key="finn_id")
+
+        # writes are queued to the shared writer thread of each database, see ap.sql_toolbox.writer
+        self.ts_writer = get_writer(self.sql_ts_db.db_path, logger=self.logger)
+        self.table_writer = get_writer(table_path, logger=self.logger)
+        if self.ts_backend == 'sqlite':
+            # daily rollups kept forever, raw prices for 90 days
+            self.rollups = RollupEngine(self.sql_ts_db)
+
+        if self.parse_workers > 0:
+            if multiprocessing.current_process().daemon:
+                self.logger.warning('Daemonic processes cannot start parse workers, parsing in the activity')
+            else:
+                self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                       mp_context=multiprocessing.get_context('spawn'))
+
+        if self.fetch_details:
+            cache = PageCache(os.path.join(self.data_dir, 'finn_details'), max_bytes=self.detail_cache_bytes)
+            fetcher = DetailFetcher(cache, fetch=self.http.fetch_always, max_workers=self._max_workers,
+                                    per_host=self._per_host, rate=self._rate, logger=self.logger)
+            self.details = DetailWorker(fetcher, max_queued=self.max_details, logger=self.logger)
+            self.details.start()
 
     def cleanup(self, started: bool, graceful: bool) -> None:
         """Perform needed cleanup actions when thread performing activity polling exits."""
         self.logger.info("Cleanup")
+        self.fetcher.close()
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=True, cancel_futures=True)
+            self._parse_pool = None
+        if self.details is not None:
+            # the queued detail pages are fetched again after the next startup, when still changed
+            self.details.stop(timeout=30.)
+            self.details.fetcher.close()
+        self.http.close()
+        for writer in (self.ts_writer, self.table_writer):
+            if writer is not None and not writer.flush(timeout=30.):
+                self.logger.warning(f'Could not flush queued writes to {writer.db_path}')
+        # the pooled connections belong to this thread, close them before it exits
+        if self.sql_ts_db is not None:
+            self.sql_ts_db.close()
+        detail_cache = self.details.fetcher.cache if self.details is not None else None
+        for sql_db in (self.sql_table, detail_cache):
+            if isinstance(sql_db, SqlDb):
+                sql_db.disconnect()
         self.logger.info('Cleanup finished')
 
+    def track_changes(self, data_set: Iterable[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], bool]]:
+        """Return the new and changed listings of data_set, each with whether it was seen before since startup."""
+        changes = []
+        for data in data_set:
+            version = (data["address"], data["price"], data["sq_m"])
+            known = self._versions.get(data["finn_id"])
+            if known != version:
+                self._versions[data["finn_id"]] = version
+                changes.append((data, known is not None))
+        return changes
+
+    def queue_details(self, changes: Iterable[Tuple[Dict[str, Any], bool]]) -> int:
+        """Queue the detail pages of the listings returned by track_changes(), returning the number dropped.
+
+        The pages are fetched by the detail worker thread, pages are dropped while its queue is full.
+        """
+        dropped = 0
+        for data, known in changes:
+            url = self.detail_url.format(finn_id=data["finn_id"])
+            # listings unknown since startup are only downloaded if not cached already
+            if not self.details.put(url, refresh=known):
+                dropped += 1
+        if dropped:
+            self.logger.warning(f'Detail queue full, skipped {dropped} detail pages')
+        return dropped
+
+    def write_listings(self, records: List[Tuple[Dict[str, Any], Tuple[bytes, int]]]) -> None:
+        """Table writer sink, confirming the fingerprint of each listing once it is written."""
+        try:
+            self.sql_table.write_many([data for data, _ in records], upsert=True)
+        except Exception:
+            self._write_failed.set()
+            raise
+        self._confirmed.extend(write for _, write in records)
+
+    def write_prices(self, records: List[Tuple[Tuple[str, int, int], Tuple[bytes, int]]]) -> None:
+        """Time series writer sink, confirming the fingerprint of each price once it is written."""
+        try:
+            self.sql_ts_db.send_many([point for point, _ in records])
+        except Exception:
+            self._write_failed.set()
+            raise
+        self._confirmed.extend(write for _, write in records)
+
+    def commit_fingerprints(self) -> int:
+        """Add the fingerprints of the items whose writes are all confirmed, returning how many were added.
+
+        Items with a failed write are not added, so they are parsed and written again.
+        """
+        if self._write_failed.is_set():
+            # unchanged pages are not parsed, fetch the pages of the failed items again
+            self._write_failed.clear()
+            self.http.forget()
+        added = 0
+        while self._confirmed:
+            write = self._confirmed.popleft()
+            if write not in self._unconfirmed:
+                continue
+            self._unconfirmed[write] -= 1
+            if self._unconfirmed[write] == 0:
+                del self._unconfirmed[write]
+                self.fingerprints.add(write[0])
+                added += 1
+        return added
+
+    def run_rollups(self, _) -> None:
+        """Writer sink running the rollup and retention pass, so it is serialised with the price writes."""
+        report = self.rollups.run()
+        self.logger.info(f'Rolled up {report.rolled_up} buckets, deleted {report.raw_deleted} raw points')
+
     def wait_for(self):
-        return 20
+        return self.schedule.next_wait()
 
-    def get_soup(self):
-        with urllib.request.urlopen('https://www.finn.no/realestate/homes/search.html?location=0.20003') as html_code:
-            read_html = html_code.read()
+    def search_page_url(self, location: str, page: int = 1) -> str:
+        return f"{self.search_url}?{urlencode({'location': location, 'page': page})}"
 
-        soup = BeautifulSoup(read_html, "html.parser")
+    def get_soup(self, location: Optional[str] = None, page: int = 1):
+        """Fetch and parse one search results page, by default the first page of the first location."""
+        location = self.locations[0] if location is None else location
+        read_html = self.http.fetch_always(self.search_page_url(location, page))
+        soup = BeautifulSoup(read_html, self.html_parser)
         return soup
 
 
@@ -99,55 +321,109 @@ class FinnActivity(ActivityABC):
         price_nok = price_nok.find("p", {"class": "t5 word-break mhn"}).get_text().split('\n')[2]
         return price_nok.split(',')[0].replace(' ', '')
 
+    def item_fragments(self, read_html: bytes) -> List[bytes]:
+        """Split a search results page into the raw html of its result items, without parsing it."""
+        return finn_parser.item_fragments(read_html, self.html_parser, self.logger)
+
+    def result_items(self, read_html: bytes) -> List[element.Tag]:
+        """Parse only the result items of a search results page, one per listing."""
+        return finn_parser.result_items(read_html, self.html_parser)
+
+    def extract_listing(self, item: element.Tag) -> Optional[Dict[str, Any]]:
+        """Extract the fields of a result item, None for listings without a single size and price."""
+        return finn_parser.extract_listing(item)
+
+    def parse_fragments(self, fragments: Iterable[bytes]) -> List[List[Dict[str, Any]]]:
+        """Parse the listings of each result item fragment, see item_fragments()."""
+        listings = []
+        for fragment in fragments:
+            fragment_listings = []
+            for item in self.result_items(fragment):
+                data_realestate = self.extract_listing(item)
+                if data_realestate is not None:
+                    fragment_listings.append(data_realestate)
+            listings.append(fragment_listings)
+        return listings
+
+    def _add_parsed(self, listings: Dict[int, Dict[str, Any]], keys: List[bytes],
+                    fragment_listings: List[List[Dict[str, Any]]]) -> None:
+        """Collect the listings parsed from the result items with fingerprints keys."""
+        for key, parsed in zip(keys, fragment_listings):
+            if not parsed:
+                # nothing to write, the item is handled
+                self.fingerprints.add(key)
+            for data_realestate in parsed:
+                # listings move between pages while we walk them, keep one of each
+                listings[data_realestate["finn_id"]] = data_realestate
+                self._listing_fingerprints[data_realestate["finn_id"]] = key
+
     def soup_alchemy(self):
-        t1 = time.time()
-        soup = self.get_soup()
-        print(f"Get soup took {time.time() - t1}")
-        data = []
-        # All realestates on one page
-        all_realestate_boxes = soup.find_all("div", class_="unit flex align-items-stretch result-item")
-
-        # TODO: asyncio for I/O
-        # TODO: get logging up
-        data = []
-        for i in all_realestate_boxes:
-
-            finn_id = i.find("a")['id']
-            address = self.get_address(i)
-            sq_m = self.get_sq_m(i)
-
-            if "-" in sq_m:
-                continue
+        """Walk every result page of every location, parsing pages while the next ones download.
 
-            price_nok = self.get_price_nok(i)
-            if "-" in price_nok:
-                # Range of sq_m ex. 45 - 60, 4-6Mill indicates to general Realestate
+        Only new and changed listings are returned: unchanged pages are not parsed, and result
+        items whose html has a known fingerprint are skipped before parsing. Every listing is
+        returned on the first call of each full walk period. The fingerprints of the returned listings are
+        added once their writes are confirmed, see commit_fingerprints().
+        """
+        t1 = time.time()
+        if t1 >= self._next_full_walk:
+            # refetch and parse every item, so unchanged prices still get their heartbeat, see PRICE_HEARTBEAT
+            self.http.forget()
+            self.fingerprints.clear()
+            self._unconfirmed.clear()
+            self._next_full_walk = t1 + FULL_WALK_PERIOD
+        self.commit_fingerprints()
+        self._listing_fingerprints = {}
+        page_urls = [partial(self.search_page_url, location) for location in self.locations]
+        listings = {}
+        pages = 0
+        unchanged = 0
+        parsed: List[Tuple[List[bytes], Future]] = []
+        for _, _, fragments in self.fetcher.walk_pages(page_urls, self.item_fragments, max_pages=self.max_pages):
+            pages += 1
+            keys = [fingerprint(fragment) for fragment in fragments]
+            changed = [(key, fragment) for key, fragment in zip(keys, fragments) if not self.fingerprints.seen(key)]
+            unchanged += len(fragments) - len(changed)
+            keys = [key for key, _ in changed]
+            fragments = [fragment for _, fragment in changed]
+            if self._parse_pool is not None:
+                # the workers parse the changed items of a page in one go, while the walk goes on
+                parsed.append((keys, self._parse_pool.submit(finn_parser.parse_fragments, fragments, self.html_parser)))
                 continue
-
-            price_nok = price_nok.replace('\xa0', '')
-            price_pr_sqm = "%.0f" % (float(price_nok) / int(sq_m))
-            # print("Description: \n%s" % i.find("h3").string)
-            data_realestate = {"finn_id": int(finn_id),
-                        "address": address,
-                        "price": int(price_nok),
-                        "sq_m": int(sq_m)}
-            data.append(data_realestate)
-
-
-        return data
+            self._add_parsed(listings, keys, self.parse_fragments(fragments))
+        for keys, future in parsed:
+            self._add_parsed(listings, keys, future.result())
+        self.logger.info(f"Fetched {len(listings)} changed listings, skipped {unchanged} unchanged, "
+                         f"from {pages} pages in {time.time() - t1:.1f} s")
+        return list(listings.values())
 
     def action(self):
 
             #self.sql_db.send_data(table_name=self.table_name_template(finn_id), data_value=price_nok)
             data_set = self.soup_alchemy()
+            # queue the page, the writers coalesce it into one transaction per database
+            scraped_at = int(time.time())
+            self._actions += 1
             for data in data_set:
-                self.sql_table.write_to_table(data)
-                self.sql_ts_db.send_data(table_name="Finn_" + str(data["finn_id"]),
-                                         data_value=data["price"])
+                # the fingerprint of the listing is added once both writes of this action are confirmed
+                write = (self._listing_fingerprints[data["finn_id"]], self._actions)
+                self._unconfirmed[write] = self._unconfirmed.get(write, 0) + 2
+                self.table_writer.submit(self.write_listings, (data, write))
+                self.ts_writer.submit(self.write_prices,
+                                      (("Finn_" + str(data["finn_id"]), data["price"], scraped_at), write))
+
+            # the full walk returns unchanged listings too, only count real changes
+            changes = self.track_changes(data_set)
+            self.schedule.record(len(changes))
+            if self.details is not None:
+                self.queue_details(changes)
+
+            if self.rollups is not None and time.time() >= self._next_rollup:
+                self.ts_writer.submit(self.run_rollups, None)
+                self._next_rollup = time.time() + DAY
 
             #JUST TO TEST WRITE CSV
-            path_to_csv = os.path.dirname(__file__)
-            path_to_csv = os.path.join(path_to_csv, 'data', 'finn_ts.csv')
+            path_to_csv = os.path.join(self.data_dir, 'finn_ts.csv')
 
             self.sql_table.write_to_csv(path=path_to_csv,table=self.sql_table.table_name)
 
@@ -0,0 +1,138 @@
+"""Parsing of finn.no search result pages.
+
+Only the result item blocks of a page are materialised: the page is parsed with a SoupStrainer
+keeping the ``result-item`` divs, so the header, scripts and ads of the page never become tree
+nodes. The fields of an item are then extracted in one walk over its tags. The backend parser
+can be chosen, ``html.parser`` ships with python while ``lxml`` is faster but optional.
+
+item_fragments() splits a page into the raw html of its items without parsing anything, so
+items can be fingerprinted and only the changed ones parsed. Pages it finds no items in are
+parsed with result_items() instead, in case the markup changed under the scan.
+"""
+
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer, element
+
+RESULT_ITEM_CLASS = "unit flex align-items-stretch result-item"
+ADDRESS_CLASS = "licorice valign-middle"
+STATS_CLASS = "t5 word-break mhn"
+
+PARSERS = ('html.parser', 'lxml')
+
+logger = logging.getLogger(__name__)
+
+
+def _class(tag: element.Tag) -> str:
+    return ' '.join(tag.get('class', ()))
+
+
+def result_items(read_html: bytes, parser: str = 'html.parser', strain: bool = True) -> List[element.Tag]:
+    """Parse a search results page into its result items, one per listing.
+
+    Args:
+        read_html: The page.
+        parser: The BeautifulSoup backend parser, see PARSERS.
+        strain: Whether to only build the result items, instead of the tree of the whole page.
+
+    Raises:
+        bs4.FeatureNotFound: If parser is not installed.
+    """
+    if not strain:
+        soup = BeautifulSoup(read_html, parser)
+        return soup.find_all("div", class_=RESULT_ITEM_CLASS)
+    soup = BeautifulSoup(read_html, parser, parse_only=SoupStrainer("div", class_=RESULT_ITEM_CLASS))
+    return [item for item in soup.contents if isinstance(item, element.Tag)]
+
+
+def extract_listing(item: element.Tag) -> Optional[Dict[str, Any]]:
+    """Extract the fields of a result item in one walk over its tags.
+
+    Returns:
+        The listing, or None for listings without a single size and price, like projects
+        listing a range of units.
+    """
+    link = address = stats = None
+    for tag in item.descendants:
+        if not isinstance(tag, element.Tag):
+            continue
+        if link is None and tag.name == 'a':
+            link = tag
+        elif address is None and tag.name == 'div' and _class(tag) == ADDRESS_CLASS:
+            address = tag
+        elif stats is None and tag.name == 'p' and _class(tag) == STATS_CLASS:
+            stats = tag
+        if link is not None and address is not None and stats is not None:
+            break
+    if link is None or stats is None:
+        return None
+
+    lines = stats.get_text().split('\n')
+    if len(lines) < 3:
+        return None
+    sq_m = lines[1].split('m')[0]
+    # Range of sq_m ex. 45 - 60, 4-6Mill indicates to general Realestate
+    if "-" in sq_m:
+        return None
+    price_nok = lines[2].split(',')[0].replace(' ', '')
+    if "-" in price_nok:
+        return None
+
+    return {"finn_id": int(link['id']),
+            # a plain str, a NavigableString drags its tree along when pickled to other processes
+            "address": str(address.string) if address is not None and address.string is not None else None,
+            "price": int(price_nok.replace('\xa0', '')),
+            "sq_m": int(sq_m)}
+
+
+def parse_listings(read_html: bytes, parser: str = 'html.parser') -> List[Dict[str, Any]]:
+    """Parse the listings of a search results page."""
+    listings = (extract_listing(item) for item in result_items(read_html, parser))
+    return [listing for listing in listings if listing is not None]
+
+
+def parse_fragments(fragments: List[bytes], parser: str = 'html.parser') -> List[List[Dict[str, Any]]]:
+    """Parse the listings of each result item fragment, see item_fragments()."""
+    return [parse_listings(fragment, parser) for fragment in fragments]
+
+
+# the class attribute may come after other attributes, and be quoted either way
+_ITEM_START = re.compile(rb'<div\s(?:[^>]*?\s)?class\s*=\s*(["\'])' + re.escape(RESULT_ITEM_CLASS.encode()) + rb'\1[^>]*>',
+                         re.IGNORECASE)
+_DIV_TAG = re.compile(rb'<(/?)div\b[^>]*>', re.IGNORECASE)
+
+
+def _item_end(read_html: bytes, start: int, end: int) -> int:
+    """Return the end of the div starting at start, or end if it is not closed before end."""
+    depth = 0
+    for match in _DIV_TAG.finditer(read_html, start, end):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            return match.end()
+    return end
+
+
+def item_fragments(read_html: bytes, parser: str = 'html.parser',
+                   fallback_logger: Optional[logging.Logger] = None) -> List[bytes]:
+    """Split a search results page into the raw html of its result items, without parsing it.
+
+    Items are found by their opening tag and end at the matching closing div. The result items
+    of a fragment are parsed with result_items(). If no item is found although the page mentions
+    the item class, the page is parsed with result_items() and each item is serialised instead.
+
+    Args:
+        read_html: The page.
+        parser: The BeautifulSoup backend parser of the fallback, see PARSERS.
+        fallback_logger: Logger warning about the fallback, the module logger if None.
+    """
+    starts = [match.start() for match in _ITEM_START.finditer(read_html)]
+    if not starts and RESULT_ITEM_CLASS.split()[-1].encode() in read_html:
+        items = result_items(read_html, parser)
+        if items:
+            (fallback_logger or logger).warning(f'Found no result items scanning the page, parsed {len(items)} '
+                                                f'with {parser} instead')
+            return [str(item).encode('utf-8') for item in items]
+    return [read_html[start:_item_end(read_html, start, end)]
+            for start, end in zip(starts, starts[1:] + [len(read_html)])]
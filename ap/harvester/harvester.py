@@ -1,15 +1,75 @@
 """Defines setup for collector activities.
+
+ActivityABC activities block the thread running them, while AsyncActivityABC activities are
+coroutines, so many of them can share the event loop of one thread, see
+ap.harvester.event_loop. Both keep their exit and error state in ActivityBase.
 """
 
-from typing import Optional, Union
+import asyncio
+from typing import Optional, Tuple, Union
 
 from abc import ABC, abstractmethod
 from logging import Logger
 from threading import Event
-from time import sleep
 
 
-class ActivityABC(ABC):
+class ActivityBase(ABC):
+    """Exit and error state shared by ActivityABC and AsyncActivityABC, see ActivityABC for the arguments."""
+
+    def __init__(self, *,
+                 wait_first: bool, wakeup_freq: Optional[float],
+                 exit_event: Event, logger: Logger) -> None:
+
+        self._wakeup_freq = wakeup_freq
+        self._wait_first = wait_first
+
+        self._external_exit_event = exit_event
+        self._logger = logger.getChild(self.name.replace(' ', '_'))
+
+        self._stored_error: Optional[Exception] = None
+        self._activity_exit_event = Event()
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Name of the activity."""
+        pass
+
+    @property
+    def logger(self) -> Logger:
+        """The activity logger."""
+        return self._logger
+
+    def exit(self) -> None:
+        """Signal the activity to exit."""
+        self._activity_exit_event.set()
+
+    def exiting(self) -> bool:
+        """Query if the activity is exiting."""
+        return self._external_exit_event.is_set() or self._activity_exit_event.is_set()
+
+    def get_error(self) -> Union[Exception, None]:
+        """Get a stored error."""
+        return self._stored_error
+
+    def _store_error(self, error: Exception) -> None:
+        """Store an exception that aborted the activity, it can be later retrieved by get_error()."""
+        self._stored_error = error
+
+    def _split_wait(self, duration: float) -> Tuple[float, float]:
+        """Split a wait of duration seconds into the part to wait now and the remainder, waking
+        up at least every self._wakeup_freq seconds."""
+        self.logger.debug(f'Should wait for {duration} s')
+        # if the wakeup frequency is less than the current wait duration, wait for the wakeup frequency instead
+        if self._wakeup_freq is not None and duration > self._wakeup_freq:
+            to_wait, duration = self._wakeup_freq, duration - self._wakeup_freq
+        else:
+            to_wait, duration = duration, 0.
+        self.logger.debug(f'Waiting for {to_wait} s')
+        return to_wait, duration
+
+
+class ActivityABC(ActivityBase):
     """Skeleton of a collector activity.
 
     Args:
@@ -22,20 +82,11 @@ class ActivityABC(ABC):
             replaced with ``_``.
     The methods startup(), cleanup(), wait_for(), and action() is only called from the thread
     executing the activity, the remaining methods may be called from multiple threads.
-    """
-
-    def __init__(self, *,
-                 wait_first: bool, wakeup_freq: Optional[float],
-                 exit_event: Event, logger: Logger) -> None:
-
-        self._wakeup_freq = wakeup_freq
-        self._wait_first = wait_first
-
-        self._external_exit_event = exit_event
-        self._logger = logger.getChild(self.name.replace(' ', '_'))
 
-        self.__stored_error: Optional[Exception] = None
-        self.__activity_exit_event = Event()
+    Waits between actions end as soon as exit() is called. The external exit event is checked
+    when a wait ends, at the latest every wakeup_freq seconds, so whoever sets it should also
+    call exit() on the activities to stop them without delay, like the CollectorMonitor does.
+    """
 
     @property
     @abstractmethod
@@ -74,43 +125,12 @@ class ActivityABC(ABC):
         """
         pass
 
-    @property
-    def logger(self) -> Logger:
-        """The activity logger."""
-        return self._logger
-
-    def exit(self) -> None:
-        """Signal the activity to exit."""
-        self.__activity_exit_event.set()
-
-    def exiting(self) -> bool:
-        """Query if the activity is exiting."""
-        return self._external_exit_event.is_set() or self.__activity_exit_event.is_set()
-
-    def get_error(self) -> Union[Exception, None]:
-        """Get a stored error."""
-        return self.__stored_error
-
-    def __store_error(self, error: Exception) -> None:
-        """Store an exception that aborted the activity, it can be later retrieved by get_error()."""
-        self.__stored_error = error
-
     def __do_wait(self, duration: float) -> float:
         """Perform the wait action, waiting either until duration or self._wakeup_freq seconds
-        have passed."""
-        # if the wakeup frequency is less than the current wait duration, wait for the wakeup frequency instead
-        # update duration to the new wait duration
-        self.logger.debug(f'Should wait for {duration} s')
-        if self._wakeup_freq is not None and duration > self._wakeup_freq:
-            to_wait = self._wakeup_freq
-            duration -= self._wakeup_freq
-        else:
-            to_wait = duration
-            duration = 0.
-
-        self.logger.debug(f'Waiting for {to_wait} s')
+        have passed, or the activity is signalled to exit."""
+        to_wait, duration = self._split_wait(duration)
         if to_wait > 0.:
-            sleep(to_wait)
+            self._activity_exit_event.wait(to_wait)
 
         # return the remainder of the wait duration
         return duration
@@ -122,7 +142,7 @@ class ActivityABC(ABC):
         graceful = False
 
         # reset the activity event
-        self.__activity_exit_event.clear()
+        self._activity_exit_event.clear()
 
         try:
             self.startup()
@@ -145,6 +165,119 @@ class ActivityABC(ABC):
             # nothing went wrong!
             graceful = True
         except Exception as e:
-            self.__store_error(error=e)
+            self._store_error(error=e)
         finally:
-            self.cleanup(started=started, graceful=graceful)
\ No newline at end of file
+            self.cleanup(started=started, graceful=graceful)
+
+
+class AsyncActivityABC(ActivityBase):
+    """Skeleton of a collector activity running on an asyncio event loop.
+
+    The asyncio counterpart of ActivityABC, taking the same arguments: startup(), wait_for(),
+    action() and cleanup() are coroutines, and run() is the coroutine running the activity.
+    Many activities can share one event loop, so they must not block it; blocking calls belong
+    in an executor, see asyncio.to_thread().
+
+    Calling the activity runs it on a new event loop in the calling thread, so it can also run
+    in a thread or process of its own. The methods exit(), exiting() and get_error() may be
+    called from any thread, and waits between actions end as soon as exit() is called.
+    """
+
+    def __init__(self, *,
+                 wait_first: bool, wakeup_freq: Optional[float],
+                 exit_event: Event, logger: Logger) -> None:
+        super().__init__(wait_first=wait_first, wakeup_freq=wakeup_freq, exit_event=exit_event, logger=logger)
+        # loop running the activity and the event ending its waits, set while it runs
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__wakeup: Optional[asyncio.Event] = None
+
+    @abstractmethod
+    async def startup(self) -> None:
+        """Perform startup actions needed before the activity polling loop."""
+        pass
+
+    @abstractmethod
+    async def wait_for(self) -> float:
+        """Return the seconds (or fractions thereof) to wait until performing action() again.
+        See ActivityABC.wait_for().
+        """
+        pass
+
+    @abstractmethod
+    async def action(self) -> None:
+        """Perform the actions this activity is intended for."""
+        pass
+
+    @abstractmethod
+    async def cleanup(self, started: bool, graceful: bool) -> None:
+        """Perform cleanup actions needed before the activity exits. See ActivityABC.cleanup()."""
+        pass
+
+    def exit(self) -> None:
+        """Signal the activity to exit."""
+        super().exit()
+        loop, wakeup = self.__loop, self.__wakeup
+        if loop is not None and wakeup is not None:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass  # the loop is closed, the activity is done
+
+    async def __do_wait(self, duration: float) -> float:
+        """Perform the wait action, waiting either until duration or self._wakeup_freq seconds
+        have passed, or the activity is signalled to exit."""
+        to_wait, duration = self._split_wait(duration)
+        if to_wait > 0.:
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), to_wait)
+            except asyncio.TimeoutError:
+                pass
+
+        # return the remainder of the wait duration
+        return duration
+
+    async def run(self) -> None:
+        """Run the activity on the running event loop, returning once the activity exits.
+        The activity is run once, as exit() calls made before it starts are kept.
+        """
+        # state
+        started = False
+        graceful = False
+
+        self.__loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
+        if self._activity_exit_event.is_set():
+            self.__wakeup.set()
+
+        try:
+            await self.startup()
+            started = True
+
+            # wait before the first action()?
+            if self._wait_first:
+                wait_for = await self.wait_for()
+            else:
+                wait_for = 0.
+
+            while not self.exiting():
+                # do the action if the wait is over
+                if wait_for == 0.:
+                    await self.action()  # do the intended action of the activity
+                    wait_for = await self.wait_for()  # get next wait duration
+                else:
+                    wait_for = await self.__do_wait(wait_for)
+
+            # nothing went wrong!
+            graceful = True
+        except Exception as e:
+            self._store_error(error=e)
+        finally:
+            try:
+                await self.cleanup(started=started, graceful=graceful)
+            finally:
+                self.__loop = None
+                self.__wakeup = None
+
+    def __call__(self) -> None:
+        """Run the activity on a new event loop in the calling thread, until the activity exits."""
+        asyncio.run(self.run())
@@ -0,0 +1,217 @@
+"""Reusable http client for the harvesters.
+
+HttpClient keeps connections alive and pools them per host, asks for gzip or deflate compressed
+bodies, and revalidates pages it has fetched before with ``If-None-Match`` and
+``If-Modified-Since``. A page that has not changed since it was last fetched comes back as not
+modified, without a body, so the caller can skip parsing it.
+"""
+
+import gzip
+import http.client
+import logging
+import threading
+import zlib
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+# Response of HttpClient.get(), body is None when not_modified
+HttpResponse = namedtuple('HttpResponse', ['url', 'status', 'headers', 'body', 'not_modified'])
+
+# ETag and Last-Modified headers of the last successful response for a url
+_Validators = namedtuple('_Validators', ['etag', 'last_modified'])
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class HttpError(RuntimeError):
+    """Error raised for responses with an unexpected status."""
+
+    def __init__(self, url: str, status: int, reason: str = '') -> None:
+        super().__init__(f'Got {status} {reason} fetching {url}')
+        self.url = url
+        self.status = status
+
+
+def decode_body(body: bytes, encoding: Optional[str]) -> bytes:
+    """Decompress a body sent with the Content-Encoding encoding."""
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    if encoding == 'identity':
+        return body
+    raise ValueError(f'Unsupported content encoding {encoding}')
+
+
+class HttpClient:
+    """Keep-alive http client with compression and conditional requests, safe to share between threads.
+
+    Args:
+        timeout: Socket timeout in seconds.
+        max_idle: Maximum number of idle connections kept per host.
+        max_redirects: Maximum number of redirects followed per request.
+        user_agent: User-Agent header sent with every request.
+        logger: Parent logger. When None, a logger named after the class is used.
+    """
+
+    def __init__(self, *, timeout: float = 30., max_idle: int = 4, max_redirects: int = 5,
+                 user_agent: str = 'ap-harvester/1.0', logger: Optional[logging.Logger] = None) -> None:
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        self.user_agent = user_agent
+
+        if logger is None:
+            self._logger = logging.getLogger(HttpClient.__name__)
+        else:
+            self._logger = logger.getChild(HttpClient.__name__)
+
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._validators: Dict[str, _Validators] = {}
+
+    def _acquire(self, scheme: str, host: str) -> Tuple[http.client.HTTPConnection, bool]:
+        """Return an idle connection to host, or a new one, and whether it was reused."""
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout), False
+        if scheme == 'http':
+            return http.client.HTTPConnection(host, timeout=self.timeout), False
+        raise ValueError(f'Unsupported url scheme {scheme}')
+
+    def _release(self, scheme: str, host: str, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def forget(self, url: Optional[str] = None) -> None:
+        """Drop the stored validators of url, or of every url, so the next get() is unconditional."""
+        with self._lock:
+            if url is None:
+                self._validators.clear()
+            else:
+                self._validators.pop(url, None)
+
+    def _request(self, url: str, headers: Dict[str, str]) -> Tuple[int, str, http.client.HTTPMessage, bytes]:
+        """Send one GET request over a pooled connection, retrying once if a reused connection went stale."""
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        while True:
+            connection, reused = self._acquire(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(parts.scheme, parts.netloc, connection)
+            return response.status, response.reason, response.headers, body
+
+    def get(self, url: str, *, conditional: bool = True, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        """GET url, following redirects.
+
+        Args:
+            url: The url to fetch.
+            conditional: Whether to revalidate with the validators of the last response for url.
+                The validators of successful responses are stored either way.
+            headers: Extra request headers.
+
+        Raises:
+            HttpError: If the final response is not 200 or, for conditional requests, 304.
+        """
+        request_headers = {'User-Agent': self.user_agent, 'Accept-Encoding': 'gzip, deflate'}
+        if headers:
+            request_headers.update(headers)
+        if conditional:
+            with self._lock:
+                validators = self._validators.get(url)
+            if validators is not None:
+                if validators.etag:
+                    request_headers['If-None-Match'] = validators.etag
+                if validators.last_modified:
+                    request_headers['If-Modified-Since'] = validators.last_modified
+
+        location = url
+        for _ in range(self.max_redirects + 1):
+            status, reason, response_headers, body = self._request(location, request_headers)
+            if status not in REDIRECTS or 'Location' not in response_headers:
+                break
+            location = urljoin(location, response_headers['Location'])
+        else:
+            raise HttpError(url, status, 'too many redirects')
+
+        if status == 304 and conditional:
+            self._logger.debug(f'{url} not modified')
+            return HttpResponse(url=location, status=status, headers=response_headers, body=None, not_modified=True)
+        if status != 200:
+            raise HttpError(location, status, reason)
+
+        etag, last_modified = response_headers.get('ETag'), response_headers.get('Last-Modified')
+        with self._lock:
+            if etag or last_modified:
+                self._validators[url] = _Validators(etag=etag, last_modified=last_modified)
+            else:
+                self._validators.pop(url, None)
+        body = decode_body(body, response_headers.get('Content-Encoding'))
+        return HttpResponse(url=location, status=status, headers=response_headers, body=body, not_modified=False)
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        """Conditionally GET url, returning its body, or None if it has not changed since the last fetch."""
+        return self.get(url).body
+
+    def fetch_always(self, url: str) -> bytes:
+        """Unconditionally GET url, returning its body."""
+        return self.get(url, conditional=False).body
+
+
+_default_client: Optional[HttpClient] = None
+_default_client_lock = threading.Lock()
+
+
+def default_client() -> HttpClient:
+    """Return the http client shared by the harvesters, creating it if needed."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
+
+def set_default_client(client: Optional[HttpClient]) -> None:
+    """Replace the shared http client, e.g. with an ap.harvester.replay client. None restores a plain HttpClient."""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
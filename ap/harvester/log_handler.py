@@ -20,6 +20,10 @@ class ActivityFilter(logging.Filter):
         # print(self.name)
         if record.name in ActivityFilter.LOGGERS:
             return True
+        # activities of named collector instances log to CollectorManager.<instance id>.<activity>
+        if any(record.name.startswith(name.split('.')[0] + '.') and record.name.endswith('.' + name.split('.')[-1])
+               for name in ActivityFilter.LOGGERS):
+            return True
         if record.name not in ActivityFilter.LOGGERS and record.levelname != "INFO":
             return True
 
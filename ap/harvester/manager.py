@@ -1,9 +1,28 @@
 """Collector service for polling data sources and persisting new data to a DTSS server.
+
+Activities run in threads of the monitoring process by default. With ExecutionMode.PROCESS
+each activity instead runs in its own child process, so CPU bound parsing in several
+activities is not serialised on the GIL. The monitor then signals exits through a pipe per
+activity, the error an activity stopped with is sent back to the
+monitor, and dead activities are restarted like threads are.
+
+Nothing waits by polling alone: activities wait between actions on their exit events, and the
+monitor sleeps until a collector is added, dropped or restarted, an activity dies or the exit
+event is set, so requests take effect within milliseconds. The poll frequency only bounds how
+long the monitor sleeps without any of these.
+
+AsyncActivityABC activities are run as tasks of one event loop thread of the monitor, see
+ap.harvester.event_loop, under the same restart and exit semantics. In process mode each of
+them runs on an event loop of its own process instead.
 """
 
-from typing import Any, Deque, Dict, List, Optional, Union
+from typing import Any, Deque, Dict, List, Optional, Tuple, Type, Union
 
 import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
+import signal
 from collections import deque, namedtuple
 from copy import copy
 from enum import Enum
@@ -12,9 +31,11 @@ from threading import Event, Thread
 from time import sleep
 
 
+from ap.harvester.harvester import ActivityABC, AsyncActivityABC
+from ap.harvester.event_loop import ActivityTask, EventLoopRunner
 from ap.harvester.finn_activity import FinnActivity
 
-CollectorTuple = namedtuple('CollectorTuple', ['collector', 'thread', 'activity', 'args'])
+CollectorTuple = namedtuple('CollectorTuple', ['collector', 'thread', 'activity', 'args', 'instance_id'])
 
 
 class CollectorError(RuntimeError):
@@ -26,12 +47,148 @@ class Collectors(Enum):
     """Enumeration of known collector instances."""
     FINN_REALESTATE = FinnActivity
 
+
+class ExecutionMode(Enum):
+    """How the monitor runs collector activities."""
+    THREAD = 'thread'  # one thread per activity in the monitoring process
+    PROCESS = 'process'  # one child process per activity
+
+
+# a known collector, or any activity class taking the ActivityABC keyword arguments
+CollectorType = Union[Collectors, Type[ActivityABC], Type[AsyncActivityABC]]
+
+
+def collector_name(collector: CollectorType) -> str:
+    """Name of a collector type, the default instance id of a collector."""
+    return collector.name if isinstance(collector, Collectors) else collector.__name__
+
+
+def _instance_id(instance: Union[str, CollectorType]) -> str:
+    """Instance id of an instance id, or of the default instance of a collector type."""
+    return instance if isinstance(instance, str) else collector_name(instance)
+
+def _forward_exit(exit_reader, exit_event: Event, activity: Union[ActivityABC, AsyncActivityABC]) -> None:
+    """Signal activity to exit once the monitor writes to exit_reader, or the monitoring process dies."""
+    exit_reader.poll(None)
+    exit_event.set()
+    activity.exit()
+
+
+class _ForwardHandler(logging.Handler):
+    """Handler of the monitoring process, passing records of child processes to the logger they were logged with."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def _run_activity_process(activity_type: Type[Union[ActivityABC, AsyncActivityABC]], args: Dict[str, Any], exit_reader,
+                          logger_name: str, log_level: int, log_queue, error_writer) -> None:
+    """Create and run an activity in a child process, sending the error it stopped with to error_writer."""
+    # the monitoring process decides when activities exit, also on keyboard interrupts
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # spawned processes start without handlers, send every record to the monitoring process instead
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(log_level)
+    exit_event = Event()
+    try:
+        activity = activity_type(**args, exit_event=exit_event, logger=logging.getLogger(logger_name))
+        Thread(target=_forward_exit, args=(exit_reader, exit_event, activity), daemon=True).start()
+        activity()
+        error = activity.get_error()
+    except Exception as e:
+        error = e
+    if error is not None:
+        try:
+            error_writer.send(error)
+        except Exception:
+            # the error could not be pickled, send its description instead
+            error_writer.send(RuntimeError(f'{type(error).__name__}: {error}'))
+
+
+class ProcessActivity:
+    """Handle of a collector activity running in a child process.
+
+    The activity is created in the child from its type and arguments, which must be picklable.
+    The handle stands in for the activity in the monitor: exit(), exiting() and get_error()
+    behave like those of ActivityABC, while the process in process replaces the thread.
+    Exits and errors are sent through pipes rather than multiprocessing events, which can
+    deadlock once a process dies waiting on them, and the activity also exits when the
+    monitoring process dies. Start the process with start(), and release the pipes with
+    close() once it has exited.
+    Args:
+        activity_type: The activity class.
+        args: The arguments to create the activity with, apart from exit_event and logger.
+        name: Name of the process.
+        exit_event: Event of the monitoring process signalling every activity to exit.
+        logger: The activity logger is created in the child with the name and level of logger.
+        log_queue: Queue the child sends its log records to, see _ForwardHandler.
+        context: The multiprocessing context to create the process with.
+    """
+
+    def __init__(self, activity_type: Type[Union[ActivityABC, AsyncActivityABC]], args: Dict[str, Any], *, name: str,
+                 exit_event: Event, logger: logging.Logger, log_queue, context) -> None:
+        self.name = activity_type.__name__
+        self._external_exit_event = exit_event
+        self._activity_exit_event = Event()
+        self._exit_reader, self._exit_writer = context.Pipe(duplex=False)
+        self._error_reader, self._error_writer = context.Pipe(duplex=False)
+        self._stored_error: Optional[Exception] = None
+        self.process = context.Process(
+            name=name, target=_run_activity_process, daemon=True,
+            args=(activity_type, args, self._exit_reader, logger.name, logger.getEffectiveLevel(),
+                  log_queue, self._error_writer),
+        )
+
+    def start(self) -> None:
+        """Start the process, then close the pipe ends of the child in this process."""
+        try:
+            self.process.start()
+        finally:
+            self._exit_reader.close()
+            # with the only writer in the child, reading errors ends at EOF once it exits
+            self._error_writer.close()
+
+    def close(self) -> None:
+        """Release the pipes of an exited process, keeping the error it stopped with."""
+        self.process.join()
+        self.get_error()
+        self._exit_writer.close()
+        self._error_reader.close()
+
+    def exit(self) -> None:
+        """Signal the activity to exit."""
+        if not self._activity_exit_event.is_set():
+            self._activity_exit_event.set()
+            try:
+                self._exit_writer.send_bytes(b'exit')
+            except OSError:
+                pass  # the process is gone
+
+    def exiting(self) -> bool:
+        """Query if the activity is exiting."""
+        return self._external_exit_event.is_set() or self._activity_exit_event.is_set()
+
+    def get_error(self) -> Union[Exception, None]:
+        """Get the error the activity stopped with, available once the process has exited."""
+        if self._stored_error is None and not self._error_reader.closed and self._error_reader.poll():
+            try:
+                self._stored_error = self._error_reader.recv()
+            except EOFError:
+                pass  # exited without an error
+        return self._stored_error
+
+
 class CollectorManager:
     """Manager for controlling collector activities.
+
+    Every started activity is a collector instance, identified by an instance id. Several
+    instances of the same collector type can run side by side, each with its own arguments,
+    e.g. one FinnActivity per location.
     Args:
         collectors: Dictionary of collectors to start together with the arguments needed
-            to start each collector. The argument dictionaries are copied as arguments may
-            be added by the manager.
+            to start each collector, one instance each with the collector name as instance id.
+            The argument dictionaries are copied as arguments may be added by the manager.
             The arguments below will be automatically added using the defaults passed
             to CollectorManager:
              * ``wait_first``: Wait before first execution of the activity.
@@ -41,6 +198,10 @@ class CollectorManager:
              * ``logger``: Collector activity parent logger instance.
             The collector activities are initialized in kwargs style using the appropriate
             value dictionary. If a collector doesn't take arguments, use an empty dictionary.
+        instances: Dictionary from instance id to the collector type and arguments of more
+            collector instances to start, with arguments handled like for collectors.
+        mode: Whether to run the activities in threads or child processes. In process mode the
+            collector arguments must be picklable.
         monitor_poll_freq: Frequency in seconds or fractions thereof for the monitor to perform
             its activities.
         default_wait_first: Whether to wait before the first call to action.
@@ -50,27 +211,26 @@ class CollectorManager:
             the class. When None, the manager creates a new logger named after the class.
     """
     def __init__(self, *,
-                 collectors: Dict[Collectors, Dict[str, Any]],
+                 collectors: Dict[CollectorType, Dict[str, Any]],
                  monitor_poll_freq: float,
                  default_wait_first: bool,
                  default_wakeup_freq: Union[float, None],
-                 logger: Union[logging.Logger, None]) -> None:
+                 logger: Union[logging.Logger, None],
+                 instances: Optional[Dict[str, Tuple[CollectorType, Dict[str, Any]]]] = None,
+                 mode: ExecutionMode = ExecutionMode.THREAD) -> None:
+
+        self._mode = mode
+        self._default_wait_first = default_wait_first
+        self._default_wakeup_freq = default_wakeup_freq
 
-        # collectors to start with arguments
-        # - only copy arguments
-        self._collector_args = {}
+        # collector instances to start with arguments, by instance id
+        self._collector_args: Dict[str, Tuple[CollectorType, Dict[str, Any]]] = {}
         for c in collectors:
-            local_args = self._collector_args[c] = copy(collectors[c])
-            # add if missing
-            if 'wait_first' not in local_args:
-                local_args['wait_first'] = default_wait_first
-            if 'wakeup_freq' not in local_args:
-                local_args['wakeup_freq'] = default_wakeup_freq
-            # remove if present
-            if 'exit_event' in local_args:
-                del local_args['exit_event']
-            if 'logger' in local_args:
-                del local_args['logger']
+            self._collector_args[collector_name(c)] = (c, self._instance_args(collectors[c]))
+        for instance_id, (c, args) in (instances or {}).items():
+            if instance_id in self._collector_args:
+                raise ValueError(f'Collector instance {instance_id} given twice')
+            self._collector_args[instance_id] = (c, self._instance_args(args))
 
         # logging
         if logger is None:
@@ -84,6 +244,21 @@ class CollectorManager:
         self._monitor = None
         self._monitor_thread = None
 
+    def _instance_args(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy collector arguments, adding the manager defaults and removing the arguments set by the monitor."""
+        local_args = copy(args)
+        # add if missing
+        if 'wait_first' not in local_args:
+            local_args['wait_first'] = self._default_wait_first
+        if 'wakeup_freq' not in local_args:
+            local_args['wakeup_freq'] = self._default_wakeup_freq
+        # remove if present
+        if 'exit_event' in local_args:
+            del local_args['exit_event']
+        if 'logger' in local_args:
+            del local_args['logger']
+        return local_args
+
     def get_logger(self) -> logging.Logger:
         """Return the logger used by the manager."""
         return self._logger
@@ -104,23 +279,42 @@ class CollectorManager:
         # start monitor
         self._monitor = CollectorMonitor(
             poll_freq=self._monitor_poll_freq,
-            exit_event=self._exit_event, logger=self._logger,
+            exit_event=self._exit_event, logger=self._logger, mode=self._mode,
         )
         self._monitor_thread = Thread(name=f'{CollectorMonitor.__name__}', target=self._monitor, daemon=True)
         self._monitor_thread.start()
 
         # start all currently registered collectors
-        for collector, args in self._collector_args.items():
-            self._monitor.add_collector(collector=collector, args=args)
+        for instance_id, (collector, args) in self._collector_args.items():
+            self._monitor.add_collector(collector=collector, args=args, instance_id=instance_id)
 
-    def is_running(self, *, collector: Optional[Collectors] = None) -> bool:
+    def add_instance(self, instance_id: str, collector: CollectorType, args: Dict[str, Any]) -> None:
+        """Register and, if the manager is running, start a new collector instance.
+        Raises:
+            ValueError: If an instance with the same id is already registered.
+        """
+        if instance_id in self._collector_args:
+            raise ValueError(f'Collector instance {instance_id} already registered')
+        self._collector_args[instance_id] = (collector, self._instance_args(args))
+        if self.is_running():
+            self._monitor.add_collector(collector=collector, args=self._collector_args[instance_id][1],
+                                        instance_id=instance_id)
+
+    def instances(self) -> List[str]:
+        """Return the ids of the registered collector instances."""
+        return list(self._collector_args)
+
+    def is_running(self, *, collector: Optional[CollectorType] = None, instance_id: Optional[str] = None) -> bool:
         """Query if either the manager or specific collector activities are running.
         Args:
-            collector: Optional collector to check for. If None check if the manager is
-                running. Defaults to None.
+            collector: Optional collector type to check for, running if any instance of it
+                is running. If None check if the manager is running. Defaults to None.
+            instance_id: Optional collector instance to check for, takes precedence over collector.
         """
+        if instance_id is not None:
+            return self._monitor is not None and self._monitor.is_collector_running(instance_id)
         if collector is not None:
-            return self._monitor is not None and self._monitor.is_collector_running(collector)
+            return self._monitor is not None and collector in self._monitor.running_collectors()
         return self._monitor_thread is not None and self._monitor_thread.is_alive()
 
     def block_on_monitor(self, *, timeout: float = None) -> None:
@@ -138,24 +332,41 @@ class CollectorManager:
 
         self._monitor_thread.join(timeout=timeout)
 
-    def exit(self, *, collector: Optional[Collectors]=None) -> None:
-        """Signal the manager or specific collector to exit, then return.
+    def exit(self, *, collector: Optional[CollectorType]=None, instance_id: Optional[str] = None) -> None:
+        """Signal the manager, a specific collector or a collector instance to exit, then return.
+        Exited collector instances are deregistered, and not started again by start().
         This method is non-blocking. If you wish to wait for the background
         threads to exit follow with a call to block_on_monitor().
         Args:
             collector: Optional collector managed by this manager to exit.
-                If this argument is not None only the specified collector will
-                exit instead of all. The default value is None.
+                If this argument is not None only the instances of the specified collector
+                will exit instead of all. The default value is None.
+            instance_id: Optional collector instance to exit, takes precedence over collector.
         Raises:
             CollectorError: If no collector activities are running.
         """
-        if not self.is_running(collector=collector):
+        if not self.is_running(collector=collector, instance_id=instance_id):
             raise CollectorError('Not running')
 
-        if collector is None:
+        if instance_id is not None:
+            self._monitor.drop_collector(instance_id)
+            self._collector_args.pop(instance_id, None)
+        elif collector is None:
             self._exit_event.set()
+            self._monitor.wakeup()
         else:
-            self._monitor.drop_collector(collector=collector)
+            for running_id in self._monitor.running_instances(collector):
+                self._monitor.drop_collector(running_id)
+                self._collector_args.pop(running_id, None)
+
+    def restart(self, instance_id: str) -> None:
+        """Signal a collector instance to exit, and start it again with the same arguments once it has.
+        Raises:
+            CollectorError: If the collector instance is not running.
+        """
+        if not self.is_running(instance_id=instance_id):
+            raise CollectorError('Not running')
+        self._monitor.restart_collector(instance_id)
 
 
 class CollectorMonitor:
@@ -163,39 +374,56 @@ class CollectorMonitor:
     The monitor regularly polls all threads registered with it, and recreate and restart them
     if necessary. If managed threads error out the error and traceback is logged to
     the provided logger.
+    Collector activities are registered by instance id, so several instances of the same
+    collector type can be monitored, restarted and dropped independently. Methods taking an
+    instance also accept a collector type for its default instance, the one with the collector
+    name as instance id.
     Note:
         The external interface for modifying the monitor is _NOT_ necessarily thread-safe.
         Only one thread should use the methods add_collector(), drop_collector(),
-        is_collector_running(), running_collectors(), died_collectors().
-        Additionally, they are never used from the manager.
+        restart_collector(), is_collector_running(), running_collectors(), died_collectors(),
+        running_instances() and died_instances().
     Args:
-        poll_freq: Frequency in seconds or fractions thereof to poll activities and check
-            for new activities to start or drop.
+        poll_freq: Maximum seconds or fractions thereof between polls of the activities. The
+            monitor also wakes up when requested, see the module documentation.
         exit_event: External event to set to signal the monitor and the activities to exit.
         logger: Parent logger object. The monitor requests a child logger with getChild(),
             and the logger is also passed on to started activities.
+        mode: Whether to run the activities in threads or child processes, see ProcessActivity.
     """
     def __init__(self, *,
                  poll_freq: float,
-                 exit_event: Event, logger: logging.Logger) -> None:
+                 exit_event: Event, logger: logging.Logger,
+                 mode: ExecutionMode = ExecutionMode.THREAD) -> None:
         # monitor arguments
         assert poll_freq > 0, f'{CollectorMonitor.__name__} should use a strictly positive poll frequency'
         self._poll_freq = poll_freq
+        self._mode = mode
+        # forking the threads of this process is unsafe, child processes start a fresh interpreter
+        self._context = multiprocessing.get_context('spawn') if mode is ExecutionMode.PROCESS else None
+        # records logged in child processes, handled by the loggers of this process
+        self._log_queue = self._context.Queue() if mode is ExecutionMode.PROCESS else None
+        self._log_listener = logging.handlers.QueueListener(self._log_queue, _ForwardHandler()) \
+            if mode is ExecutionMode.PROCESS else None
 
         # activity common arguments
         self._exit_event = exit_event
+        self._event_loop: Optional[EventLoopRunner] = None  # shared by async activities, started on demand
+        self._wakeup_event = Event()  # set to run a monitoring step without waiting for the poll
 
         # loggers
         self._parent_logger = logger  # logger to pass to activities
         self._logger: logging.Logger = logger.getChild(CollectorMonitor.__name__)
 
-        # monitor state
-        self._collectors: Dict[Collectors, CollectorTuple] = {}
-        self._to_drop_queue: Deque[Collectors] = deque()  # queue of collector to remove once exited
-        self._register_queue = Queue()  # element type: Tuple[Collector, Dict[str, Any]]
-        self._deregister_queue = Queue()  # element type: Collector
+        # monitor state, by instance id
+        self._collectors: Dict[str, CollectorTuple] = {}
+        self._to_drop_queue: Deque[str] = deque()  # queue of collector to remove once exited
+        self._to_restart = set()  # dropped collectors to start again once exited
+        self._register_queue = Queue()  # element type: Tuple[CollectorType, Dict[str, Any], str]
+        self._deregister_queue = Queue()  # element type: Tuple[str, bool], instance id and restart
 
-    def add_collector(self, *, collector: Collectors, args: Dict[str, Any]) -> None:
+    def add_collector(self, *, collector: CollectorType, args: Dict[str, Any],
+                      instance_id: Optional[str] = None) -> None:
         """Register a collector activity in the monitor.
         This method queues the collector to be started. The collector is started from the thread
         running the monitor. Until the activity is removed by a call to drop_collector(),
@@ -203,6 +431,7 @@ class CollectorMonitor:
         Args:
             collector: The collector type to register.
             args: The arguments to start the collector activity with.
+            instance_id: Id of the collector instance, defaults to the collector name.
         Note:
             The external interface to the monitor can only see a collector once it is started.
             Therefore it is possible to add the same collector multiple times if the monitor
@@ -211,19 +440,21 @@ class CollectorMonitor:
             and the duplicate collector is left unstarted and dropped.
             Thus it is advisable to take care not to add duplicate collectors.
         Raises:
-            ValueError: If a collector with the same type is already registered and started.
+            ValueError: If a collector with the same instance id is already registered and started.
                 See the above note.
         """
-        if collector in self._collectors:
+        instance_id = instance_id if instance_id is not None else collector_name(collector)
+        if instance_id in self._collectors:
             # TODO consider more robust _collector check
             #      This is safe because of the GIL and that we are using threads
-            raise ValueError(f'Collector {collector.name} already registered')
-        self._register_queue.put((collector, args))
+            raise ValueError(f'Collector {instance_id} already registered')
+        self._register_queue.put((collector, args, instance_id))
+        self.wakeup()
 
-    def drop_collector(self, collector: Collectors) -> None:
+    def drop_collector(self, collector: Union[str, CollectorType]) -> None:
         """De-register a started collector from the monitor.
         Args:
-            collector: The collector to deregister.
+            collector: The collector instance id, or collector type of the default instance, to deregister.
         Note:
             The external interface to the monitor can only see a collector once it is started.
             Therefore it is possible that drop_collector() raises ValueError even though
@@ -233,47 +464,95 @@ class CollectorMonitor:
             ValueError: If no such collector have been registered _and_ started.
                 See the above note.
         """
-        if collector not in self._collectors:
+        instance_id = _instance_id(collector)
+        if instance_id not in self._collectors:
             # TODO consider more robust _collector check
             #      This is safe because of the GIL and that we are using threads
-            raise ValueError(f'Collector {collector.name} is not registered')
-        self._deregister_queue.put(collector)
+            raise ValueError(f'Collector {instance_id} is not registered')
+        self._deregister_queue.put((instance_id, False))
+        self.wakeup()
 
-    def is_collector_running(self, collector: Collectors) -> bool:
-        """Query if a specific collector is running."""
+    def restart_collector(self, collector: Union[str, CollectorType]) -> None:
+        """Signal a started collector to exit, and start it again with the same arguments once it has.
+        Raises:
+            ValueError: If no such collector have been registered _and_ started.
+        """
+        instance_id = _instance_id(collector)
+        if instance_id not in self._collectors:
+            raise ValueError(f'Collector {instance_id} is not registered')
+        self._deregister_queue.put((instance_id, True))
+        self.wakeup()
+
+    def is_collector_running(self, collector: Union[str, CollectorType]) -> bool:
+        """Query if a specific collector instance is running."""
         # TODO consider more robust _collector check
         #      This is safe because of the GIL and that we are using threads
-        return collector in self._collectors and self._collectors[collector].thread.is_alive()
+        instance_id = _instance_id(collector)
+        collector_tup = self._collectors.get(instance_id)
+        return collector_tup is not None and collector_tup.thread.is_alive()
 
-    def running_collectors(self) -> List[Collectors]:
-        """Return a list of the running collector types."""
+    def running_instances(self, collector: Optional[CollectorType] = None) -> List[str]:
+        """Return the ids of the running collector instances, optionally only those of a collector type."""
         # TODO consider more robust _collector retrieval
         #      This is safe because of the GIL and that we are using threads
-        return list(collector
-                    for collector in self._collectors
-                    if self._collectors[collector].thread.is_alive())
+        return list(instance_id
+                    for instance_id, collector_tup in list(self._collectors.items())
+                    if collector_tup.thread.is_alive() and collector in (None, collector_tup.collector))
 
-    def died_collectors(self) -> List[Collectors]:
+    def died_instances(self) -> List[str]:
+        """Return the ids of the collector instances that are not running, yet still registered."""
+        return list(instance_id
+                    for instance_id, collector_tup in list(self._collectors.items())
+                    if not collector_tup.thread.is_alive())
+
+    def running_collectors(self) -> List[CollectorType]:
+        """Return a list of the running collector types."""
+        collectors = []
+        for instance_id in self.running_instances():
+            collector = self._collectors[instance_id].collector
+            if collector not in collectors:
+                collectors.append(collector)
+        return collectors
+
+    def died_collectors(self) -> List[CollectorType]:
         """Return a list of collector types that is not running, yet still registered."""
-        # TODO consider more robust _collector retrieval
-        #      This is safe because of the GIL and that we are using threads
-        return list(collector
-                    for collector in self._collectors
-                    if not self._collectors[collector].thread.is_alive())
+        collectors = []
+        for instance_id in self.died_instances():
+            collector = self._collectors[instance_id].collector
+            if collector not in collectors:
+                collectors.append(collector)
+        return collectors
+
+    def wakeup(self) -> None:
+        """Make the monitor perform a monitoring step now, e.g. after setting the exit event."""
+        self._wakeup_event.set()
 
     def __call__(self) -> None:
         """Monitor execution loop."""
         self._exit_event.clear()  # reset
+        if self._log_listener is not None:
+            self._log_listener.start()
         while not self._should_exit():
+            # requests arriving during the step wake up the next wait at once
+            self._wakeup_event.clear()
             self._logger.info('Performing activity monitoring')
             self._monitoring_step()
-            sleep(self._poll_freq)
+            self._wakeup_event.wait(self._poll_freq)
+
+        if self._event_loop is not None:
+            self._event_loop.stop()
+            self._event_loop = None
+        if self._log_listener is not None:
+            self._log_listener.stop()
 
         self._logger.info(f'Monitor exiting')
 
     def _should_exit(self) -> bool:
         """Determines if the monitor should exit."""
         if self._exit_event.is_set():
+            # signal each activity, ending their waits and reaching child processes
+            for collector_tup in self._collectors.values():
+                collector_tup.activity.exit()
             if len(self._collectors) > 0:
                 self._logger.warning('Waiting for collectors to exit')
             else:
@@ -284,15 +563,15 @@ class CollectorMonitor:
         """Perform the monitoring tasks."""
         # if there are collectors waiting to start -> start them
         while not self._register_queue.empty():
-            collector, args = self._register_queue.get()
-            self._start_collector(collector, args)
+            collector, args, instance_id = self._register_queue.get()
+            self._start_collector(collector, args, instance_id)
 
         sleep(0.)  # force synchronization and context switch
 
         # if there are collectors that are requested to exit -> signal them to exit
         while not self._deregister_queue.empty():
-            collector = self._deregister_queue.get()
-            self._drop_collector(collector)
+            instance_id, restart = self._deregister_queue.get()
+            self._drop_collector(instance_id, restart=restart)
 
         sleep(0.)  # force synchronization and context switch
 
@@ -306,79 +585,139 @@ class CollectorMonitor:
         sleep(0.)  # force synchronization and context switch
 
         # poll each collector and check check if they are alive
-        for collector in self._collectors:
-            self._poll_collector(collector)
+        for instance_id in list(self._collectors):
+            self._poll_collector(instance_id)
 
-    def _start_collector(self, collector: Collectors, args: Dict[str, Any], *, restart: bool=False) -> None:
-        """Start and register a collector in the monitor."""
+    def _start_collector(self, collector: CollectorType, args: Dict[str, Any], instance_id: str, *,
+                         restart: bool=False) -> None:
+        """Start and register a collector instance in the monitor."""
         if not restart:
-            self._logger.info(f'Starting collector activity: {collector.name}')
+            self._logger.info(f'Starting collector activity: {instance_id}')
         else:
-            self._logger.info(f'Restarting collector activity: {collector.name}')
+            self._logger.info(f'Restarting collector activity: {instance_id}')
 
         # only start a collector once!
-        if not restart and collector in self._collectors:
-            self._logger.error(f'Trying to start collector {collector.name}, but it is already started')
+        if not restart and instance_id in self._collectors:
+            self._logger.error(f'Trying to start collector {instance_id}, but it is already started')
             return
-        elif restart and collector not in self._collectors:
-            self._logger.error(f'Trying to restart collector {collector.name}, but it is not already registered')
+        elif restart and instance_id not in self._collectors:
+            self._logger.error(f'Trying to restart collector {instance_id}, but it is not already registered')
             return
 
         # startup logic
-        activity = collector.value(
-            **args,
-            exit_event=self._exit_event, logger=self._parent_logger,
-        )
-        thread = Thread(name=activity.name, target=activity, daemon=True)
-        self._collectors[collector] = CollectorTuple(
+        # the default instance logs like a single collector did, other instances get their own logger
+        logger = self._parent_logger if instance_id == collector_name(collector) \
+            else self._parent_logger.getChild(instance_id)
+        activity_type = collector.value if isinstance(collector, Collectors) else collector
+        if self._mode is ExecutionMode.PROCESS:
+            activity = ProcessActivity(
+                activity_type, args, name=f'{activity_type.__name__}[{instance_id}]',
+                exit_event=self._exit_event, logger=logger, log_queue=self._log_queue, context=self._context,
+            )
+            thread = activity.process
+        elif issubclass(activity_type, AsyncActivityABC):
+            activity = activity_type(
+                **args,
+                exit_event=self._exit_event, logger=logger,
+            )
+            if self._event_loop is None:
+                self._event_loop = EventLoopRunner(name=f'{CollectorMonitor.__name__}.{EventLoopRunner.__name__}',
+                                                   logger=self._logger)
+            thread = ActivityTask(activity, self._event_loop, name=f'{activity.name}[{instance_id}]',
+                                  on_exit=self.wakeup)
+        else:
+            activity = activity_type(
+                **args,
+                exit_event=self._exit_event, logger=logger,
+            )
+            thread = Thread(name=f'{activity.name}[{instance_id}]', target=self._run_activity,
+                            args=(activity,), daemon=True)
+        self._collectors[instance_id] = CollectorTuple(
             collector=collector, thread=thread,
-            activity=activity, args=args,
+            activity=activity, args=args, instance_id=instance_id,
         )
-        thread.start()
-
-    def _drop_collector(self, collector: Collectors) -> None:
-        """Signal a collector to stop. Actual removal is done in _do_drop_collector()."""
-
-        self._logger.info(f'Signalling collector activity to exit: {collector.name}')
-
-        if collector not in self._collectors:
-            self._logger.error(f'Requesting to drop not registered collector: {collector.name}')
+        if self._mode is ExecutionMode.PROCESS:
+            activity.start()
+            # wake up the monitor when the process exits
+            Thread(name=f'{thread.name}.watch', target=self._watch_process, args=(thread,), daemon=True).start()
+        else:
+            thread.start()
+
+    @staticmethod
+    def _release(collector_tup: CollectorTuple) -> None:
+        """Release the resources of an exited collector activity."""
+        if isinstance(collector_tup.activity, ProcessActivity):
+            collector_tup.activity.close()
+
+    def _run_activity(self, activity: ActivityABC) -> None:
+        """Run an activity in its thread, waking up the monitor when it exits."""
+        try:
+            activity()
+        finally:
+            self.wakeup()
+
+    def _watch_process(self, process) -> None:
+        """Wake up the monitor when process exits."""
+        # wait on the sentinel instead of join(), the monitor thread alone reaps its processes
+        multiprocessing.connection.wait([process.sentinel])
+        self.wakeup()
+
+    def _drop_collector(self, instance_id: str, *, restart: bool = False) -> None:
+        """Signal a collector to stop. Actual removal, or restart, is done in _do_drop_collector()."""
+
+        self._logger.info(f'Signalling collector activity to exit: {instance_id}')
+
+        if instance_id not in self._collectors:
+            self._logger.error(f'Requesting to drop not registered collector: {instance_id}')
             return
 
-        if self._collectors[collector].activity.exiting():
-            self._logger.warning(f'Collector already requested to exit: {collector.name}')
+        if self._collectors[instance_id].activity.exiting():
+            self._logger.warning(f'Collector already requested to exit: {instance_id}')
 
         # add the collector to the list of collectors to remove, and signal it to exit
-        self._to_drop_queue.append(collector)
-        self._collectors[collector].activity.exit()
+        if restart:
+            self._to_restart.add(instance_id)
+        else:
+            self._to_restart.discard(instance_id)
+        self._to_drop_queue.append(instance_id)
+        self._collectors[instance_id].activity.exit()
 
-    def _do_drop_collector(self, collector: Collectors, retry_queue: Deque[Collectors]) -> None:
-        """Query if the collector activity is running, and drop it if it is dead."""
+    def _do_drop_collector(self, instance_id: str, retry_queue: Deque[str]) -> None:
+        """Query if the collector activity is running, and drop or restart it if it is dead."""
 
-        self._logger.info(f'Attempting to exit collector activity: {collector.name}')
+        self._logger.info(f'Attempting to exit collector activity: {instance_id}')
 
-        if collector not in self._collectors:
-            self._logger.error(f'Attempting to drop not started collector: {collector.name}')
+        if instance_id not in self._collectors:
+            self._logger.error(f'Attempting to drop not started collector: {instance_id}')
             return
 
-        collector_tup = self._collectors[collector]
+        collector_tup = self._collectors[instance_id]
         if not collector_tup.thread.is_alive():
-            # it is dead -> remove it
-            del self._collectors[collector]
+            if instance_id in self._to_restart and not self._exit_event.is_set():
+                # it is dead -> start it again
+                self._to_restart.discard(instance_id)
+                self._release(collector_tup)
+                self._start_collector(collector_tup.collector, collector_tup.args, instance_id, restart=True)
+            else:
+                # it is dead -> remove it, the monitor may be waiting for it to exit
+                self._to_restart.discard(instance_id)
+                self._release(collector_tup)
+                del self._collectors[instance_id]
+                self.wakeup()
         else:
-            self._logger.warning(f'Dropped collector have not yet exited: {collector.name}')
-            retry_queue.append(collector)
+            self._logger.warning(f'Dropped collector have not yet exited: {instance_id}')
+            retry_queue.append(instance_id)
 
-    def _poll_collector(self, collector: Collectors) -> None:
+    def _poll_collector(self, instance_id: str) -> None:
         """Poll collectors and check if they are alive."""
 
-        self._logger.info(f'Polling collector activity: {collector.name}')
+        self._logger.info(f'Polling collector activity: {instance_id}')
 
-        collector_tup: CollectorTuple = self._collectors[collector]
+        collector_tup: CollectorTuple = self._collectors[instance_id]
         if not collector_tup.activity.exiting():
             if not collector_tup.thread.is_alive():
                 # log error
-                message = f'Collector activity exited unexpectedly: {collector.name}'
+                message = f'Collector activity exited unexpectedly: {instance_id}'
                 error: Exception = collector_tup.activity.get_error()
                 if error is not None:
                     message += f'\nWith error:\n{str(error)}'
@@ -387,6 +726,8 @@ class CollectorMonitor:
                 self._logger.error(message)
 
                 # attempt to restart
-                self._start_collector(collector_tup.collector, collector_tup.args, restart=True)
-        elif not collector_tup.thread.is_alive():
-            self._to_drop_queue.append(collector)
+                self._release(collector_tup)
+                self._start_collector(collector_tup.collector, collector_tup.args, instance_id, restart=True)
+        elif not collector_tup.thread.is_alive() and instance_id not in self._to_drop_queue:
+            self._to_drop_queue.append(instance_id)
+            self.wakeup()  # drop it in the next step, without waiting for the poll
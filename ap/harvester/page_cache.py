@@ -0,0 +1,139 @@
+"""Content-addressed on-disk cache of fetched pages.
+
+Page bodies are stored once per content, as ``objects/<digest[:2]>/<digest>`` files named by
+the sha256 of the body, and a sqlite index maps each url to the digest of its last fetched
+body. When the bodies outgrow max_bytes the least recently used ones are evicted, together
+with the urls pointing to them. The total size of the bodies is counted once when the cache is
+opened and then kept up to date in memory, so puts below max_bytes do not scan the index.
+"""
+
+import hashlib
+import os
+import time
+from typing import List, Optional
+
+from ap.sql_toolbox.sql_interface import SqlDb, SqlOptions
+
+
+class PageCache(SqlDb):
+    """Content-addressed page cache, see the module documentation.
+
+    The cache is meant to be used from one thread at a time, and one PageCache per directory.
+
+    Args:
+        directory: Directory holding the bodies and the ``index.db`` index, created if missing.
+        max_bytes: Maximum total size of the stored bodies, None for no limit.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = 512 * 1024 * 1024) -> None:
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        super().__init__(db_path=os.path.join(directory, 'index.db'),
+                         options=SqlOptions(journal_mode="WAL", synchronous="NORMAL"))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.create_tables()
+        self._size = self.size()
+
+    def create_tables(self) -> None:
+        if not self.does_table_exist('pages'):
+            self.create_table_from_sql('pages', """CREATE TABLE IF NOT EXISTS pages(
+                                       url TEXT PRIMARY KEY, digest TEXT NOT NULL, fetched_at INT NOT NULL)""")
+        if not self.does_table_exist('blobs'):
+            self.create_table_from_sql('blobs', """CREATE TABLE IF NOT EXISTS blobs(
+                                       digest TEXT PRIMARY KEY, size INT NOT NULL, last_access REAL NOT NULL)
+                                       WITHOUT ROWID""")
+            self.routine("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs(last_access)")
+        # evictions delete the urls of a digest
+        self.routine("CREATE INDEX IF NOT EXISTS pages_digest ON pages(digest)")
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def put(self, url: str, body: bytes, fetched_at: Optional[int] = None) -> str:
+        """Store body as the page of url, returning its digest."""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as blob_file:
+                blob_file.write(body)
+            os.replace(temporary, path)
+
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute("INSERT OR IGNORE INTO blobs(digest, size, last_access) VALUES (?, ?, ?)",
+                           (digest, len(body), now))
+            added = cursor.rowcount == 1
+            if not added:
+                cursor.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (now, digest))
+            cursor.execute("INSERT OR REPLACE INTO pages(url, digest, fetched_at) VALUES (?, ?, ?)",
+                           (url, digest, int(now) if fetched_at is None else fetched_at))
+        if added:
+            self._size += len(body)
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            self.evict(self.max_bytes)
+        return digest
+
+    def digest(self, url: str) -> Optional[str]:
+        """Return the digest of the cached page of url, None if not cached."""
+        with self.transaction() as cursor:
+            row = cursor.execute("SELECT digest FROM pages WHERE url = ?", (url,)).fetchone()
+        return None if row is None else row[0]
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Return the cached page of url, None if not cached, and mark it as recently used."""
+        digest = self.digest(url)
+        if digest is None:
+            return None
+        try:
+            with open(self._path(digest), 'rb') as blob_file:
+                body = blob_file.read()
+        except FileNotFoundError:
+            # the body was removed from under the index
+            with self.transaction() as cursor:
+                row = cursor.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+                cursor.execute("DELETE FROM pages WHERE digest = ?", (digest,))
+                cursor.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            if row is not None:
+                self._size -= row[0]
+            return None
+        self.routine("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+        return body
+
+    def __contains__(self, url: str) -> bool:
+        return self.digest(url) is not None
+
+    def urls(self) -> List[str]:
+        """Return the urls of all cached pages."""
+        with self.transaction() as cursor:
+            return [row[0] for row in cursor.execute("SELECT url FROM pages ORDER BY url")]
+
+    def size(self) -> int:
+        """Return the total size of the stored bodies in bytes, counted from the index."""
+        with self.transaction() as cursor:
+            return cursor.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def evict(self, max_bytes: int) -> int:
+        """Evict least recently used bodies until at most max_bytes are stored, returning the number evicted."""
+        excess = self._size - max_bytes
+        if excess <= 0:
+            return 0
+        evicted = []
+        freed = 0
+        with self.transaction() as cursor:
+            # rows are read lazily, only the least recently used ones are loaded
+            for digest, size in cursor.execute("SELECT digest, size FROM blobs ORDER BY last_access"):
+                if freed >= excess:
+                    break
+                evicted.append((digest,))
+                freed += size
+            cursor.executemany("DELETE FROM pages WHERE digest = ?", evicted)
+            cursor.executemany("DELETE FROM blobs WHERE digest = ?", evicted)
+        self._size -= freed
+        for digest, in evicted:
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+        return len(evicted)
@@ -0,0 +1,109 @@
+"""Benchmark of search result page parsing on saved pages.
+
+Parses the given pages with every installed backend parser, both building the tree of the
+whole page and only the result items (see ap.harvester.finn_parser), and reports items/sec and
+the peak memory allocated while parsing a page as JSON::
+
+    python -m ap.harvester.parse_benchmark ap/tests/test_harvester/data/search_page.html --repeat 20
+
+With ``--workers``, the pages are also parsed on pools of worker processes, like FinnActivity
+does with parse_workers, to show how parsing throughput scales with cores.
+"""
+
+import argparse
+import json
+import multiprocessing
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from bs4 import FeatureNotFound
+
+from ap.harvester.finn_parser import PARSERS, extract_listing, parse_listings, result_items
+
+
+def available_parsers() -> List[str]:
+    """Return the backend parsers of PARSERS that are installed."""
+    parsers = []
+    for parser in PARSERS:
+        try:
+            result_items(b'<html></html>', parser)
+        except FeatureNotFound:
+            continue
+        parsers.append(parser)
+    return parsers
+
+
+def _parse(pages: Sequence[bytes], parser: str, strain: bool) -> int:
+    items = 0
+    for page in pages:
+        for item in result_items(page, parser, strain=strain):
+            extract_listing(item)
+            items += 1
+    return items
+
+
+def bench_parse(pages: Sequence[bytes], parser: str, strain: bool, repeat: int = 5) -> Dict[str, Any]:
+    """Parse all pages repeat times, then once more under tracemalloc for the peak memory of a page."""
+    t1 = time.perf_counter()
+    items = sum(_parse(pages, parser, strain) for _ in range(repeat))
+    seconds = time.perf_counter() - t1
+
+    peak = 0
+    for page in pages:
+        tracemalloc.start()
+        try:
+            _parse([page], parser, strain)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    return {"parser": parser, "strain": strain, "pages": len(pages) * repeat, "items": items,
+            "seconds": seconds, "items_per_sec": items / seconds if seconds > 0 else None,
+            "peak_memory_bytes": peak}
+
+
+def bench_workers(pages: Sequence[bytes], parser: str, workers: int, repeat: int = 5) -> Dict[str, Any]:
+    """Parse all pages repeat times on a pool of worker processes, one page per task."""
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # start the workers before timing
+        list(pool.map(parse_listings, [b'<html></html>'] * workers, [parser] * workers))
+        t1 = time.perf_counter()
+        tasks = [page for _ in range(repeat) for page in pages]
+        listings = sum(len(page_listings) for page_listings in pool.map(parse_listings, tasks, [parser] * len(tasks)))
+        seconds = time.perf_counter() - t1
+    return {"parser": parser, "workers": workers, "pages": len(tasks), "listings": listings,
+            "seconds": seconds, "listings_per_sec": listings / seconds if seconds > 0 else None}
+
+
+def run(paths: Sequence[str], repeat: int = 5, parsers: Optional[Sequence[str]] = None,
+        workers: Sequence[int] = ()) -> Dict[str, Any]:
+    """Benchmark parsing the pages at paths with each parser, with and without straining, and on each number of workers."""
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as page_file:
+            pages.append(page_file.read())
+    parsers = available_parsers() if parsers is None else list(parsers)
+    return {"pages": list(paths), "bytes": sum(len(page) for page in pages), "repeat": repeat,
+            "results": [bench_parse(pages, parser, strain, repeat) for parser in parsers for strain in (False, True)],
+            "workers": [bench_workers(pages, parser, count, repeat) for parser in parsers for count in workers]}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('paths', nargs='+', help='Saved search result pages.')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Times each page is parsed.')
+    arg_parser.add_argument('--parser', action='append', dest='parsers', choices=PARSERS,
+                            help='Backend parser to run, repeatable. Defaults to all installed.')
+    arg_parser.add_argument('--workers', type=int, nargs='*', default=[],
+                            help='Numbers of worker processes to also parse the pages with.')
+    arg_parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+    arguments = arg_parser.parse_args()
+
+    report = run(arguments.paths, repeat=arguments.repeat, parsers=arguments.parsers, workers=arguments.workers)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
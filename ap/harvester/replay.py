@@ -0,0 +1,161 @@
+"""Record and replay of harvester http traffic.
+
+RecordingClient is an HttpClient saving every response it receives to a corpus directory, and
+ReplayClient serves a corpus back without touching the network. Harvesters take either in place
+of their HttpClient, so parsers, benchmarks and tests can run offline against real pages.
+
+A corpus is a directory with ``responses.jsonl``, one line per response with its url, the time
+it was recorded, its status and headers, and the sha256 of its body, and the bodies stored once
+per content in ``bodies/<digest>``.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from ap.harvester.http_client import HttpClient, HttpError, HttpResponse
+
+# A response of a corpus, digest is None for responses without a body
+RecordedResponse = namedtuple('RecordedResponse', ['url', 'recorded_at', 'status', 'headers', 'digest'])
+
+# response headers kept in a corpus
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def _body_path(directory: str, digest: str) -> str:
+    return os.path.join(directory, 'bodies', digest)
+
+
+def read_corpus(directory: str) -> List[RecordedResponse]:
+    """Return the responses of a corpus in recording order."""
+    responses = []
+    with open(os.path.join(directory, 'responses.jsonl'), encoding='utf-8') as index_file:
+        for line in index_file:
+            if line.strip():
+                responses.append(RecordedResponse(**json.loads(line)))
+    return responses
+
+
+def read_body(directory: str, response: RecordedResponse) -> Optional[bytes]:
+    """Return the body of a recorded response."""
+    if response.digest is None:
+        return None
+    with open(_body_path(directory, response.digest), 'rb') as body_file:
+        return body_file.read()
+
+
+class RecordingClient(HttpClient):
+    """HttpClient saving every 200 response and error status it receives to a corpus.
+
+    Not modified responses are not saved, replaying serves the last saved body instead.
+
+    Args:
+        directory: Corpus directory, created if missing. New responses are appended.
+        **kwargs: Arguments of HttpClient.
+    """
+
+    def __init__(self, directory: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        self._record_lock = threading.Lock()
+
+    def _record(self, url: str, status: int, headers: Dict[str, str], body: Optional[bytes]) -> None:
+        digest = None if body is None else hashlib.sha256(body).hexdigest()
+        if digest is not None and not os.path.exists(_body_path(self.directory, digest)):
+            temporary = f'{_body_path(self.directory, digest)}.{threading.get_ident()}.tmp'
+            with open(temporary, 'wb') as body_file:
+                body_file.write(body)
+            os.replace(temporary, _body_path(self.directory, digest))
+        response = RecordedResponse(url=url, recorded_at=time.time(), status=status, digest=digest,
+                                    headers={k: headers[k] for k in RECORDED_HEADERS if k in headers})
+        with self._record_lock:
+            with open(os.path.join(self.directory, 'responses.jsonl'), 'a', encoding='utf-8') as index_file:
+                index_file.write(json.dumps(response._asdict()) + '\n')
+
+    def get(self, url: str, *, conditional: bool = True, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        try:
+            response = super().get(url, conditional=conditional, headers=headers)
+        except HttpError as e:
+            self._record(url, e.status, {}, None)
+            raise
+        if not response.not_modified:
+            self._record(url, response.status, response.headers, response.body)
+        return response
+
+
+class ReplayClient(HttpClient):
+    """HttpClient serving the responses of a corpus, without network access.
+
+    With a speed, the corpus is replayed on a clock starting at the first recorded response
+    when the client is created, running speed times faster than real time, and each request is
+    answered with the last response recorded for its url at the replay time, or the first one if
+    the url was only recorded later. Without a speed, the responses of each url are served in
+    recording order, one per request, as fast as possible, and the last one is repeated.
+
+    Conditional requests are answered as not modified when the body to serve is the body last
+    served for the url. Urls missing from the corpus are answered with 404.
+
+    Args:
+        directory: Corpus directory.
+        speed: Replay speed relative to real time, None to replay request by request.
+        **kwargs: Arguments of HttpClient, only the logger is used.
+    """
+
+    def __init__(self, directory: str, speed: Optional[float] = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        assert speed is None or speed > 0., f'{ReplayClient.__name__} should use a strictly positive speed'
+        self.directory = directory
+        self.speed = speed
+        self._responses: Dict[str, List[RecordedResponse]] = {}
+        responses = read_corpus(directory)
+        for response in responses:
+            self._responses.setdefault(response.url, []).append(response)
+        self._first_recorded = min((r.recorded_at for r in responses), default=0.)
+        self._started = time.monotonic()
+        self._served: Dict[str, int] = {}
+        self._last_digest: Dict[str, Optional[str]] = {}
+
+    def replay_time(self) -> float:
+        """Return the recording time currently being replayed."""
+        return self._first_recorded + (time.monotonic() - self._started) * (self.speed or 0.)
+
+    def _pick(self, url: str) -> Optional[RecordedResponse]:
+        responses = self._responses.get(url)
+        if not responses:
+            return None
+        with self._lock:
+            if self.speed is None:
+                index = self._served.get(url, 0)
+                self._served[url] = index + 1
+                return responses[min(index, len(responses) - 1)]
+        index = bisect_right([r.recorded_at for r in responses], self.replay_time()) - 1
+        return responses[max(index, 0)]
+
+    def forget(self, url: Optional[str] = None) -> None:
+        with self._lock:
+            if url is None:
+                self._last_digest.clear()
+            else:
+                self._last_digest.pop(url, None)
+
+    def get(self, url: str, *, conditional: bool = True, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        response = self._pick(url)
+        if response is None:
+            self._logger.warning(f'{url} is not in the corpus {self.directory}')
+            raise HttpError(url, 404, 'Not Found')
+        if response.status != 200:
+            raise HttpError(url, response.status)
+
+        with self._lock:
+            unchanged = self._last_digest.get(url) == response.digest
+            self._last_digest[url] = response.digest
+        if conditional and unchanged:
+            return HttpResponse(url=url, status=304, headers=response.headers, body=None, not_modified=True)
+        return HttpResponse(url=url, status=200, headers=response.headers,
+                            body=read_body(self.directory, response), not_modified=False)
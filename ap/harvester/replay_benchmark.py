@@ -0,0 +1,107 @@
+"""Throughput benchmark of the full scrape-to-database path on a recorded corpus.
+
+Runs FinnActivity actions against a corpus recorded with ap.harvester.replay.RecordingClient,
+served by a ReplayClient, writing to fresh databases in a temporary directory, and reports the
+time of each action and the listings and prices persisted per second as JSON::
+
+    python -m ap.harvester.replay_benchmark path/to/corpus --actions 5
+
+A corpus is recorded by running the activity with ``http_client=RecordingClient(path)``.
+"""
+
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import time
+from threading import Event
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from ap.harvester.finn_activity import FinnActivity
+from ap.harvester.replay import ReplayClient, read_corpus
+from ap.sql_toolbox.sql_interface import SqlDb
+
+
+def search_locations(directory: str) -> Tuple[str, List[str]]:
+    """Return the search url and the locations searched in a corpus."""
+    search_url = None
+    locations: Dict[str, None] = {}
+    for response in read_corpus(directory):
+        parts = urlsplit(response.url)
+        query = parse_qs(parts.query)
+        if parts.path.endswith('/search.html') and 'location' in query:
+            search_url = search_url or urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+            locations.setdefault(query['location'][0])
+    if search_url is None:
+        raise ValueError(f'No search pages in the corpus {directory}')
+    return search_url, list(locations)
+
+
+def _count(sql_db: SqlDb, table: str) -> int:
+    with sql_db.transaction() as cursor:
+        return cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def run(directory: str, actions: int = 3, speed: Optional[float] = None, fetch_details: bool = False,
+        data_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Run actions FinnActivity actions replaying the corpus in directory.
+
+    Args:
+        directory: The corpus.
+        actions: Number of actions to run.
+        speed: Replay speed, see ReplayClient. None serves the recorded responses of each url in turn.
+        fetch_details: Whether the activity fetches detail pages, which should then be in the corpus.
+        data_dir: Directory of the databases, a temporary directory is used and removed if None.
+    """
+    temporary = data_dir is None
+    data_dir = tempfile.mkdtemp(prefix='replay_bench_') if temporary else data_dir
+    search_url, locations = search_locations(directory)
+    logger = logging.getLogger('replay_benchmark')
+    activity = FinnActivity(wait_first=False, wakeup_freq=None, exit_event=Event(), logger=logger,
+                            locations=locations, search_url=search_url, rate=None, fetch_details=fetch_details,
+                            http_client=ReplayClient(directory, speed=speed, logger=logger), data_dir=data_dir)
+    try:
+        activity.startup()
+        seconds = []
+        t1 = time.perf_counter()
+        for _ in range(actions):
+            t2 = time.perf_counter()
+            activity.action()
+            seconds.append(time.perf_counter() - t2)
+        for writer in (activity.ts_writer, activity.table_writer):
+            writer.flush()
+        total = time.perf_counter() - t1
+
+        listings = _count(activity.sql_table, activity.sql_table.table_name)
+        prices = _count(activity.sql_ts_db, activity.sql_ts_db.ts_table) if isinstance(activity.sql_ts_db, SqlDb) \
+            else sum(len(times) for times, _ in activity.sql_ts_db.get_many().values())
+        return {"corpus": directory, "locations": locations, "actions": actions, "action_seconds": seconds,
+                "seconds": total, "listings": listings, "prices": prices,
+                "listings_per_sec": listings / total, "prices_per_sec": prices / total}
+    finally:
+        activity.cleanup(started=True, graceful=True)
+        for writer in (activity.ts_writer, activity.table_writer):
+            if writer is not None:
+                writer.stop()
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus', help='Corpus directory recorded with RecordingClient.')
+    parser.add_argument('--actions', type=int, default=3, help='Number of activity actions to run.')
+    parser.add_argument('--speed', type=float, help='Replay speed relative to real time.')
+    parser.add_argument('--fetch-details', action='store_true', help='Also fetch detail pages from the corpus.')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+    arguments = parser.parse_args()
+
+    report = run(arguments.corpus, actions=arguments.actions, speed=arguments.speed,
+                 fetch_details=arguments.fetch_details)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,111 @@
+"""Adaptive polling schedules for collector activities.
+
+An activity records how many changes each action found, and returns the schedule's next wait
+from ActivityABC.wait_for(). The schedule estimates the change rate of the source, and waits
+long enough for about target_changes changes to accumulate: sources that change often are
+polled often, quiet sources rarely, always within the min/max bounds. A time-of-day profile
+stretches the wait at hours the source is known to be quiet, and jitter spreads the polls
+of several sources or instances so they do not hit the site in lockstep.
+"""
+
+import random
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class TimeOfDayProfile:
+    """Wait factors by local time of day.
+
+    Args:
+        factors: Mapping from the hour a factor starts applying, a float in ``[0, 24)``, to
+            the factor the wait is multiplied with. A factor applies until the next hour in the
+            mapping, and the last one wraps around midnight.
+    """
+
+    def __init__(self, factors: Dict[float, float]) -> None:
+        assert factors, f'{TimeOfDayProfile.__name__} needs at least one factor'
+        assert all(0. <= hour < 24. for hour in factors), 'hours should be in [0, 24)'
+        assert all(factor > 0. for factor in factors.values()), 'factors should be strictly positive'
+        self._factors: List[Tuple[float, float]] = sorted(factors.items())
+
+    def factor(self, now: Optional[float] = None) -> float:
+        """Return the factor at the time now, in seconds since the epoch, defaults to the wall clock."""
+        local = datetime.fromtimestamp(time.time() if now is None else now)
+        hour = local.hour + local.minute / 60. + local.second / 3600.
+        current = self._factors[-1][1]
+        for start, factor in self._factors:
+            if start > hour:
+                break
+            current = factor
+        return current
+
+
+# finn.no listings are mostly published and edited during the day
+NIGHT_PROFILE = TimeOfDayProfile({0.: 4., 6.: 1., 22.: 2.})
+
+
+class AdaptiveSchedule:
+    """Poll interval adapting to the change rate of a source.
+
+    Args:
+        min_wait: Minimum seconds between actions.
+        max_wait: Maximum seconds between actions, also used while no change has been seen.
+        target_changes: Number of changes to let accumulate between actions.
+        smoothing: Weight of the latest action in the change rate estimate, in ``(0, 1]``.
+        jitter: Maximum relative random deviation of each wait, e.g. 0.1 for +-10 %.
+        profile: Optional time-of-day profile the wait is multiplied with, before it is bounded
+            by min_wait and max_wait.
+        rng: Random generator for the jitter, for reproducible schedules.
+    """
+
+    def __init__(self, *, min_wait: float, max_wait: float, target_changes: float = 5.,
+                 smoothing: float = 0.3, jitter: float = 0.1, profile: Optional[TimeOfDayProfile] = None,
+                 rng: Optional[random.Random] = None) -> None:
+        assert 0. < min_wait <= max_wait, 'should have 0 < min_wait <= max_wait'
+        assert target_changes > 0., 'target_changes should be strictly positive'
+        assert 0. < smoothing <= 1., 'smoothing should be in (0, 1]'
+        assert 0. <= jitter < 1., 'jitter should be in [0, 1)'
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.target_changes = target_changes
+        self.smoothing = smoothing
+        self.jitter = jitter
+        self.profile = profile
+        self._rng = rng if rng is not None else random.Random()
+        self._rate: Optional[float] = None
+        self._last_action: Optional[float] = None
+
+    @property
+    def rate(self) -> Optional[float]:
+        """The estimated changes per second, None before the second action."""
+        return self._rate
+
+    def record(self, changes: int, now: Optional[float] = None) -> None:
+        """Record the number of changes found by an action finishing at now, defaults to the wall clock.
+
+        The changes are attributed to the time since the previous action, the first action
+        only starts the clock as it sees every change since forever.
+        """
+        now = time.time() if now is None else now
+        if self._last_action is not None and now > self._last_action:
+            sample = changes / (now - self._last_action)
+            self._rate = sample if self._rate is None else \
+                self.smoothing * sample + (1. - self.smoothing) * self._rate
+        self._last_action = now
+
+    def next_wait(self, now: Optional[float] = None) -> float:
+        """Return the seconds to wait until the next action."""
+        if self._rate is None:
+            wait = self.min_wait
+        elif self._rate <= 0.:
+            wait = self.max_wait
+        else:
+            wait = self.target_changes / self._rate
+        if self.profile is not None:
+            wait *= self.profile.factor(now)
+        # the profile stretches or shrinks the wait within the bounds, not past them
+        wait = min(max(wait, self.min_wait), self.max_wait)
+        if self.jitter:
+            wait *= 1. + self._rng.uniform(-self.jitter, self.jitter)
+        return max(wait, 0.)
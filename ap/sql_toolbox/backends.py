@@ -0,0 +1,268 @@
+"""Registry of time series storage backends.
+
+Activities pick their time series storage by name with create_backend(). Every backend
+implements TsBackend, so they are interchangeable behind the same write and read methods:
+
+ * ``sqlite``: SqlTsDb, one row per point.
+ * ``sqlite_blocks``: SqlBlockTsDb, compressed blocks of points.
+ * ``memory``: MemoryTsDb, process memory only, for tests and benchmarks.
+ * ``mmap``: MmapTsDb, append-only numpy column files read through memory maps.
+"""
+
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from ap.sql_toolbox.sql_interface import TsBackend, SqlTsDb, _check_resample, resample_arrays
+from ap.sql_toolbox.block_storage import SqlBlockTsDb
+
+
+def _select(times: np.ndarray, values: np.ndarray, start: Optional[int], end: Optional[int],
+            bucket: Optional[int], how: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Slice time sorted arrays to ``[start, end)`` without copying, then resample if bucket is given."""
+    low = 0 if start is None else np.searchsorted(times, start, side='left')
+    high = len(times) if end is None else np.searchsorted(times, end, side='left')
+    times, values = times[low:high], values[low:high]
+    if bucket is not None:
+        times, values = resample_arrays(times, values, int(bucket), how)
+    return times, values
+
+
+class MemoryTsDb(TsBackend):
+    """Time series kept in process memory, lost when the instance is dropped.
+
+    Args:
+        category: Name of the measured quantity, only kept for symmetry with SqlTsDb.
+        db_path: Name used to identify the store, e.g. for ap.sql_toolbox.writer.get_writer().
+    """
+
+    def __init__(self, category: str = 'value', db_path: str = ':memory:') -> None:
+        self.category = category
+        self.db_path = db_path
+        self._series: Dict[str, Tuple[List[int], List[Any]]] = {}
+
+    def send_many(self, points: Iterable[Tuple[str, Any, Optional[int]]], *,
+                  batch_size: int = 1000, commit_every: Optional[int] = None) -> int:
+        """Write points, batch_size and commit_every are accepted for compatibility and ignored."""
+        now = int(time.time())
+        written = 0
+        for series_id, data_value, input_time in points:
+            point_time = input_time if input_time is not None else now
+            times, values = self._series.setdefault(series_id, ([], []))
+            if not times or point_time > times[-1]:
+                times.append(point_time)
+                values.append(data_value)
+            else:
+                index = bisect_left(times, point_time)
+                if times[index] == point_time:
+                    values[index] = data_value
+                else:
+                    times.insert(index, point_time)
+                    values.insert(index, data_value)
+            written += 1
+        return written
+
+    def get_many(self, series_ids: Optional[Iterable[str]] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 bucket: Optional[int] = None, how: str = 'last') -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        _check_resample(bucket, how)
+        series = {}
+        for series_id in (self._series if series_ids is None else series_ids):
+            if series_id not in self._series:
+                continue
+            times, values = self._series[series_id]
+            times, values = _select(np.array(times, dtype=np.int64), np.array(values, dtype=np.float64),
+                                    start, end, bucket, how)
+            if len(times) > 0:
+                series[series_id] = (times, values)
+        return series
+
+    def series_ids(self) -> List[str]:
+        return sorted(self._series)
+
+
+class MmapTsDb(TsBackend):
+    """Append-only columnar time series files, read through numpy memory maps.
+
+    Every series is stored as two files in directory, ``<series>.times`` with int64 times and
+    ``<series>.values`` with float64 values, where ``<series>`` is the url quoted series id.
+    Appending is a plain file write, and reads return views into the memory mapped files, so
+    no data is copied unless resampling is requested. A point at the time of the last point
+    replaces its value. Late points, older than the last point of their series, are appended
+    unsorted to ``<series>.late_times`` and ``<series>.late_values``, and merged into the
+    sorted columns when the series is read, the last written value of a time winning. Reads of
+    series with late points copy, until compact() merges them into the sorted columns.
+
+    Args:
+        directory: Directory holding the column files, created if missing.
+        category: Name of the measured quantity, only kept for symmetry with SqlTsDb.
+    """
+
+    TIME_DTYPE = np.dtype('<i8')
+    VALUE_DTYPE = np.dtype('<f8')
+
+    def __init__(self, directory: str, category: str = 'value') -> None:
+        self.db_path = directory
+        self.category = category
+        os.makedirs(directory, exist_ok=True)
+        self._last_times: Dict[str, int] = {}
+
+    def _path(self, series_id: str, column: str) -> str:
+        return os.path.join(self.db_path, f"{quote(series_id, safe='')}.{column}")
+
+    def _map(self, series_id: str, prefix: str = '') -> Tuple[np.ndarray, np.ndarray]:
+        """Memory map the columns of a series, trimmed to the points written to both files.
+        With prefix ``late_``, map the late points instead."""
+        columns = []
+        for column, dtype in ((prefix + 'times', self.TIME_DTYPE), (prefix + 'values', self.VALUE_DTYPE)):
+            path = self._path(series_id, column)
+            size = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+            columns.append(np.memmap(path, dtype=dtype, mode='r', shape=(size,)) if size
+                           else np.empty(0, dtype=dtype))
+        count = min(len(columns[0]), len(columns[1]))
+        return columns[0][:count], columns[1][:count]
+
+    def _last_time(self, series_id: str) -> Optional[int]:
+        if series_id not in self._last_times:
+            times, _ = self._map(series_id)
+            if len(times) == 0:
+                return None
+            self._last_times[series_id] = int(times[-1])
+        return self._last_times[series_id]
+
+    def _append(self, series_id: str, prefix: str, times: List[int], values: List[Any]) -> None:
+        # values first, _map() ignores values without a matching time
+        with open(self._path(series_id, prefix + 'values'), 'ab') as values_file:
+            values_file.write(np.asarray(values, dtype=self.VALUE_DTYPE).tobytes())
+        with open(self._path(series_id, prefix + 'times'), 'ab') as times_file:
+            times_file.write(np.asarray(times, dtype=self.TIME_DTYPE).tobytes())
+
+    def send_many(self, points: Iterable[Tuple[str, Any, Optional[int]]], *,
+                  batch_size: int = 1000, commit_every: Optional[int] = None) -> int:
+        """Append points, batch_size and commit_every are accepted for compatibility and ignored."""
+        now = int(time.time())
+        per_series: Dict[str, Tuple[List[int], List[float]]] = {}
+        late: Dict[str, Tuple[List[int], List[float]]] = {}
+        for series_id, data_value, input_time in points:
+            point_time = input_time if input_time is not None else now
+            times, values = per_series.setdefault(series_id, ([], []))
+            last = times[-1] if times else self._last_time(series_id)
+            if last is not None and point_time < last:
+                late_times, late_values = late.setdefault(series_id, ([], []))
+                late_times.append(point_time)
+                late_values.append(data_value)
+            elif times and point_time == times[-1]:
+                values[-1] = data_value
+            elif not times and point_time == last:
+                self._replace_last(series_id, data_value)
+            else:
+                times.append(point_time)
+                values.append(data_value)
+
+        written = 0
+        for series_id, (times, values) in per_series.items():
+            if not times:
+                continue
+            self._append(series_id, '', times, values)
+            self._last_times[series_id] = times[-1]
+            written += len(times)
+        for series_id, (times, values) in late.items():
+            self._append(series_id, 'late_', times, values)
+            written += len(times)
+        return written
+
+    def _read(self, series_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the time sorted points of a series, merging its late points if any."""
+        times, values = self._map(series_id)
+        late_times, late_values = self._map(series_id, 'late_')
+        if len(late_times) == 0:
+            return times, values
+        times = np.concatenate([times, late_times])
+        values = np.concatenate([values, late_values])
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+        # late points are written after the sorted ones, in order, so the last of each time wins
+        last = np.append(times[1:] != times[:-1], True)
+        return times[last], values[last]
+
+    def compact(self, series_ids: Optional[Iterable[str]] = None) -> int:
+        """Merge the late points of the given series, or all series, into their sorted columns.
+
+        Returns:
+            The number of series compacted.
+        """
+        compacted = 0
+        for series_id in (self.series_ids() if series_ids is None else series_ids):
+            if not os.path.exists(self._path(series_id, 'late_times')):
+                continue
+            times, values = (np.array(column) for column in self._read(series_id))
+            for column, data in (('times', times), ('values', values)):
+                temporary = self._path(series_id, column) + '.tmp'
+                with open(temporary, 'wb') as column_file:
+                    column_file.write(data.tobytes())
+                os.replace(temporary, self._path(series_id, column))
+            for column in ('late_times', 'late_values'):
+                os.remove(self._path(series_id, column))
+            self._last_times[series_id] = int(times[-1])
+            compacted += 1
+        return compacted
+
+    def _replace_last(self, series_id: str, data_value: Any) -> None:
+        _, values = self._map(series_id)
+        with open(self._path(series_id, 'values'), 'r+b') as values_file:
+            values_file.seek((len(values) - 1) * self.VALUE_DTYPE.itemsize)
+            values_file.write(np.asarray([data_value], dtype=self.VALUE_DTYPE).tobytes())
+
+    def get_many(self, series_ids: Optional[Iterable[str]] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 bucket: Optional[int] = None, how: str = 'last') -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        _check_resample(bucket, how)
+        series = {}
+        for series_id in (self.series_ids() if series_ids is None else series_ids):
+            times, values = _select(*self._read(series_id), start, end, bucket, how)
+            if len(times) > 0:
+                series[series_id] = (times, values)
+        return series
+
+    def series_ids(self) -> List[str]:
+        return sorted(unquote(name[:-len('.times')]) for name in os.listdir(self.db_path) if name.endswith('.times'))
+
+
+_backends: Dict[str, Callable[..., TsBackend]] = {}
+
+
+def register_backend(name: str, factory: Callable[..., TsBackend]) -> None:
+    """Register a time series backend factory under name.
+
+    Raises:
+        ValueError: If a backend with the same name is already registered.
+    """
+    if name in _backends:
+        raise ValueError(f'Backend {name} already registered')
+    _backends[name] = factory
+
+
+def backend_names() -> List[str]:
+    """Return the names of the registered backends."""
+    return sorted(_backends)
+
+
+def create_backend(name: str, **kwargs) -> TsBackend:
+    """Create a time series backend by name, passing kwargs on to its factory.
+
+    Raises:
+        ValueError: If no backend is registered under name.
+    """
+    if name not in _backends:
+        raise ValueError(f'Unknown backend {name}, use one of {", ".join(backend_names())}')
+    return _backends[name](**kwargs)
+
+
+register_backend('sqlite', SqlTsDb)
+register_backend('sqlite_blocks', SqlBlockTsDb)
+register_backend('memory', MemoryTsDb)
+register_backend('mmap', MmapTsDb)
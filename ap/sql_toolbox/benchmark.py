@@ -0,0 +1,199 @@
+"""Benchmarks of the sql_toolbox write and read paths.
+
+Generates synthetic listings, a finn_info style table and price series, and measures insert
+throughput, point lookup and range read latency, csv export speed and on-disk size for each
+time series backend. Results are written as JSON so runs can be compared across releases::
+
+    python -m ap.sql_toolbox.benchmark --rows 10000 100000 1000000 --output bench.json
+
+Every row count is a separate run, with rows / 10 series and as many listings as rows unless
+given explicitly.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ap.sql_toolbox.backends import create_backend
+from ap.sql_toolbox.sql_interface import SqlDb, SqlTable, TsBackend
+
+DEFAULT_BACKENDS = ['sqlite', 'sqlite_blocks', 'memory', 'mmap']
+FINN_INFO_CATEGORIES = {"finn_id": "INT", "address": "VARCHAR(30)", "price": "INT", "sq_m": "INT"}
+
+
+def synthetic_listings(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Return count finn_info rows with realistic looking values."""
+    rng = random.Random(seed)
+    streets = ['Storgata', 'Kirkeveien', 'Thereses gate', 'Trondheimsveien', 'Bygdøy allé']
+    return [{"finn_id": 100000000 + i,
+             "address": f"{rng.choice(streets)} {rng.randint(1, 200)}, 0{rng.randint(150, 999)} Oslo",
+             "price": rng.randrange(1500000, 15000000, 10000),
+             "sq_m": rng.randint(20, 250)}
+            for i in range(count)]
+
+
+def synthetic_points(rows: int, series: int, start: int = 1500000000, step: int = 3600,
+                     seed: int = 0) -> List[tuple]:
+    """Return rows ``(series_id, price, time)`` points spread evenly over series, in time order per series.
+
+    Prices change on about one in ten points, like asking prices do.
+    """
+    rng = random.Random(seed)
+    prices = [rng.randrange(1500000, 15000000, 10000) for _ in range(series)]
+    points = []
+    for i in range(rows):
+        s = i % series
+        if rng.random() < 0.1:
+            prices[s] += rng.randrange(-200000, 200000, 10000)
+        points.append((f"Finn_{s}", prices[s], start + (i // series) * step))
+    return points
+
+
+def _timed(function: Callable[[], Any]) -> float:
+    t1 = time.perf_counter()
+    function()
+    return time.perf_counter() - t1
+
+
+def _latencies(function: Callable[[Any], Any], arguments: Iterable[Any]) -> Dict[str, float]:
+    """Call function for every argument and summarise the latencies in milliseconds."""
+    latencies = np.array([_timed(lambda: function(argument)) for argument in arguments]) * 1e3
+    return {"count": int(len(latencies)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "max_ms": float(latencies.max())}
+
+
+def _disk_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return sum(os.path.getsize(p) for p in (path, path + '-wal', path + '-shm') if os.path.exists(p))
+
+
+def _backend_args(name: str, directory: str) -> Dict[str, Any]:
+    if name in ('sqlite', 'sqlite_blocks'):
+        return dict(db_path=os.path.join(directory, f'{name}.db'), category="price", sql_type="INT")
+    if name == 'mmap':
+        return dict(directory=os.path.join(directory, name), category="price")
+    return dict(category="price")
+
+
+def bench_backend(backend: TsBackend, points: List[tuple], series: int, lookups: int, seed: int = 0) -> Dict[str, Any]:
+    """Benchmark one time series backend."""
+    rng = random.Random(seed)
+    result: Dict[str, Any] = {}
+
+    seconds = _timed(lambda: backend.send_many(points, batch_size=10000))
+    result["insert"] = {"points": len(points), "seconds": seconds, "points_per_sec": len(points) / seconds}
+
+    ids = [f"Finn_{rng.randrange(series)}" for _ in range(lookups)]
+    times = sorted({p[2] for p in points})
+    middle = times[len(times) // 2]
+    result["point_lookup"] = _latencies(lambda s: backend.get_series(s, start=middle, end=middle + 1), ids)
+    result["range_read"] = _latencies(lambda s: backend.get_series(s, start=times[len(times) // 4],
+                                                                   end=times[3 * len(times) // 4]), ids)
+    result["resampled_read"] = _latencies(lambda s: backend.get_series(s, bucket=7 * 24 * 3600, how='last'), ids)
+
+    seconds = _timed(lambda: backend.get_many())
+    result["full_scan"] = {"points": len(points), "seconds": seconds, "points_per_sec": len(points) / seconds}
+
+    location = getattr(backend, 'db_path', None)
+    if location and os.path.exists(location):
+        result["disk_bytes"] = _disk_size(location)
+        result["disk_bytes_per_point"] = result["disk_bytes"] / len(points)
+    return result
+
+
+def bench_table(directory: str, listings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Benchmark SqlTable inserts, upserts and csv export."""
+    table = SqlTable(db_path=os.path.join(directory, 'table.db'))
+    table.create_table(table_name="finn_info", categories=FINN_INFO_CATEGORIES, unique_key="finn_id")
+    result: Dict[str, Any] = {}
+
+    seconds = _timed(lambda: table.write_many(listings, batch_size=10000))
+    result["insert"] = {"rows": len(listings), "seconds": seconds, "rows_per_sec": len(listings) / seconds}
+    seconds = _timed(lambda: table.write_many(listings, upsert=True, batch_size=10000))
+    result["unchanged_upsert"] = {"rows": len(listings), "seconds": seconds, "rows_per_sec": len(listings) / seconds}
+
+    export = table.write_to_csv(path=os.path.join(directory, 'finn_info.csv'), table="finn_info")
+    result["csv_export"] = {"rows": export.rows, "seconds": export.seconds, "rows_per_sec": export.rows_per_sec}
+    result["disk_bytes"] = _disk_size(table.db_path)
+    table.disconnect()
+    return result
+
+
+def run(rows: int, series: int, listings: int, lookups: int = 200,
+        backends: Optional[List[str]] = None, directory: Optional[str] = None, seed: int = 0) -> Dict[str, Any]:
+    """Run the benchmark suite and return the results.
+
+    Args:
+        rows: Number of price points to write to each backend.
+        series: Number of price series the points are spread over.
+        listings: Number of finn_info rows.
+        lookups: Number of reads timed for each latency measurement.
+        backends: Names of the time series backends to benchmark. Defaults to all built-in.
+        directory: Directory for the benchmark databases, a temporary directory is used
+            and removed if None.
+        seed: Seed of the synthetic data.
+    """
+    backends = backends if backends is not None else DEFAULT_BACKENDS
+    temporary = directory is None
+    directory = tempfile.mkdtemp(prefix='sql_toolbox_bench_') if temporary else directory
+    os.makedirs(directory, exist_ok=True)
+
+    try:
+        points = synthetic_points(rows, series, seed=seed)
+        results = {
+            "meta": {"timestamp": int(time.time()), "python": platform.python_version(),
+                     "sqlite": sqlite3.sqlite_version, "numpy": np.__version__, "platform": platform.platform(),
+                     "rows": rows, "series": series, "listings": listings, "lookups": lookups, "seed": seed},
+            "table": bench_table(directory, synthetic_listings(listings, seed=seed)),
+            "backends": {},
+        }
+        for name in backends:
+            backend = create_backend(name, **_backend_args(name, directory))
+            results["backends"][name] = bench_backend(backend, points, series, lookups, seed=seed)
+            if isinstance(backend, SqlDb):
+                ts_table = backend.ts_table
+                export = backend.write_to_csv(path=os.path.join(directory, f'{name}.csv'), table=ts_table)
+                results["backends"][name]["csv_export"] = {
+                    "rows": export.rows, "seconds": export.seconds, "rows_per_sec": export.rows_per_sec}
+                backend.disconnect()
+        return results
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='Price points per run.')
+    parser.add_argument('--series', type=int, help='Number of price series, defaults to rows / 10.')
+    parser.add_argument('--listings', type=int, help='Number of finn_info rows, defaults to rows.')
+    parser.add_argument('--lookups', type=int, default=200, help='Reads per latency measurement.')
+    parser.add_argument('--backend', action='append', dest='backends', help='Backend to run, repeatable.')
+    parser.add_argument('--directory', help='Keep the benchmark databases in this directory.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+    arguments = parser.parse_args()
+
+    report = [run(rows=rows, series=arguments.series or max(rows // 10, 1), listings=arguments.listings or rows,
+                  lookups=arguments.lookups, backends=arguments.backends,
+                  directory=None if arguments.directory is None else os.path.join(arguments.directory, str(rows)),
+                  seed=arguments.seed)
+              for rows in arguments.rows]
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
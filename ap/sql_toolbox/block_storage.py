@@ -0,0 +1,282 @@
+"""Compressed block storage for price time series.
+
+SqlBlockTsDb stores series in fixed-size compressed blocks instead of one row per point.
+New points are appended to an open tail block, which is simply the SqlTsDb series table.
+Once a series has block_size points in its tail they are sealed into one BLOB in
+``<ts_table>_blocks``. A block holds delta-of-delta encoded times and delta encoded values,
+each cast to the narrowest integer type that fits, deflated with zlib. Long runs of unchanged
+prices end up as a few bytes. Decoding a block takes a handful of vectorized numpy operations,
+so full histories are read block by block instead of row by row.
+"""
+
+import struct
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ap.sql_toolbox.sql_interface import (
+    SqlTsDb, SqlOptions, _check_resample, resample_arrays, _split_series)
+
+# version, time dtype code, value dtype code, number of points, first time, first value
+BLOCK_HEADER = struct.Struct('<BBBIqq')
+BLOCK_VERSION = 1
+
+# dtype codes, integer codes are ordered by width so the narrowest fitting code is the smallest
+_INT_DTYPES = [np.dtype('<i1'), np.dtype('<i2'), np.dtype('<i4'), np.dtype('<i8')]
+_FLOAT_CODE = len(_INT_DTYPES)
+_FLOAT_DTYPE = np.dtype('<f8')
+
+
+def _narrowest_int(array: np.ndarray) -> int:
+    """Return the code of the narrowest integer dtype holding all values in array."""
+    if len(array) == 0:
+        return 0
+    low, high = array.min(), array.max()
+    for code, dtype in enumerate(_INT_DTYPES):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return code
+    return len(_INT_DTYPES) - 1
+
+
+def _as_integers(values: np.ndarray) -> Optional[np.ndarray]:
+    """Return values as int64 if that is lossless, otherwise None."""
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64)
+    if np.issubdtype(values.dtype, np.floating) and np.all(np.isfinite(values)) \
+            and np.all(np.abs(values) < 2 ** 53) and np.all(np.mod(values, 1) == 0):
+        return values.astype(np.int64)
+    return None
+
+
+def encode_block(times: np.ndarray, values: np.ndarray) -> bytes:
+    """Encode time sorted points into a block, see the module documentation.
+
+    Integer (or integral float) values are delta encoded, other values are stored as float64.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values)
+    if len(times) == 0:
+        raise ValueError('Cannot encode an empty block')
+
+    dod = np.diff(np.diff(times, prepend=times[0]), prepend=0)
+    time_code = _narrowest_int(dod)
+    payload = [dod.astype(_INT_DTYPES[time_code]).tobytes()]
+
+    integers = _as_integers(values)
+    if integers is not None:
+        first_value = int(integers[0])
+        deltas = np.diff(integers, prepend=integers[0])
+        value_code = _narrowest_int(deltas)
+        payload.append(deltas.astype(_INT_DTYPES[value_code]).tobytes())
+    else:
+        first_value = 0
+        value_code = _FLOAT_CODE
+        payload.append(values.astype(_FLOAT_DTYPE).tobytes())
+
+    header = BLOCK_HEADER.pack(BLOCK_VERSION, time_code, value_code, len(times), int(times[0]), first_value)
+    return header + zlib.compress(b''.join(payload))
+
+
+def decode_block(block: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode a block made by encode_block() into int64 times and float64 values."""
+    version, time_code, value_code, count, first_time, first_value = BLOCK_HEADER.unpack_from(block)
+    if version != BLOCK_VERSION:
+        raise ValueError(f'Unknown block version {version}')
+
+    payload = zlib.decompress(block[BLOCK_HEADER.size:])
+    time_dtype = _INT_DTYPES[time_code]
+    dod = np.frombuffer(payload, dtype=time_dtype, count=count)
+    times = first_time + np.cumsum(np.cumsum(dod, dtype=np.int64))
+
+    offset = count * time_dtype.itemsize
+    if value_code == _FLOAT_CODE:
+        values = np.frombuffer(payload, dtype=_FLOAT_DTYPE, count=count, offset=offset).astype(np.float64)
+    else:
+        deltas = np.frombuffer(payload, dtype=_INT_DTYPES[value_code], count=count, offset=offset)
+        values = (first_value + np.cumsum(deltas, dtype=np.int64)).astype(np.float64)
+    return times, values
+
+
+class SqlBlockTsDb(SqlTsDb):
+    """SqlTsDb storing sealed history in compressed blocks, see the module documentation.
+
+    The series table of SqlTsDb holds the open tail block of every series. Writes go to the
+    tail, and series whose tail reaches block_size points are sealed after every write. Points
+    are expected to arrive in time order per series; late points are stored and read back
+    sorted, but are not merged into already sealed blocks. A late point at a time already in a
+    sealed block is kept next to it, and reads keep the last written value of each time: the
+    tail wins over blocks, and later sealed blocks over earlier ones.
+
+    Args:
+        block_size: Number of points per sealed block.
+        The remaining arguments are passed on to SqlTsDb.
+    """
+    def __init__(self, db_path: str, category: str, sql_type, ts_table: Optional[str] = None,
+                 options: Optional[SqlOptions] = None, dedup: bool = False, heartbeat: Optional[int] = None,
+                 block_size: int = 1024):
+        super().__init__(db_path=db_path, category=category, sql_type=sql_type, ts_table=ts_table,
+                         options=options, dedup=dedup, heartbeat=heartbeat)
+        assert block_size > 0, 'block_size should be strictly positive'
+        self.block_size = block_size
+        self.block_table = f"{self.ts_table}_blocks"
+
+    def create_table(self, table_name: str = None):
+        """Create the tail and block tables if missing."""
+        super().create_table(table_name=table_name)
+        self.create_table_from_sql(self.block_table, f"""CREATE TABLE IF NOT EXISTS {self.block_table}(
+                                   block_id INTEGER PRIMARY KEY, series_id TEXT NOT NULL,
+                                   start_time INT NOT NULL, end_time INT NOT NULL, count INT NOT NULL,
+                                   data BLOB NOT NULL)""")
+        self.routine(f"""CREATE INDEX IF NOT EXISTS {self.block_table}_series
+                         ON {self.block_table}(series_id, end_time)""")
+
+    def _write_rows(self, rows: Iterable[Tuple[str, int, Any]], *,
+                    batch_size: int, commit_every: Optional[int]) -> int:
+        if not self.does_table_exist(self.block_table):
+            self.create_table()
+
+        touched: Set[str] = set()
+
+        def track(points: Iterable[Tuple[str, int, Any]]) -> Iterator[Tuple[str, int, Any]]:
+            for point in points:
+                touched.add(point[0])
+                yield point
+
+        written = super()._write_rows(track(rows), batch_size=batch_size, commit_every=commit_every)
+        self.seal_blocks(touched)
+        return written
+
+    def seal_blocks(self, series_ids: Optional[Iterable[str]] = None) -> int:
+        """Seal every full block in the tail of the given series, or of all series if None.
+
+        Returns:
+            The number of blocks sealed.
+        """
+        sealed = 0
+        with self.transaction() as cursor:
+            for batch in self._batches(series_ids):
+                conditions, parameters = self._series_condition(batch)
+                cursor.execute(f"""SELECT series_id FROM {self.ts_table}{_where(conditions)}
+                                   GROUP BY series_id HAVING COUNT(*) >= ?""", parameters + [self.block_size])
+                for series_id in [row[0] for row in cursor.fetchall()]:
+                    sealed += self._seal_series(cursor, series_id)
+        return sealed
+
+    def _seal_series(self, cursor, series_id: str) -> int:
+        sealed = 0
+        while True:
+            cursor.execute(f"SELECT series_id, time, value FROM {self.ts_table} WHERE series_id = ? "
+                           f"ORDER BY time LIMIT ?", (series_id, self.block_size))
+            rows = cursor.fetchall()
+            if len(rows) < self.block_size:
+                return sealed
+
+            times, values = _split_series(rows)[series_id]
+            cursor.execute(f"""INSERT INTO {self.block_table}(series_id, start_time, end_time, count, data)
+                               VALUES (?, ?, ?, ?, ?)""",
+                           (series_id, int(times[0]), int(times[-1]), len(times), encode_block(times, values)))
+            cursor.execute(f"DELETE FROM {self.ts_table} WHERE series_id = ? AND time <= ?",
+                           (series_id, int(times[-1])))
+            sealed += 1
+
+    def warm_last_points(self) -> None:
+        """Load the last point of every series, the newer of its tail and its last block, into the dedup map."""
+        super().warm_last_points()
+        if not self.does_table_exist(self.block_table):
+            return
+
+        with self.transaction() as cursor:
+            cursor.execute(f"""SELECT series_id, data FROM {self.block_table} AS b WHERE block_id =
+                               (SELECT block_id FROM {self.block_table} WHERE series_id = b.series_id
+                                ORDER BY end_time DESC, block_id DESC LIMIT 1)""")
+            for series_id, data in cursor:
+                times, values = decode_block(data)
+                last = self._last_points.get(series_id)
+                # late points stay in the tail after newer points were sealed, a tail point at the
+                # end time of the block was written after it was sealed
+                if last is None or int(times[-1]) > last[0]:
+                    self._last_points[series_id] = (int(times[-1]), values[-1])
+
+    def series_ids(self) -> List[str]:
+        series_ids = set(super().series_ids())
+        if self.does_table_exist(self.block_table):
+            with self.transaction() as cursor:
+                cursor.execute(f"SELECT DISTINCT series_id FROM {self.block_table}")
+                series_ids.update(row[0] for row in cursor.fetchall())
+        return sorted(series_ids)
+
+    def get_many(self, series_ids: Optional[Iterable[str]] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 bucket: Optional[int] = None, how: str = 'last') -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Read many series as contiguous ``(times, values)`` arrays, see SqlTsDb.get_many().
+
+        Blocks overlapping the range are decoded whole, merged with the tail and resampled in numpy.
+        """
+        _check_resample(bucket, how)
+
+        if series_ids is not None:
+            series_ids = list(series_ids)
+        parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        if self.does_table_exist(self.block_table):
+            with self.transaction() as cursor:
+                for batch in self._batches(series_ids):
+                    conditions, parameters = self._series_condition(batch)
+                    if start is not None:
+                        conditions.append("end_time >= ?")
+                        parameters.append(start)
+                    if end is not None:
+                        conditions.append("start_time < ?")
+                        parameters.append(end)
+                    # in sealing order, so blocks holding rewritten times come after the ones they rewrite
+                    cursor.execute(f"SELECT series_id, data FROM {self.block_table}{_where(conditions)} "
+                                   f"ORDER BY series_id, block_id", parameters)
+                    for series_id, data in cursor:
+                        parts.setdefault(series_id, []).append(decode_block(data))
+
+        for series_id, tail in super().get_many(series_ids, start=start, end=end).items():
+            parts.setdefault(series_id, []).append(tail)
+
+        series = {}
+        for series_id, arrays in parts.items():
+            times = np.concatenate([a[0] for a in arrays])
+            values = np.concatenate([a[1] for a in arrays])
+            if len(times) > 1 and np.any(times[1:] < times[:-1]):
+                order = np.argsort(times, kind='stable')
+                times, values = times[order], values[order]
+            if len(times) > 1:
+                # a time written again after it was sealed keeps the last value written
+                last = np.append(times[1:] != times[:-1], True)
+                if not last.all():
+                    times, values = times[last], values[last]
+
+            mask = np.ones(len(times), dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times < end
+            times, values = times[mask], values[mask]
+            if bucket is not None:
+                times, values = resample_arrays(times, values, int(bucket), how)
+            if len(times) > 0:
+                series[series_id] = (times, values)
+
+        return series
+
+    @staticmethod
+    def _batches(series_ids: Optional[Iterable[str]]) -> List[Optional[List[str]]]:
+        if series_ids is None:
+            return [None]
+        series_ids = list(series_ids)
+        return [series_ids[i:i + 500] for i in range(0, len(series_ids), 500)]
+
+    @staticmethod
+    def _series_condition(series_ids: Optional[List[str]]) -> Tuple[List[str], List[Any]]:
+        if series_ids is None:
+            return [], []
+        return [f"series_id IN ({','.join('?' for _ in series_ids)})"], list(series_ids)
+
+
+def _where(conditions: List[str]) -> str:
+    return (" WHERE " + " AND ".join(conditions)) if conditions else ""
@@ -0,0 +1,65 @@
+"""Convert time series databases from the table per series layout to the SqlTsDb series table.
+
+Older versions of SqlTsDb created one table per listing, ``Finn_<finn_id>(id, time, <category>)``.
+migrate_table_per_series() copies every such table into the shared ``(series_id, time, value)``
+table, using the old table name as series id so ``send_data(table_name=...)`` keeps writing to
+the same series, and drops the old tables.
+"""
+
+import argparse
+import logging
+from typing import List
+
+from ap.sql_toolbox.sql_interface import SqlTsDb
+
+logger = logging.getLogger(__name__)
+
+
+def series_tables(ts_db: SqlTsDb, pattern: str) -> List[str]:
+    """Return the tables in ts_db matching the sqlite GLOB pattern, except the series table."""
+    with ts_db.transaction() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name GLOB ? AND name != ?",
+                       (pattern, ts_db.ts_table))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def migrate_table_per_series(ts_db: SqlTsDb, pattern: str = 'Finn_*', drop: bool = True) -> int:
+    """Move all table per series tables matching pattern into the series table of ts_db.
+
+    Each table is copied, and dropped if drop is True, in its own transaction, so an
+    interrupted migration can be resumed by running it again.
+    Args:
+        ts_db: Target SqlTsDb, its category names the value column of the old tables.
+        pattern: Sqlite GLOB pattern matching the old table names.
+        drop: Whether to drop the old tables once copied.
+    Returns:
+        The number of points copied.
+    """
+    ts_db.create_table()
+    copied = 0
+    for table_name in series_tables(ts_db, pattern):
+        with ts_db.transaction() as cursor:
+            cursor.execute(f"""INSERT OR REPLACE INTO {ts_db.ts_table}(series_id, time, value)
+                               SELECT ?, time, {ts_db.category} FROM {table_name}
+                               WHERE time IS NOT NULL ORDER BY id""", (table_name,))
+            copied += cursor.rowcount
+            if drop:
+                cursor.execute(f"DROP TABLE {table_name}")
+        logger.info(f'Migrated {table_name}')
+
+    return copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--category', default='price')
+    parser.add_argument('--sql-type', default='INT')
+    parser.add_argument('--pattern', default='Finn_*')
+    parser.add_argument('--keep', action='store_true', help='Keep the old tables after copying.')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with SqlTsDb(db_path=arguments.db_path, category=arguments.category, sql_type=arguments.sql_type) as db:
+        points = migrate_table_per_series(db, pattern=arguments.pattern, drop=not arguments.keep)
+    print(f"Migrated {points} points")
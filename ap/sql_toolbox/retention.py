@@ -0,0 +1,200 @@
+"""Retention and rollup of SqlTsDb series.
+
+RollupEngine summarises the raw points of a SqlTsDb series table into rollup tables,
+``<ts_table>_rollup_<bucket>(series_id, time, open, high, low, close, count, sum)``, one row per
+series and bucket, and ages out raw points and old rollups. Each rollup keeps a watermark in
+``<ts_table>_watermarks``, the end of the last bucket it has summarised, so every pass only
+reads the raw points of buckets that completed since the last pass. Points written with a time
+before the watermark of a rollup are not summarised.
+
+RollupEngine.get_many() answers resampled queries from the coarsest fitting rollup for the
+summarised part of the range, and from the raw points for the rest.
+"""
+
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ap.sql_toolbox.sql_interface import SqlTsDb, _check_resample, _split_series
+
+DAY = 24 * 3600
+
+# rollup of raw points into buckets of bucket seconds, kept for keep seconds (None keeps them forever)
+RollupPolicy = namedtuple('RollupPolicy', ['bucket', 'keep'], defaults=[None])
+
+# number of rollup rows written, raw points deleted and rollup rows deleted by RollupEngine.run()
+RollupReport = namedtuple('RollupReport', ['rolled_up', 'raw_deleted', 'rollups_deleted'])
+
+# sql computing each resampling method of SqlTsDb.get_many() from rollup rows
+_ROLLUP_AGGREGATES = {
+    'first': 'open, MIN(time)',
+    'last': 'close, MAX(time)',
+    'mean': 'CAST(SUM(sum) AS REAL) / SUM(count)',
+    'min': 'MIN(low)',
+    'max': 'MAX(high)',
+}
+
+
+class RollupEngine:
+    """Incremental retention and rollup policy for one SqlTsDb, see the module documentation.
+
+    Args:
+        ts_db: The row based SqlTsDb to summarise.
+        rollups: Rollups to maintain. Defaults to daily rollups kept forever.
+        raw_keep: Seconds to keep raw points, None keeps them forever. Raw points are only
+            deleted once every rollup has summarised them, and the latest point of each series
+            is always kept so change-only series keep their current value. Resampled queries
+            with buckets longer than raw_keep may miss raw points at the watermark boundary.
+    """
+
+    def __init__(self, ts_db: SqlTsDb, rollups: Optional[Iterable[RollupPolicy]] = None,
+                 raw_keep: Optional[int] = 90 * DAY) -> None:
+        self.ts_db = ts_db
+        self.rollups = sorted(rollups if rollups is not None else [RollupPolicy(bucket=DAY)],
+                              key=lambda policy: policy.bucket)
+        assert all(policy.bucket > 0 for policy in self.rollups), 'rollup buckets should be strictly positive'
+        self.raw_keep = raw_keep
+        self.watermark_table = f"{ts_db.ts_table}_watermarks"
+
+    def rollup_table(self, bucket: int) -> str:
+        return f"{self.ts_db.ts_table}_rollup_{int(bucket)}"
+
+    def create_tables(self) -> None:
+        """Create the series, rollup and watermark tables if missing."""
+        if not self.ts_db.does_table_exist(self.ts_db.ts_table):
+            self.ts_db.create_table()
+        if not self.ts_db.does_table_exist(self.watermark_table):
+            self.ts_db.create_table_from_sql(self.watermark_table, f"""CREATE TABLE IF NOT EXISTS
+                                             {self.watermark_table}(name TEXT PRIMARY KEY, time INT NOT NULL)""")
+        for policy in self.rollups:
+            table = self.rollup_table(policy.bucket)
+            if not self.ts_db.does_table_exist(table):
+                self.ts_db.create_table_from_sql(table, f"""CREATE TABLE IF NOT EXISTS {table}(
+                                                 series_id TEXT NOT NULL, time INT NOT NULL,
+                                                 open REAL, high REAL, low REAL, close REAL,
+                                                 count INT NOT NULL, sum REAL,
+                                                 PRIMARY KEY(series_id, time)) WITHOUT ROWID""")
+
+    def watermarks(self) -> Dict[int, int]:
+        """Return the watermark of each rollup bucket, 0 if nothing is summarised yet."""
+        self.create_tables()
+        with self.ts_db.transaction() as cursor:
+            cursor.execute(f"SELECT name, time FROM {self.watermark_table}")
+            stored = dict(cursor.fetchall())
+        return {policy.bucket: stored.get(self.rollup_table(policy.bucket), 0) for policy in self.rollups}
+
+    def run(self, now: Optional[int] = None) -> RollupReport:
+        """Summarise all buckets completed since the last pass, then apply retention.
+
+        Args:
+            now: Current time in seconds, defaults to the wall clock.
+        """
+        now = int(time.time()) if now is None else int(now)
+        watermarks = self.watermarks()
+        ts_table = self.ts_db.ts_table
+
+        rolled_up = 0
+        raw_deleted = 0
+        rollups_deleted = 0
+        with self.ts_db.transaction() as cursor:
+            for policy in self.rollups:
+                bucket = int(policy.bucket)
+                table = self.rollup_table(bucket)
+                since, until = watermarks[bucket], (now // bucket) * bucket
+                if until > since:
+                    cursor.execute(f"""INSERT OR REPLACE INTO {table}(series_id, time, open, high, low, close, count, sum)
+                                       SELECT g.series_id, g.bucket, o.value, g.high, g.low, c.value, g.count, g.sum
+                                       FROM (SELECT series_id, (time / {bucket}) * {bucket} AS bucket,
+                                                    MAX(value) AS high, MIN(value) AS low, COUNT(*) AS count,
+                                                    SUM(value) AS sum, MIN(time) AS first, MAX(time) AS last
+                                             FROM {ts_table} WHERE time >= ? AND time < ?
+                                             GROUP BY series_id, bucket) AS g
+                                       JOIN {ts_table} AS o ON o.series_id = g.series_id AND o.time = g.first
+                                       JOIN {ts_table} AS c ON c.series_id = g.series_id AND c.time = g.last""",
+                                   (since, until))
+                    rolled_up += cursor.rowcount
+                    cursor.execute(f"INSERT OR REPLACE INTO {self.watermark_table}(name, time) VALUES (?, ?)",
+                                   (table, until))
+                    watermarks[bucket] = until
+
+                if policy.keep is not None:
+                    cursor.execute(f"DELETE FROM {table} WHERE time < ?", (now - policy.keep,))
+                    rollups_deleted += cursor.rowcount
+
+            if self.raw_keep is not None:
+                cutoff = min([now - self.raw_keep] + list(watermarks.values()))
+                cursor.execute(f"""DELETE FROM {ts_table} WHERE time < ? AND time <
+                                   (SELECT MAX(time) FROM {ts_table} AS latest
+                                    WHERE latest.series_id = {ts_table}.series_id)""", (cutoff,))
+                raw_deleted = cursor.rowcount
+
+        return RollupReport(rolled_up=rolled_up, raw_deleted=raw_deleted, rollups_deleted=rollups_deleted)
+
+    def get_many(self, series_ids: Optional[Iterable[str]] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 bucket: Optional[int] = None, how: str = 'last') -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Read series like SqlTsDb.get_many(), using rollups for resampled queries where possible.
+
+        The coarsest rollup whose bucket divides bucket serves the range before its watermark,
+        aligned down to bucket, and raw points serve the rest.
+        """
+        if bucket is None:
+            return self.ts_db.get_many(series_ids, start=start, end=end)
+        _check_resample(bucket, how)
+        bucket = int(bucket)
+
+        fitting = [policy for policy in self.rollups if bucket % int(policy.bucket) == 0]
+        if not fitting:
+            return self.ts_db.get_many(series_ids, start=start, end=end, bucket=bucket, how=how)
+        policy = fitting[-1]
+
+        split = (self.watermarks()[policy.bucket] // bucket) * bucket
+        if series_ids is not None:
+            series_ids = list(series_ids)
+
+        rolled = self._read_rollup(policy.bucket, series_ids, start, split if end is None else min(end, split),
+                                   bucket, how)
+        raw = self.ts_db.get_many(series_ids, start=split if start is None else max(start, split), end=end,
+                                  bucket=bucket, how=how)
+
+        series = rolled
+        for series_id, (times, values) in raw.items():
+            if series_id in series:
+                series[series_id] = (np.concatenate((series[series_id][0], times)),
+                                     np.concatenate((series[series_id][1], values)))
+            else:
+                series[series_id] = (times, values)
+        return series
+
+    def _read_rollup(self, rollup_bucket: int, series_ids: Optional[List[str]], start: Optional[int],
+                     end: int, bucket: int, how: str) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Resample the rollup rows in ``[start, end)`` to bucket."""
+        table = self.rollup_table(rollup_bucket)
+        if start is not None and start >= end:
+            return {}
+
+        series = {}
+        batches = [None] if series_ids is None else [series_ids[i:i + 500] for i in range(0, len(series_ids), 500)]
+        with self.ts_db.transaction() as cursor:
+            for batch in batches:
+                conditions = ["time < ?"]
+                parameters = [end]
+                if batch is not None:
+                    conditions.append(f"series_id IN ({','.join('?' for _ in batch)})")
+                    parameters.extend(batch)
+                if start is not None:
+                    conditions.append("time >= ?")
+                    parameters.append(start)
+                grouped = (f"SELECT series_id, (time / {bucket}) * {bucket} AS bucket, {_ROLLUP_AGGREGATES[how]} "
+                           f"FROM {table} WHERE {' AND '.join(conditions)} GROUP BY series_id, bucket")
+                if how in ('first', 'last'):
+                    # sqlite takes bare columns from the row holding the MIN()/MAX() aggregate
+                    column = 'open' if how == 'first' else 'close'
+                    statement = f"SELECT series_id, bucket, {column} FROM ({grouped}) ORDER BY series_id, bucket"
+                else:
+                    statement = grouped + " ORDER BY series_id, bucket"
+                cursor.execute(statement, parameters)
+                series.update(_split_series(cursor.fetchall()))
+        return series
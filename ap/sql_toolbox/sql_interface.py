@@ -1,11 +1,209 @@
+import csv
+import logging
+import os
 import sqlite3
-from typing import Tuple, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from urllib.request import pathname2url
+from typing import Tuple, Dict, Any, Iterable, Iterator, List, Optional, Sequence
 from abc import abstractmethod
+from collections import namedtuple
 from enum import Enum
 
+import numpy as np
+
 """Make API for simpler sqlite operations for TimeSeries specific"""
 """Make same for retrievting data"""
 
+logger = logging.getLogger(__name__)
+
+# sql aggregate for each resampling method of SqlTsDb.get_many()
+RESAMPLE_AGGREGATES = {
+    'first': 'value, MIN(time)',
+    'last': 'value, MAX(time)',
+    'mean': 'AVG(value)',
+    'min': 'MIN(value)',
+    'max': 'MAX(value)',
+}
+
+
+# number of duplicated keys logged when creating a unique index, see SqlTable
+_DUPLICATES_SAMPLE = 10
+
+
+def _check_resample(bucket: Optional[int], how: str) -> None:
+    """Validate the resampling arguments of TsBackend.get_many()."""
+    if bucket is not None and int(bucket) <= 0:
+        raise ValueError('bucket should be strictly positive')
+    if how not in RESAMPLE_AGGREGATES:
+        raise ValueError(f'Unknown aggregate {how}, use one of {", ".join(RESAMPLE_AGGREGATES)}')
+
+
+class CsvExport(namedtuple('CsvExport', ['rows', 'seconds'])):
+    """Result of SqlDb.write_to_csv()."""
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float('inf')
+
+
+class SqlOptions(namedtuple('SqlOptions', ['read_only', 'journal_mode', 'synchronous', 'busy_timeout'],
+                            defaults=[False, None, None, 5.])):
+    """Connection settings for a SqlDb.
+
+    Args:
+        read_only: Open the database with a ``mode=ro`` uri. Read-only connections never take
+            the write lock, combined with a writer in WAL mode they never block or are
+            blocked by it. The database must already exist.
+        journal_mode: Journal mode set when connecting, e.g. ``WAL``. None keeps the mode
+            stored in the database. Ignored for read-only connections.
+        synchronous: Synchronous level set when connecting, e.g. ``NORMAL``. None keeps the
+            sqlite default.
+        busy_timeout: Seconds to wait for a lock held by another connection before raising.
+    """
+
+
+class ConnectionPool:
+    """Long-lived sqlite3 connections, one per database path, SqlOptions and thread.
+
+    Opening a sqlite3 connection parses the schema and sets up the file handles, which
+    dominates the cost of small writes. The pool hands out the same connection to every
+    SqlDb in a thread working on the same database file with the same options, and only
+    opens a new one the first time a thread needs it, or if the file was removed from under it.
+
+    Connections are created with ``check_same_thread=False`` so close_all() can close them
+    from any thread, but each connection is only ever handed out to the thread that opened it.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+
+    def _thread_connections(self) -> Dict[Tuple[str, SqlOptions], sqlite3.Connection]:
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def get(self, db_path: str, options: SqlOptions = SqlOptions()) -> sqlite3.Connection:
+        """Return the connection to db_path owned by the calling thread, opening it if needed."""
+        connections = self._thread_connections()
+        connection = connections.get((db_path, options))
+        if connection is not None and (db_path == ':memory:' or os.path.exists(db_path)):
+            return connection
+
+        if connection is not None:
+            # the file was removed, the old connection points to an unlinked inode
+            self._discard(connection)
+
+        connection = self._connect(db_path, options)
+        # the file may have been replaced, do not trust what we know about its schema
+        schema_cache.invalidate(db_path)
+        connections[(db_path, options)] = connection
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    @staticmethod
+    def _connect(db_path: str, options: SqlOptions) -> sqlite3.Connection:
+        if options.read_only:
+            uri = 'file:' + pathname2url(os.path.abspath(db_path)) + '?mode=ro'
+            connection = sqlite3.connect(uri, uri=True, timeout=options.busy_timeout, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(db_path, timeout=options.busy_timeout, check_same_thread=False)
+            if options.journal_mode is not None:
+                connection.execute(f"PRAGMA journal_mode={options.journal_mode}")
+        if options.synchronous is not None:
+            connection.execute(f"PRAGMA synchronous={options.synchronous}")
+        return connection
+
+    def close(self, db_path: str, options: Optional[SqlOptions] = None) -> None:
+        """Close the calling thread's connection to db_path with options, or all of them if options is None."""
+        connections = self._thread_connections()
+        for key in list(connections):
+            if key[0] == db_path and (options is None or key[1] == options):
+                self._discard(connections.pop(key))
+
+    def close_all(self) -> None:
+        """Close every connection handed out by the pool, in all threads."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _discard(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        connection.close()
+
+
+class SchemaCache:
+    """In-process cache of the tables, and their columns, in each database file.
+
+    Each lookup costs one ``PRAGMA schema_version``, which only reads the database header,
+    instead of a query against ``sqlite_master``. The cached schema is reloaded whenever
+    the schema version differs from the one it was loaded at, i.e. when any connection,
+    in this or another process, changed the schema.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._schemas: Dict[str, Tuple[int, Dict[str, List[str]]]] = {}
+
+    @staticmethod
+    def _schema_version(connection: sqlite3.Connection) -> int:
+        return connection.execute("PRAGMA schema_version").fetchone()[0]
+
+    def tables(self, db_path: str, connection: sqlite3.Connection) -> Dict[str, List[str]]:
+        """Return a mapping from table name to column names for the database at db_path."""
+        version = self._schema_version(connection)
+        with self._lock:
+            cached = self._schemas.get(db_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        tables: Dict[str, List[str]] = {}
+        for table_name, column in connection.execute(
+                "SELECT m.name, p.name FROM sqlite_master AS m LEFT JOIN pragma_table_info(m.name) AS p "
+                "WHERE m.type = 'table' ORDER BY m.name, p.cid"):
+            columns = tables.setdefault(table_name, [])
+            if column is not None:
+                columns.append(column)
+        with self._lock:
+            self._schemas[db_path] = (version, tables)
+        return tables
+
+    def table_created(self, db_path: str, connection: sqlite3.Connection,
+                      table_name: str, columns: List[str]) -> None:
+        """Record a table created through connection without reloading the whole schema.
+
+        If the schema changed by more than our own CREATE TABLE since it was cached, the
+        cache is dropped and reloaded on the next lookup instead.
+        """
+        version = self._schema_version(connection)
+        with self._lock:
+            cached = self._schemas.get(db_path)
+            if cached is not None and cached[0] == version - 1:
+                tables = dict(cached[1])
+                tables[table_name] = list(columns)
+                self._schemas[db_path] = (version, tables)
+            else:
+                self._schemas.pop(db_path, None)
+
+    def invalidate(self, db_path: str) -> None:
+        """Forget the cached schema of db_path."""
+        with self._lock:
+            self._schemas.pop(db_path, None)
+
+
+connection_pool = ConnectionPool()
+schema_cache = SchemaCache()
+
 class SqlTsAdapter:
 
     @abstractmethod
@@ -25,14 +223,81 @@ class SqlTsAdapter:
         pass
 
 
+class TsBackend:
+    """Time series storage interface, implemented by SqlTsDb and the backends in ap.sql_toolbox.backends.
+
+    The interface is about series only, sql backends add their connection handling through SqlDb.
+    Points are ``(series_id, data_value, input_time)``, in any time order, and writing the same
+    series and time twice keeps the last value. Reads return contiguous, time sorted int64
+    times and float64 values per series.
+    """
+
+    @abstractmethod
+    def send_many(self, points: Iterable[Tuple[str, Any, Optional[int]]], *,
+                  batch_size: int = 1000, commit_every: Optional[int] = None) -> int:
+        """Write points, returning the number of points written."""
+        pass
+
+    @abstractmethod
+    def get_many(self, series_ids: Optional[Iterable[str]] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 bucket: Optional[int] = None, how: str = 'last') -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Read many series as ``(times, values)`` arrays, see SqlTsDb.get_many()."""
+        pass
+
+    @abstractmethod
+    def series_ids(self) -> List[str]:
+        """Return the ids of all stored series."""
+        pass
+
+    def send_data(self, input_time: int=None, table_name: str=None, data_value: float=None,
+                  series_id: str=None):
+        """Write one point. table_name is the old name for series_id and is used if series_id is None."""
+        series_id = series_id if series_id is not None else table_name
+        self.send_many([(series_id, data_value, input_time)])
+
+    def get_series(self, series_id: str, start: Optional[int] = None, end: Optional[int] = None,
+                   bucket: Optional[int] = None, how: str = 'last') -> Tuple[np.ndarray, np.ndarray]:
+        """Read one series as contiguous ``(times, values)`` arrays, see get_many()."""
+        return self.get_many([series_id], start=start, end=end, bucket=bucket, how=how).get(
+            series_id, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)))
+
+    def close(self) -> None:
+        """Release the resources held for the calling thread, the backend stays usable."""
+        pass
+
+
 class SqlDb(SqlTsAdapter):
+    """Base sqlite interface.
 
-    def __init__(self, db_path: str):
+    Connections are taken from the module wide ``connection_pool``, so every SqlDb (and
+    subclass) working on the same ``db_path`` with the same options from the same thread
+    shares one long-lived connection. close_db() only releases the connection back to the
+    pool; use disconnect() or the instance as a context manager to actually close it.
+
+    Args:
+        db_path: Path to the sqlite database.
+        options: Connection settings, see SqlOptions. Defaults to a read-write connection
+            keeping the journal mode of the database.
+    """
+
+    def __init__(self, db_path: str, options: Optional[SqlOptions] = None):
         self.db_path = db_path
+        self.options = options if options is not None else SqlOptions()
         self.sql_db = None
 
+    def __enter__(self) -> 'SqlDb':
+        self.connect_db()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.disconnect()
+
+    def _connection(self) -> sqlite3.Connection:
+        return connection_pool.get(self.db_path, self.options)
+
     def connect_db(self):
-        self.sql_db = sqlite3.connect(self.db_path)
+        self.sql_db = self._connection()
 
     def get_cursor(self):
         if not self.sql_db:
@@ -44,28 +309,73 @@ class SqlDb(SqlTsAdapter):
         self.sql_db.commit()
 
     def close_db(self):
-        self.sql_db.close()
+        self.sql_db = None
 
-    def routine(self, str):
-        # Make try
-        self.connect_db()
-        self.get_cursor().execute(str)
-        self.commit()
-        self.close_db()
+    def disconnect(self) -> None:
+        """Close the pooled connection to db_path held by the calling thread."""
+        self.sql_db = None
+        connection_pool.close(self.db_path, self.options)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Yield a cursor on the pooled connection, committing on success and rolling back on error."""
+        connection = self._connection()
+        try:
+            yield connection.cursor()
+        except Exception:
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+
+    def routine(self, str, parameters: Tuple = ()):
+        with self.transaction() as cursor:
+            cursor.execute(str, parameters)
+
+    def execute_many(self, statement: str, rows: Iterable[Sequence], *,
+                     batch_size: int = 1000, commit_every: Optional[int] = None) -> int:
+        """Execute a parametrised statement for every row using executemany.
+
+        Args:
+            statement: Parametrised SQL statement, e.g. ``INSERT INTO t(a, b) VALUES (?, ?)``.
+            rows: Parameter rows, consumed lazily batch_size rows at a time.
+            batch_size: Number of rows handed to each executemany call.
+            commit_every: Commit once at least this many rows have been written since the
+                last commit. None writes all rows in a single transaction.
+        Returns:
+            The number of rows written.
+        """
+        assert batch_size > 0, 'batch_size should be strictly positive'
+        rows = iter(rows)
+        written = 0
+        uncommitted = 0
+        with self.transaction() as cursor:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                cursor.executemany(statement, batch)
+                written += len(batch)
+                uncommitted += len(batch)
+                if commit_every is not None and uncommitted >= commit_every:
+                    cursor.connection.commit()
+                    uncommitted = 0
+
+        return written
+
+    def tables(self) -> Dict[str, List[str]]:
+        """Return a mapping from table name to column names, served from the schema cache."""
+        return schema_cache.tables(self.db_path, self._connection())
 
     def does_table_exist(self, table_name):
-        self.connect_db()
-        cursor = self.get_cursor()
-        #cursor.execute(f"""SELECT count(*) FROM sqlite_master WHERE type='table' AND name='REALD' """)
-        cursor.execute("SELECT count(*) FROM sqlite_master where type='table' AND name=?", (table_name,))
-        # reads all records into memory, and then returns that list.
-        exist = cursor.fetchall()[0][0]
-        if exist == 1:
-            return True
+        return table_name in self.tables()
 
-        return False
-
-        self.close_db()
+    def create_table_from_sql(self, table_name: str, statement: str) -> None:
+        """Execute a CREATE TABLE statement for table_name and record it in the schema cache."""
+        with self.transaction() as cursor:
+            cursor.execute(statement)
+            columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+        schema_cache.table_created(self.db_path, self._connection(), table_name, columns)
 
     def get_categories(self, table_name: str):
         self.connect_db()
@@ -76,57 +386,294 @@ class SqlDb(SqlTsAdapter):
         self.close_db()
         return output
 
-    def write_to_csv(self, path: str, table: str):
-        # to export as csv file
-        # WRITE TO CSV IKKE HELT GOD DA "," I ADRESSEN F* UP CSV
-        # MULIG PREPROSSESEROMG I AKTIVITET ER LØSNINGEN!
-        self.connect_db()
-        cursor = self.get_cursor()
-        cursor.execute(f"PRAGMA table_info({table})")
-        table_info = cursor.fetchall()
-        colum_headers = " ".join([t[1] + "," for t in table_info])[:-1]
-
-        with open(path, "wb") as write_file:
-            write_file.write(colum_headers.encode())
-            write_file.write("\n".encode())
-            for row in cursor.execute(f"SELECT * FROM {table}"):
-                writeRow = " ".join([str(i) + "," for i in row])[:-1]
-                write_file.write(writeRow.encode())
-                write_file.write("\n".encode())
-        self.close_db()
-
-
-class SqlTsDb(SqlDb):
+    def write_to_csv(self, path: str, table: str, *, columns: Optional[List[str]] = None,
+                     where: Optional[str] = None, parameters: Sequence = (),
+                     start: Optional[int] = None, end: Optional[int] = None, time_column: str = 'time',
+                     chunk_size: int = 1000) -> 'CsvExport':
+        """Export a table to csv, streaming rows from the database in chunks of chunk_size.
+
+        Values are quoted as needed by the csv module, so text containing commas, quotes or
+        newlines survives the round trip. Memory use does not depend on the size of the table.
+        Args:
+            path: Path of the csv file to write.
+            table: Table to export.
+            columns: Optional subset of columns to export, in order. Defaults to all columns.
+            where: Optional sql condition, may use ``?`` placeholders bound from parameters.
+            parameters: Values bound to the placeholders in where.
+            start: Only export rows with ``time_column >= start``.
+            end: Only export rows with ``time_column < end``.
+            time_column: Column start and end apply to.
+            chunk_size: Number of rows fetched from the database at a time.
+        Returns:
+            The number of rows written and the time it took.
+        Raises:
+            ValueError: If table, a column or time_column does not exist.
+        """
+        t1 = time.time()
+        known_columns = self.tables().get(table)
+        if known_columns is None:
+            raise ValueError(f'No such table: {table}')
+        if columns is None:
+            columns = known_columns
+        for column in columns + ([time_column] if start is not None or end is not None else []):
+            if column not in known_columns:
+                raise ValueError(f'No such column in {table}: {column}')
+
+        conditions = [f"({where})"] if where else []
+        parameters = list(parameters)
+        if start is not None:
+            conditions.append(f"{time_column} >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append(f"{time_column} < ?")
+            parameters.append(end)
+
+        statement = f"SELECT {', '.join(columns)} FROM {table}"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+
+        rows = 0
+        cursor = self._connection().cursor()
+        cursor.execute(statement, parameters)
+        with open(path, "w", newline="", encoding="utf-8", buffering=1 << 16) as write_file:
+            writer = csv.writer(write_file)
+            writer.writerow(columns)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                writer.writerows(chunk)
+                rows += len(chunk)
+        cursor.close()
+
+        export = CsvExport(rows=rows, seconds=time.time() - t1)
+        logger.info(f"Exported {export.rows} rows from {table} to {path} "
+                    f"in {export.seconds:.3f} s ({export.rows_per_sec:.0f} rows/s)")
+        return export
+
+
+class SqlTsDb(SqlDb, TsBackend):
     """Sqlinterface, for storing TS in Sqlite.
 
-    Intened for Activities.
+    Intened for Activities. All series share one narrow table ``(series_id, time, value)``
+    stored ``WITHOUT ROWID`` with primary key ``(series_id, time)``, so the table itself is
+    the covering index for per-series range reads. Writing the same series and time twice
+    keeps the last value. Databases using the old table per series layout can be converted
+    with ap.sql_toolbox.migrate.
+
+    In dedup mode only changes are recorded: the last written value of every series is kept
+    in memory, warmed from the database on the first write, and points repeating it are
+    skipped. The map only knows about writes made through this instance.
+
+    Args:
+        db_path: Path to the sqlite database.
+        category: Name of the measured quantity, e.g. ``price``.
+        sql_type: Sql type of the values.
+        ts_table: Name of the series table. Defaults to ``<category>_ts``.
+        options: Connection settings, see SqlOptions.
+        dedup: Skip points whose value equals the last written value of the series.
+        heartbeat: Optional seconds, in dedup mode an unchanged value is still written if
+            the last written point of the series is at least this old, recording that the
+            series was still seen.
     """
-    def __init__(self, db_path: str, category: str, sql_type):
-        super().__init__(db_path=db_path)
+    def __init__(self, db_path: str, category: str, sql_type, ts_table: Optional[str] = None,
+                 options: Optional[SqlOptions] = None, dedup: bool = False, heartbeat: Optional[int] = None):
+        super().__init__(db_path=db_path, options=options)
         self.category = category
         self.sql_type = sql_type
-
-
-    def create_table(self, table_name):
-
-        self.routine(f"""CREATE TABLE {table_name}(id INTEGER PRIMARY KEY, 
-                           time INT, {self.category} {self.sql_type})""")
-
-
-    def send_data(self, input_time: int=None, table_name: str=None, data_value: float=None):
-
-        if self.does_table_exist(table_name=table_name):
-
-            if input_time:
-                self.routine(f"""INSERT INTO 
-                             {table_name}(TIME, {self.category}) VALUES ({input_time}, {data_value})""")
-            else:
-                self.routine(f"""INSERT INTO 
-                             {table_name}(TIME, {self.category}) VALUES (strftime('%s', 'now'), {data_value})""")
-
+        self.ts_table = ts_table if ts_table else f"{category}_ts"
+        self.dedup = dedup
+        self.heartbeat = heartbeat
+        self._last_points: Optional[Dict[str, Tuple[int, Any]]] = None
+
+    def close(self) -> None:
+        """Close the pooled connection of the calling thread, see disconnect()."""
+        self.disconnect()
+
+    def create_table(self, table_name: str = None):
+        """Create the series table if missing.
+
+        Series are rows in the shared series table, so table_name is only accepted for
+        compatibility with the old table per series layout and otherwise ignored.
+        """
+        self.create_table_from_sql(self.ts_table, f"""CREATE TABLE IF NOT EXISTS {self.ts_table}(
+                                   series_id TEXT NOT NULL, time INT NOT NULL, value {self.sql_type},
+                                   PRIMARY KEY(series_id, time)) WITHOUT ROWID""")
+
+    def send_many(self, points: Iterable[Tuple[str, Any, Optional[int]]], *,
+                  batch_size: int = 1000, commit_every: Optional[int] = None) -> int:
+        """Write many points with executemany instead of one transaction per point.
+
+        Args:
+            points: Iterable of ``(series_id, data_value, input_time)``. An input_time
+                of None stamps the point with the current time.
+            batch_size: See SqlDb.execute_many().
+            commit_every: See SqlDb.execute_many().
+        Returns:
+            The number of points written, excluding points skipped in dedup mode.
+        """
+        if not self.does_table_exist(self.ts_table):
+            self.create_table()
+
+        now = int(time.time())
+        rows = ((series_id, input_time if input_time is not None else now, data_value)
+                for series_id, data_value, input_time in points)
+        if self.dedup:
+            rows = self._changed_points(rows)
+
+        try:
+            return self._write_rows(rows, batch_size=batch_size, commit_every=commit_every)
+        except Exception:
+            # the map may hold points that were rolled back, rebuild it on the next write
+            self._last_points = None
+            raise
+
+    def _write_rows(self, rows: Iterable[Tuple[str, int, Any]], *,
+                    batch_size: int, commit_every: Optional[int]) -> int:
+        """Store ``(series_id, time, value)`` rows, returning the number of rows stored."""
+        statement = f"INSERT OR REPLACE INTO {self.ts_table}(series_id, time, value) VALUES (?, ?, ?)"
+        return self.execute_many(statement, rows, batch_size=batch_size, commit_every=commit_every)
+
+    def warm_last_points(self) -> None:
+        """Load the last point of every series into the dedup map."""
+        with self.transaction() as cursor:
+            cursor.execute(f"SELECT series_id, MAX(time), value FROM {self.ts_table} GROUP BY series_id")
+            self._last_points = {series_id: (point_time, value) for series_id, point_time, value in cursor}
+
+    def _changed_points(self, rows: Iterable[Tuple[str, int, Any]]) -> Iterator[Tuple[str, int, Any]]:
+        """Filter out points repeating the last written value of their series, see dedup."""
+        if self._last_points is None:
+            self.warm_last_points()
+
+        last_points = self._last_points
+        for series_id, point_time, value in rows:
+            last = last_points.get(series_id)
+            if last is not None and last[1] == value and point_time >= last[0]:
+                if self.heartbeat is None or point_time - last[0] < self.heartbeat:
+                    continue
+            # late points are written, but the newest point stays the baseline of the series
+            if last is None or point_time >= last[0]:
+                last_points[series_id] = (point_time, value)
+            yield series_id, point_time, value
+
+    def series_ids(self) -> List[str]:
+        """Return the ids of all stored series."""
+        if not self.does_table_exist(self.ts_table):
+            return []
+        with self.transaction() as cursor:
+            cursor.execute(f"SELECT DISTINCT series_id FROM {self.ts_table} ORDER BY series_id")
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_many(self, series_ids: Optional[Iterable[str]] = None,
+                 start: Optional[int] = None, end: Optional[int] = None,
+                 bucket: Optional[int] = None, how: str = 'last') -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Read many series as contiguous ``(times, values)`` arrays, sorted on time.
+
+        Resampling is done by sqlite, so only one point per bucket leaves the database.
+        Args:
+            series_ids: Series to read. None reads all series.
+            start: Only read points with ``time >= start``.
+            end: Only read points with ``time < end``.
+            bucket: Optional bucket length in seconds to resample to. Each bucket is stamped
+                with its start time.
+            how: Aggregate used when resampling, one of RESAMPLE_AGGREGATES.
+        Returns:
+            Mapping from series id to int64 times and float64 values. Series without any
+            points in the range are left out.
+        Raises:
+            ValueError: If bucket is not strictly positive or how is unknown.
+        """
+        _check_resample(bucket, how)
+        if not self.does_table_exist(self.ts_table):
+            return {}
+
+        if series_ids is None:
+            batches = [None]
         else:
-            self.create_table(table_name=table_name)
-            self.send_data(input_time=input_time, table_name=table_name, data_value=data_value)
+            series_ids = list(series_ids)
+            # stay well below sqlite's limit on the number of bound parameters
+            batches = [series_ids[i:i + 500] for i in range(0, len(series_ids), 500)]
+
+        series = {}
+        with self.transaction() as cursor:
+            for batch in batches:
+                statement, parameters = self._select_points(batch, start, end, bucket, how)
+                cursor.execute(statement, parameters)
+                series.update(_split_series(cursor.fetchall()))
+
+        return series
+
+    def _select_points(self, series_ids: Optional[List[str]], start: Optional[int], end: Optional[int],
+                       bucket: Optional[int], how: str) -> Tuple[str, List]:
+        """Build the query for get_many(), returning ``(series_id, time, value)`` rows."""
+        conditions = []
+        parameters: List[Any] = []
+        if series_ids is not None:
+            conditions.append(f"series_id IN ({','.join('?' for _ in series_ids)})")
+            parameters.extend(series_ids)
+        if start is not None:
+            conditions.append("time >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("time < ?")
+            parameters.append(end)
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+        if bucket is None:
+            return f"SELECT series_id, time, value FROM {self.ts_table}{where} ORDER BY series_id, time", parameters
+
+        bucket = int(bucket)
+        grouped = (f"SELECT series_id, (time / {bucket}) * {bucket} AS bucket, "
+                   f"{RESAMPLE_AGGREGATES[how]} FROM {self.ts_table}{where} GROUP BY series_id, bucket")
+        if how in ('first', 'last'):
+            # sqlite takes bare columns from the row holding the MIN()/MAX() aggregate
+            return f"SELECT series_id, bucket, value FROM ({grouped}) ORDER BY series_id, bucket", parameters
+        return grouped + " ORDER BY series_id, bucket", parameters
+
+
+def resample_arrays(times: np.ndarray, values: np.ndarray, bucket: int, how: str = 'last') -> Tuple[np.ndarray, np.ndarray]:
+    """Resample time sorted arrays to buckets of bucket seconds, like SqlTsDb.get_many() does in sql.
+
+    Args:
+        times: Sorted int64 times.
+        values: Values at times.
+        bucket: Bucket length in seconds. Each bucket is stamped with its start time.
+        how: Aggregate per bucket, one of RESAMPLE_AGGREGATES.
+    Returns:
+        Bucket start times and aggregated float64 values, one per non-empty bucket.
+    """
+    if how not in RESAMPLE_AGGREGATES:
+        raise ValueError(f'Unknown aggregate {how}, use one of {", ".join(RESAMPLE_AGGREGATES)}')
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    values = np.asarray(values, dtype=np.float64)
+    keys = (np.asarray(times, dtype=np.int64) // bucket) * bucket
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    if how == 'first':
+        aggregated = values[starts]
+    elif how == 'last':
+        aggregated = values[np.concatenate((starts[1:], [len(values)])) - 1]
+    elif how == 'mean':
+        aggregated = np.add.reduceat(values, starts) / np.diff(np.concatenate((starts, [len(values)])))
+    elif how == 'min':
+        aggregated = np.minimum.reduceat(values, starts)
+    else:
+        aggregated = np.maximum.reduceat(values, starts)
+    return keys[starts], aggregated
+
+
+def _split_series(rows: List[Tuple[str, int, Any]]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """Split ``(series_id, time, value)`` rows sorted on series_id into contiguous arrays per series."""
+    if not rows:
+        return {}
+
+    points = np.array(rows, dtype=[('series_id', object), ('time', np.int64), ('value', np.float64)])
+    ids = points['series_id']
+    bounds = np.concatenate(([0], np.flatnonzero(ids[1:] != ids[:-1]) + 1, [len(points)]))
+    times = np.ascontiguousarray(points['time'])
+    values = np.ascontiguousarray(points['value'])
+    return {ids[a]: (times[a:b], values[a:b]) for a, b in zip(bounds[:-1], bounds[1:])}
 
 # TODO: Make subclass for storing daily market info, to be used with
 # TODO: Bokeh or ML. Initiated in harvester
@@ -134,12 +681,23 @@ class SqlTsDb(SqlDb):
 
 class SqlTable(SqlDb):
 
-    def __init__(self, db_path: str):
-        super().__init__(db_path=db_path)
+    def __init__(self, db_path: str, options: Optional[SqlOptions] = None):
+        super().__init__(db_path=db_path, options=options)
         self.categories = None
         self.table_name = None
+        self.unique_key = None
+
+    def create_table(self, table_name, categories: Dict, primary_key: str=None, unique_key: str=None):
+        """Create the table if missing and make it the target of the write methods.
 
-    def create_table(self, table_name, categories: Dict, primary_key: str=None):
+        Args:
+            table_name: Name of the table.
+            categories: Mapping from column name to sql type.
+            primary_key: Optional primary key column(s), comma separated.
+            unique_key: Optional column(s), comma separated, identifying a row for upserts.
+                A unique index is created on them, also on an existing table. Existing
+                duplicates are removed first, keeping the most recently inserted row.
+        """
 
         if not self.does_table_exist(table_name=table_name):
 
@@ -149,7 +707,7 @@ class SqlTable(SqlDb):
                     text += f", {cat} {sql_type}"
 
                 text += f", PRIMARY KEY({primary_key}) )"
-                self.routine(text)
+                self.create_table_from_sql(table_name, text)
                 self.categories = categories
                 self.table_name = table_name
 
@@ -160,7 +718,7 @@ class SqlTable(SqlDb):
                     text += f", {cat} {sql_type}"
 
                 text += ")"
-                self.routine(text)
+                self.create_table_from_sql(table_name, text)
                 self.categories = categories
                 self.table_name = table_name
 
@@ -171,6 +729,43 @@ class SqlTable(SqlDb):
 
             print("Table exist")
 
+        self.unique_key = unique_key
+        if unique_key:
+            self._create_unique_index()
+
+    def _create_unique_index(self) -> None:
+        index = f"{self.table_name}_{'_'.join(c.strip() for c in self.unique_key.split(','))}_unique"
+        text = f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {self.table_name}({self.unique_key})"
+        try:
+            self.routine(text)
+        except sqlite3.IntegrityError:
+            # rows written before the key was declared may be duplicated, keep the last written
+            with self.transaction() as cursor:
+                duplicates = cursor.execute(f"""SELECT {self.unique_key}, COUNT(*) - 1 FROM {self.table_name}
+                                                GROUP BY {self.unique_key} HAVING COUNT(*) > 1""").fetchall()
+                cursor.execute(f"""DELETE FROM {self.table_name} WHERE rowid NOT IN
+                                   (SELECT MAX(rowid) FROM {self.table_name} GROUP BY {self.unique_key})""")
+                sample = ', '.join(f'{tuple(key)}: {removed}' for *key, removed in duplicates[:_DUPLICATES_SAMPLE])
+                logger.warning(f'Removed {cursor.rowcount} duplicate rows of {len(duplicates)} keys of '
+                               f'{self.table_name} to create the unique index {index}, keeping the last written. '
+                               f'Rows removed per ({self.unique_key}), first {_DUPLICATES_SAMPLE} keys: {sample}')
+                logger.debug(f'Rows removed per ({self.unique_key}) of {self.table_name}: '
+                             + ', '.join(f'{tuple(key)}: {removed}' for *key, removed in duplicates))
+                cursor.execute(text)
+
+    def _upsert_clause(self, columns: List[str]) -> str:
+        """Return the ON CONFLICT clause updating only rows where a value actually changed."""
+        if not self.unique_key:
+            raise ValueError(f'Table {self.table_name} has no unique_key to upsert on')
+
+        key = [c.strip() for c in self.unique_key.split(',')]
+        update = [c for c in columns if c not in key]
+        if not update:
+            return f" ON CONFLICT({self.unique_key}) DO NOTHING"
+        return (f" ON CONFLICT({self.unique_key}) DO UPDATE SET "
+                + ", ".join(f"{c}=excluded.{c}" for c in update)
+                + " WHERE " + " OR ".join(f"{c} IS NOT excluded.{c}" for c in update))
+
     def check_valid_keys(self, values: Dict):
         for i in self.categories:
             if i not in values:
@@ -178,7 +773,8 @@ class SqlTable(SqlDb):
 
         return True
 
-    def write_to_table(self, values: Dict):
+    def write_to_table(self, values: Dict, upsert: bool = False):
+        """Insert one row. With upsert, a row with the same unique_key is updated instead."""
 
         if self.check_valid_keys(values=values):
             text = f"INSERT INTO {self.table_name}"
@@ -189,9 +785,30 @@ class SqlTable(SqlDb):
             nr_tuple = "(" + ",".join("?" for i in range(len(values))) + ")"
 
             text += cat_tuple + "VALUES" + nr_tuple
-
-            self.connect_db()
-            cursor = self.get_cursor()
-            cursor.execute(text, val_tuple)
-            self.commit()
-            self.close_db()
\ No newline at end of file
+            if upsert:
+                text += self._upsert_clause(list(values))
+
+            self.routine(text, val_tuple)
+
+    def write_many(self, rows: Iterable[Dict], *, upsert: bool = False,
+                   batch_size: int = 1000, commit_every: Optional[int] = None) -> int:
+        """Write many rows with executemany instead of one transaction per row.
+
+        Rows missing any of the table categories are skipped, as in write_to_table().
+        Args:
+            rows: Iterable of dictionaries mapping category to value.
+            upsert: Update rows with the same unique_key instead of inserting duplicates.
+                Rows whose values did not change are left untouched.
+            batch_size: See SqlDb.execute_many().
+            commit_every: See SqlDb.execute_many().
+        Returns:
+            The number of rows passed to the database, including unchanged upserted rows.
+        """
+        columns = list(self.categories)
+        text = (f"INSERT INTO {self.table_name}(" + ",".join(columns) + ")"
+                + "VALUES(" + ",".join("?" for _ in columns) + ")")
+        if upsert:
+            text += self._upsert_clause(columns)
+        parameters = (tuple(row[c] for c in columns) for row in rows if self.check_valid_keys(values=row))
+
+        return self.execute_many(text, parameters, batch_size=batch_size, commit_every=commit_every)
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""Write-behind service decoupling activities from sqlite writes.
+
+Activities submit records to the SqlWriter of a database file instead of writing them
+directly. Each writer owns one thread, the only one writing to its file, which coalesces
+queued records into batches by size or age and hands each batch to the sink it was submitted
+with, typically a batch write method like SqlTable.write_many or SqlTsDb.send_many. A slow
+fsync then delays the writer thread only, not the next fetch of the activity.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from ap.sql_toolbox.sql_interface import connection_pool
+
+# Counters of a SqlWriter:
+#  * queue_depth: records waiting in the queue,
+#  * batches, records: number of batches and records written,
+#  * last_batch_size: records in the last batch,
+#  * last_write_seconds: seconds spent in the sinks writing the last batch,
+#  * last_latency: seconds from the oldest record of the last batch being submitted until it was written.
+WriterStats = namedtuple('WriterStats', ['queue_depth', 'batches', 'records',
+                                         'last_batch_size', 'last_write_seconds', 'last_latency'])
+
+Sink = Callable[[List[Any]], Any]
+
+
+class _Flush:
+    """Queue marker, set once every record queued before it has been written."""
+
+    def __init__(self) -> None:
+        self.done = Event()
+
+
+class SqlWriter:
+    """Dedicated writer thread for one database file.
+
+    Args:
+        db_path: The database file written by this writer, used for naming and the registry.
+        max_queue: Maximum number of queued records. submit() blocks while the queue is full.
+        max_batch: Maximum number of records coalesced into one batch.
+        max_delay: Maximum seconds a record waits for more records before its batch is written.
+        logger: Parent logger. When None, a logger named after the class is used.
+    """
+
+    def __init__(self, db_path: str, *, max_queue: int = 10000, max_batch: int = 1000,
+                 max_delay: float = 1., logger: Optional[logging.Logger] = None) -> None:
+        assert max_batch > 0, f'{SqlWriter.__name__} should use a strictly positive max_batch'
+        self.db_path = db_path
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+
+        if logger is None:
+            self._logger = logging.getLogger(SqlWriter.__name__)
+        else:
+            self._logger = logger.getChild(SqlWriter.__name__)
+
+        # element type: Tuple[Sink, Any, float] or _Flush
+        self._queue: Queue = Queue(maxsize=max_queue)
+        self._exit_event = Event()
+        self._thread: Optional[Thread] = None
+        self._stored_error: Optional[Exception] = None
+
+        self._stats_lock = Lock()
+        self._batches = 0
+        self._records = 0
+        self._last_batch_size = 0
+        self._last_write_seconds = 0.
+        self._last_latency = 0.
+
+    def start(self) -> None:
+        """Start the writer thread, if not already running."""
+        if self.is_running():
+            return
+        self._exit_event.clear()
+        self._thread = Thread(name=f'{SqlWriter.__name__}({self.db_path})', target=self._run, daemon=True)
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, sink: Sink, record: Any, *, timeout: Optional[float] = None) -> None:
+        """Queue a record to be written by sink, blocking while the queue is full.
+
+        Records submitted with the same sink are passed to it together, as one list, in
+        submission order.
+        Raises:
+            queue.Full: If the queue is still full after timeout seconds.
+        """
+        self._queue.put((sink, record, time.monotonic()), timeout=timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every record submitted before the call has been written.
+
+        Returns:
+            False if timeout seconds passed first, also while waiting for room in the queue, or
+            the writer is not running.
+        """
+        if not self.is_running():
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except Full:
+            return False
+        return marker.done.wait(timeout=None if deadline is None else max(0., deadline - time.monotonic()))
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Write all queued records, then stop the writer thread, waiting at most timeout seconds for it."""
+        if not self.is_running():
+            return
+        self._exit_event.set()
+        try:
+            # wake up the idle writer thread, a full queue keeps it busy until it is empty anyway
+            self._queue.put_nowait(_Flush())
+        except Full:
+            pass
+        self._thread.join(timeout=timeout)
+
+    def get_error(self) -> Union[Exception, None]:
+        """Get the last error raised by a sink. The records of a failed batch are dropped."""
+        return self._stored_error
+
+    def stats(self) -> WriterStats:
+        with self._stats_lock:
+            return WriterStats(
+                queue_depth=self._queue.qsize(), batches=self._batches, records=self._records,
+                last_batch_size=self._last_batch_size, last_write_seconds=self._last_write_seconds,
+                last_latency=self._last_latency,
+            )
+
+    def _run(self) -> None:
+        """Writer loop, coalescing queued records and writing them."""
+        while not (self._exit_event.is_set() and self._queue.empty()):
+            batch, flushes = self._collect()
+            if batch:
+                self._write(batch)
+            for marker in flushes:
+                marker.done.set()
+
+        # the pooled connections of this thread die with it
+        connection_pool.close(self.db_path)
+
+    def _collect(self) -> Tuple[List[Tuple[Sink, Any, float]], List[_Flush]]:
+        """Collect a batch, until it is full, its oldest record is max_delay old, or a flush is requested."""
+        batch: List[Tuple[Sink, Any, float]] = []
+        flushes: List[_Flush] = []
+        deadline = None
+        while len(batch) < self._max_batch:
+            if deadline is None:
+                # nothing collected, block until a record, a flush or stop() arrives
+                wait = None
+            else:
+                wait = deadline - time.monotonic()
+                if wait <= 0.:
+                    break
+            try:
+                item = self._queue.get(timeout=wait)
+            except Empty:
+                continue
+
+            if isinstance(item, _Flush):
+                flushes.append(item)
+                break
+            batch.append(item)
+            if deadline is None:
+                deadline = item[2] + self._max_delay
+        return batch, flushes
+
+    def _write(self, batch: List[Tuple[Sink, Any, float]]) -> None:
+        """Hand each sink its records from the batch."""
+        per_sink: Dict[Sink, List[Any]] = {}
+        for sink, record, _ in batch:
+            per_sink.setdefault(sink, []).append(record)
+
+        t1 = time.monotonic()
+        for sink, records in per_sink.items():
+            try:
+                sink(records)
+            except Exception as e:
+                self._stored_error = e
+                self._logger.exception(f'Dropped {len(records)} records, writing to {self.db_path} failed')
+        t2 = time.monotonic()
+
+        with self._stats_lock:
+            self._batches += 1
+            self._records += len(batch)
+            self._last_batch_size = len(batch)
+            self._last_write_seconds = t2 - t1
+            self._last_latency = t2 - batch[0][2]
+
+
+_writers: Dict[str, SqlWriter] = {}
+_writers_lock = Lock()
+
+
+def get_writer(db_path: str, **kwargs) -> SqlWriter:
+    """Return the running writer shared by everyone writing to db_path, creating it if needed.
+
+    The keyword arguments are passed to SqlWriter when the writer is created, and ignored otherwise.
+    """
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = _writers[db_path] = SqlWriter(db_path, **kwargs)
+        writer.start()
+        return writer
+
+
+def stop_writers(timeout: Optional[float] = None) -> None:
+    """Write everything queued and stop all shared writers."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop(timeout=timeout)
@@ -0,0 +1,158 @@
+"""Fixture finn.no search pages and a local http server serving them."""
+
+import gzip
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+ITEM = """
+<div class="unit flex align-items-stretch result-item">
+  <article>
+    <a href="/realestate/homes/ad.html?finnkode={finn_id}" id="{finn_id}"><h3>Lys leilighet med balkong</h3></a>
+    <div class="licorice valign-middle">{address}</div>
+    <p class="t5 word-break mhn">
+{sq_m} m²
+{price},-
+</p>
+  </article>
+</div>"""
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>Bolig til salgs</title></head>
+<body><div class="result-list">{items}
+</div></body></html>"""
+
+
+DETAIL_PAGE = """<!DOCTYPE html>
+<html><head><title>{address}</title></head>
+<body><div class="bd word-break"><p>Lys leilighet på {sq_m} m² med balkong, prisantydning {price} kr.</p></div>
+</body></html>"""
+
+
+def listing(finn_id: int, price: int = 3500000, sq_m: str = '50') -> Dict:
+    return dict(finn_id=finn_id, address=f'Storgata {finn_id % 100}, 0155 Oslo', price=price, sq_m=sq_m)
+
+
+def search_page(listings: List[Dict]) -> bytes:
+    """Render a search results page of listings, prices are formatted like finn.no does."""
+    items = ''.join(ITEM.format(finn_id=entry['finn_id'], address=entry['address'], sq_m=entry['sq_m'],
+                                price=f"{entry['price']:,}".replace(',', '\xa0'))
+                    for entry in listings)
+    return PAGE.format(items=items).encode('utf-8')
+
+
+def detail_page(entry: Dict) -> bytes:
+    return DETAIL_PAGE.format(**entry).encode('utf-8')
+
+
+class FinnServer:
+    """Local http server serving search pages, ``{location: [page 1 listings, page 2 listings, ...]}``.
+
+    Pages beyond the last are served without results, like finn.no does. Responses are sent over
+    keep-alive connections with an ETag, and gzip compressed if compress is set and the client
+    accepts it. Detail pages are served for every listing on a search page. Requested paths are
+    recorded in requests, client addresses in connections. The first failures[path] requests of
+    a path are answered with 503.
+    """
+
+    def __init__(self, locations: Dict[str, List[List[Dict]]], delay: float = 0., compress: bool = False) -> None:
+        self.locations = locations
+        self.delay = delay
+        self.compress = compress
+        self.requests: List[str] = []
+        self.statuses: List[int] = []
+        self.connections = set()
+        self.failures: Dict[str, int] = {}
+        self.headers: List[Dict[str, str]] = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def body(self, path: str) -> Optional[bytes]:
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        if url.path == '/realestate/homes/ad.html':
+            finn_id = int(query.get('finnkode', ['0'])[0])
+            for pages in self.locations.values():
+                for entries in pages:
+                    for entry in entries:
+                        if entry['finn_id'] == finn_id:
+                            return detail_page(entry)
+            return None
+        if url.path != '/realestate/homes/search.html':
+            return None
+        pages = self.locations.get(query.get('location', [''])[0], [])
+        page = int(query.get('page', ['1'])[0])
+        return search_page(pages[page - 1] if page <= len(pages) else [])
+
+    def __enter__(self) -> 'FinnServer':
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with fixture._lock:
+                    fixture.connections.add(self.client_address)
+                    fixture.requests.append(self.path)
+                    fixture.headers.append(dict(self.headers))
+                    fixture.active += 1
+                    fixture.max_active = max(fixture.max_active, fixture.active)
+                try:
+                    if fixture.delay:
+                        threading.Event().wait(fixture.delay)
+                    with fixture._lock:
+                        fail = fixture.failures.get(self.path, 0) > 0
+                        if fail:
+                            fixture.failures[self.path] -= 1
+                    if fail:
+                        fixture.statuses.append(503)
+                        self.send_error(503)
+                        return
+                    body = fixture.body(self.path)
+                    if body is None:
+                        fixture.statuses.append(404)
+                        self.send_error(404)
+                        return
+                    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                    if self.headers.get('If-None-Match') == etag:
+                        fixture.statuses.append(304)
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.end_headers()
+                        return
+                    if fixture.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                        body = gzip.compress(body)
+                        encoding = 'gzip'
+                    else:
+                        encoding = 'identity'
+                    fixture.statuses.append(200)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Encoding', encoding)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with fixture._lock:
+                        fixture.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+from ap.harvester.detail_fetcher import DetailFetcher, DetailWorker
+from ap.harvester.http_client import HttpClient
+from ap.harvester.page_cache import PageCache
+from ap.tests.test_harvester.finn_pages import FinnServer, detail_page, listing
+from ap.tests.test_harvester.test_fetcher import make_activity
+
+
+def test_page_cache(tmp_path):
+    cache = PageCache(str(tmp_path), max_bytes=None)
+    digest = cache.put('http://a/1', b'page one')
+    assert cache.put('http://a/2', b'page one') == digest
+    assert cache.get('http://a/1') == cache.get('http://a/2') == b'page one'
+    assert cache.size() == len(b'page one')
+    assert 'http://a/1' in cache and 'http://a/3' not in cache
+    assert cache.get('http://a/3') is None
+
+    cache.put('http://a/1', b'page one, edited')
+    assert cache.get('http://a/1') == b'page one, edited'
+    assert cache.urls() == ['http://a/1', 'http://a/2']
+    cache.disconnect()
+
+
+def test_page_cache_lru_eviction(tmp_path):
+    cache = PageCache(str(tmp_path), max_bytes=250)
+    for i in range(3):
+        cache.put(f'http://a/{i}', bytes([i]) * 100)
+    # the first page was evicted to make room for the third
+    assert cache.urls() == ['http://a/1', 'http://a/2']
+    assert cache.get('http://a/1') is not None
+    cache.put('http://a/3', b'3' * 100)
+    # page 1 was used more recently than page 2
+    assert cache.urls() == ['http://a/1', 'http://a/3']
+    assert cache.size() == 200
+    assert sum(len(files) for _, _, files in os.walk(os.path.join(str(tmp_path), 'objects'))) == 2
+    cache.disconnect()
+
+
+def test_page_cache_counts_size(tmp_path):
+    cache = PageCache(str(tmp_path), max_bytes=250)
+    statements = []
+    cache._connection().set_trace_callback(statements.append)
+    cache.put('http://a/1', b'1' * 100)
+    cache.put('http://a/2', b'1' * 100)
+    cache.put('http://a/3', b'3' * 100)
+    # puts below max_bytes neither sum the sizes nor read the blobs
+    assert not any('SUM' in statement or 'ORDER BY' in statement for statement in statements)
+    cache.put('http://a/4', b'4' * 100)
+    assert cache._size == cache.size() == 200
+    plan = cache._connection().execute("EXPLAIN QUERY PLAN DELETE FROM pages WHERE digest = ?", ('',)).fetchall()
+    assert 'pages_digest' in str(plan)
+    cache.disconnect()
+
+    # the size is counted again when the cache is opened
+    cache = PageCache(str(tmp_path), max_bytes=250)
+    assert cache._size == 200
+    cache.disconnect()
+
+
+def test_fetch_with_retries(tmp_path):
+    entries = [listing(i) for i in range(1, 7)]
+    with FinnServer({'0.20003': [entries]}) as server:
+        url = server.url + '/realestate/homes/ad.html?finnkode={}'
+        server.failures['/realestate/homes/ad.html?finnkode=2'] = 2
+        server.failures['/realestate/homes/ad.html?finnkode=3'] = 5
+        fetcher = DetailFetcher(PageCache(str(tmp_path)), fetch=HttpClient().fetch_always, max_workers=4,
+                                rate=None, retries=3, backoff=0.01)
+        results = {r.url: r for r in fetcher.fetch_many([url.format(i) for i in range(1, 8)])}
+
+        assert results[url.format(2)].body == detail_page(entries[1])
+        assert results[url.format(3)].error.status == 503
+        assert results[url.format(7)].error.status == 404
+        assert sorted(fetcher.cache.urls()) == sorted(url.format(i) for i in (1, 2, 4, 5, 6))
+        assert server.max_active <= 2
+        # only the failed page is requested again, it fails once more before succeeding
+        requests = len(server.requests)
+        results = list(fetcher.fetch_many([url.format(i) for i in range(1, 7)], refresh=False))
+        assert sum(r.cached for r in results) == 5
+        assert all(r.error is None for r in results)
+        assert len(server.requests) == requests + 2
+        fetcher.close()
+        fetcher.cache.disconnect()
+
+
+def test_detail_worker(tmp_path):
+    entries = [listing(i) for i in range(1, 5)]
+    with FinnServer({'0.20003': [entries]}, delay=0.05) as server:
+        url = server.url + '/realestate/homes/ad.html?finnkode={}'
+        fetcher = DetailFetcher(PageCache(str(tmp_path)), fetch=HttpClient().fetch_always, rate=None)
+        worker = DetailWorker(fetcher, max_queued=3, batch_size=2)
+        # the queue is bounded, queuing never waits for fetches
+        assert [worker.put(url.format(i), refresh=False) for i in range(1, 5)] == [True, True, True, False]
+        assert worker.put(url.format(1), refresh=True)
+        assert worker.pending() == {url.format(1): True, url.format(2): False, url.format(3): False}
+
+        worker.start()
+        assert worker.wait_idle(timeout=10.)
+        assert worker.fetched == 3
+        assert worker.pending() == {}
+        worker.stop(timeout=10.)
+        assert not worker.is_running()
+        fetcher.close()
+        assert sorted(fetcher.cache.urls()) == sorted(url.format(i) for i in range(1, 4))
+        fetcher.cache.disconnect()
+
+
+def test_activity_fetches_new_and_changed_details(tmp_path):
+    pages = [[listing(1), listing(2)]]
+    with FinnServer({'0.20003': pages}) as server:
+        activity = make_activity(server, rate=None, detail_url=server.url + '/realestate/homes/ad.html?finnkode={finn_id}')
+        fetcher = DetailFetcher(PageCache(str(tmp_path)), fetch=activity.http.fetch_always, rate=None)
+        activity.details = DetailWorker(fetcher)
+
+        assert activity.queue_details(activity.track_changes(activity.soup_alchemy())) == 0
+        assert activity.details.pending() == {server.url + '/realestate/homes/ad.html?finnkode=1': False,
+                                              server.url + '/realestate/homes/ad.html?finnkode=2': False}
+        activity.details.start()
+        assert activity.details.wait_idle(timeout=10.)
+        assert activity.details.fetched == 2
+        pages[0][0]['price'] = 3300000
+        activity.queue_details(activity.track_changes(activity.soup_alchemy()))
+        assert activity.details.wait_idle(timeout=10.)
+        assert activity.details.fetched == 3
+        assert fetcher.cache.get(server.url + '/realestate/homes/ad.html?finnkode=1') == detail_page(pages[0][0])
+
+        activity.details.stop(timeout=10.)
+        activity.fetcher.close()
+        fetcher.close()
+        fetcher.cache.disconnect()
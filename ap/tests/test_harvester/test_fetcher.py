@@ -0,0 +1,115 @@
+import logging
+import time
+
+import pytest
+
+from ap.harvester.fetcher import HostLimiter, PageFetcher
+from ap.harvester.finn_activity import FULL_WALK_PERIOD, FinnActivity
+from ap.tests.test_harvester.finn_pages import FinnServer, listing
+
+
+def make_activity(server, **kwargs):
+    return FinnActivity(wait_first=False, wakeup_freq=None, exit_event=None, logger=logging.getLogger('test'),
+                        search_url=server.url + '/realestate/homes/search.html', **kwargs)
+
+
+def test_walks_all_pages_of_all_locations():
+    locations = {
+        '0.20003': [[listing(1), listing(2)], [listing(3), listing(4, sq_m='45 - 60')], [listing(5)]],
+        '0.20061': [[listing(6), listing(2)]],
+    }
+    with FinnServer(locations) as server:
+        activity = make_activity(server, locations=['0.20003', '0.20061'], rate=None)
+        data = activity.soup_alchemy()
+        activity.fetcher.close()
+
+    assert sorted(d["finn_id"] for d in data) == [1, 2, 3, 5, 6]
+    assert {"finn_id": 1, "address": "Storgata 1, 0155 Oslo", "price": 3500000, "sq_m": 50} in data
+    # every page up to and including the first empty page of each location
+    fetched = {path for path in server.requests}
+    for location, pages in locations.items():
+        for page in range(1, len(pages) + 2):
+            assert f'/realestate/homes/search.html?location={location}&page={page}' in fetched
+
+
+def test_parse_workers(tmp_path):
+    locations = {'0.20003': [[listing(1), listing(2)], [listing(3), listing(4, sq_m='45 - 60')], [listing(5)]]}
+    with FinnServer(locations) as server:
+        activity = make_activity(server, rate=None, parse_workers=2, fetch_details=False, data_dir=str(tmp_path))
+        activity.startup()
+        try:
+            assert activity._parse_pool is not None
+            data = activity.soup_alchemy()
+        finally:
+            activity.cleanup(started=True, graceful=True)
+
+    assert sorted(d["finn_id"] for d in data) == [1, 2, 3, 5]
+    assert {"finn_id": 1, "address": "Storgata 1, 0155 Oslo", "price": 3500000, "sq_m": 50} in data
+    assert activity._parse_pool is None
+
+
+def test_full_walks_write_price_heartbeats(tmp_path):
+    with FinnServer({}) as server:
+        activity = make_activity(server, rate=None, fetch_details=False, data_dir=str(tmp_path))
+        activity.startup()
+        try:
+            # the second full walk finishes ten minutes sooner after its start than the first
+            activity.sql_ts_db.send_many([("Finn_1", 3500000, 1000), ("Finn_1", 3500000, 1000 + FULL_WALK_PERIOD - 600),
+                                          ("Finn_1", 3500000, 1000 + FULL_WALK_PERIOD)])
+            times, _ = activity.sql_ts_db.get_series("Finn_1")
+            assert list(times) == [1000, 1000 + FULL_WALK_PERIOD - 600]
+        finally:
+            activity.cleanup(started=True, graceful=True)
+
+
+def test_max_pages():
+    with FinnServer({'0.20003': [[listing(i)] for i in range(10)]}) as server:
+        activity = make_activity(server, max_pages=3, rate=None)
+        data = activity.soup_alchemy()
+        activity.fetcher.close()
+    assert len(data) == 3
+    assert len(server.requests) == 3
+
+
+def test_per_host_concurrency():
+    locations = {str(i): [[listing(10 * i + j)] for j in range(3)] for i in range(4)}
+    with FinnServer(locations, delay=0.05) as server:
+        fetcher = PageFetcher(max_workers=8, per_host=2, rate=None)
+        urls = [f'{server.url}/realestate/homes/search.html?location={i}&page=1' for i in range(8)]
+        assert len(list(fetcher.fetch_all(urls))) == 8
+        fetcher.close()
+    assert server.max_active == 2
+
+
+def test_rate_limit():
+    limiter = HostLimiter(per_host=4, rate=20.)
+    t1 = time.monotonic()
+    for _ in range(5):
+        limiter.call('http://example.com/', lambda url: b'')
+    assert time.monotonic() - t1 >= 4 / 20. - 0.01
+
+
+def test_fetch_error():
+    with FinnServer({}) as server:
+        fetcher = PageFetcher(rate=None)
+        with pytest.raises(Exception):
+            list(fetcher.walk_pages([lambda page: f'{server.url}/missing?page={page}'], lambda body: [body]))
+        fetcher.close()
+
+
+def test_failures_beyond_the_end_are_ignored():
+    def fetch(url):
+        page = int(url.split('=')[-1])
+        if page == 3:
+            raise OSError('gone')
+        if page == 2:
+            # the failure of page 3 completes before page 2, the end of the results
+            time.sleep(0.1)
+            return b''
+        return b'item'
+
+    fetcher = PageFetcher(rate=None, fetch=fetch)
+    pages = list(fetcher.walk_pages([lambda page: f'http://finn/search?page={page}'],
+                                    lambda body: [body] if body else []))
+    fetcher.close()
+    assert [page for _, page, _ in pages] == [1]
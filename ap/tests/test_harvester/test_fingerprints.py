@@ -0,0 +1,112 @@
+import logging
+
+from ap.harvester.finn_parser import item_fragments, result_items, extract_listing
+from ap.harvester.fingerprints import FingerprintIndex, fingerprint
+from ap.tests.test_harvester.finn_pages import FinnServer, listing, search_page
+from ap.tests.test_harvester.test_fetcher import make_activity
+from ap.tests.test_harvester.test_finn_parser import read_page
+
+
+def test_item_fragments():
+    page = read_page()
+    fragments = item_fragments(page)
+    assert len(fragments) == 50
+    assert [extract_listing(result_items(f)[0]) for f in fragments] == \
+        [extract_listing(i) for i in result_items(page)]
+    assert all(f.endswith(b'</div>') and f.count(b'<div') == f.count(b'</div>') for f in fragments)
+    assert item_fragments(search_page([])) == []
+
+
+def test_item_start_attributes():
+    page = search_page([listing(1), listing(2), listing(3)])
+    expected = [extract_listing(result_items(f)[0]) for f in item_fragments(page)]
+    reordered = page.replace(b'<div class="unit flex align-items-stretch result-item">',
+                             b'<div data-id="x" class="unit flex align-items-stretch result-item">', 1)
+    reordered = reordered.replace(b'<div class="unit flex align-items-stretch result-item">',
+                                  b"<DIV class='unit flex align-items-stretch result-item' id=\"y\">", 1)
+    fragments = item_fragments(reordered)
+    assert len(fragments) == 3
+    assert [extract_listing(result_items(f)[0]) for f in fragments] == expected
+
+
+def test_item_fragments_fall_back_to_parsing(caplog):
+    # markup the scan does not match, but the parser decodes
+    page = search_page([listing(1), listing(2)]).replace(b'stretch result-item', b'stretch&#32;result-item')
+    with caplog.at_level(logging.WARNING):
+        fragments = item_fragments(page)
+    assert [extract_listing(result_items(f)[0])["finn_id"] for f in fragments] == [1, 2]
+    assert 'Found no result items scanning the page' in caplog.text
+    caplog.clear()
+    # pages without results do not fall back
+    assert item_fragments(search_page([])) == []
+    assert not caplog.records
+
+
+def test_fingerprint_index():
+    index = FingerprintIndex()
+    first, second = fingerprint(b'<div>1</div>'), fingerprint(b'<div>2</div>')
+    assert not index.seen(first)
+    # checking does not record the fingerprint
+    assert not index.seen(first)
+    index.add(first)
+    assert index.seen(first) and not index.seen(second)
+    index.add(first)
+    index.add(second)
+    assert len(index) == 2
+    index.clear()
+    assert len(index) == 0
+
+
+def flush(activity):
+    for writer in (activity.ts_writer, activity.table_writer):
+        assert writer.flush(timeout=10.)
+
+
+def test_unchanged_items_are_skipped(tmp_path):
+    pages = [[listing(1), listing(2), listing(3)], [listing(4)]]
+    with FinnServer({'0.20003': pages}) as server:
+        activity = make_activity(server, rate=None, fetch_details=False, data_dir=str(tmp_path))
+        activity.startup()
+        extracted = []
+        extract = activity.extract_listing
+        activity.extract_listing = lambda item: extracted.append(item) or extract(item)
+        try:
+            activity.action()
+            flush(activity)
+            assert len(extracted) == 4
+
+            pages[0][1]['price'] = 2990000
+            pages[1].append(listing(5))
+            assert sorted(d["finn_id"] for d in activity.soup_alchemy()) == [2, 5]
+            assert len(extracted) == 4 + 2
+
+            # the first walk of a day returns every listing
+            activity._next_full_walk = 0.
+            assert len(activity.soup_alchemy()) == 5
+        finally:
+            activity.cleanup(started=True, graceful=True)
+
+
+def test_items_are_parsed_again_after_failed_writes(tmp_path):
+    with FinnServer({'0.20003': [[listing(1), listing(2)]]}) as server:
+        activity = make_activity(server, rate=None, fetch_details=False, data_dir=str(tmp_path))
+        activity.startup()
+        write_many = activity.sql_table.write_many
+
+        def failing_write_many(*args, **kwargs):
+            raise OSError('disk full')
+
+        activity.sql_table.write_many = failing_write_many
+        try:
+            # parsing does not mark items as seen, their writes do
+            activity.action()
+            flush(activity)
+            assert activity.table_writer.get_error() is not None
+            assert len(activity.soup_alchemy()) == 2
+
+            activity.sql_table.write_many = write_many
+            activity.action()
+            flush(activity)
+            assert activity.soup_alchemy() == []
+        finally:
+            activity.cleanup(started=True, graceful=True)
@@ -0,0 +1,36 @@
+import os
+
+from ap.harvester import finn_parser
+from ap.harvester.parse_benchmark import available_parsers, run
+from ap.tests.test_harvester.finn_pages import listing, search_page
+
+SEARCH_PAGE = os.path.join(os.path.dirname(__file__), 'data', 'search_page.html')
+
+
+def read_page():
+    with open(SEARCH_PAGE, 'rb') as page_file:
+        return page_file.read()
+
+
+def test_strained_parse_matches_full_tree():
+    page = read_page()
+    full = finn_parser.result_items(page, strain=False)
+    strained = finn_parser.result_items(page)
+    assert len(full) == len(strained) == 50
+    assert [finn_parser.extract_listing(i) for i in full] == [finn_parser.extract_listing(i) for i in strained]
+    # three project listings with a range of sizes are skipped
+    assert len(finn_parser.parse_listings(page)) == 47
+
+
+def test_extract_listing():
+    page = search_page([listing(1, price=4250000, sq_m='62'), listing(2, sq_m='45 - 60')])
+    assert finn_parser.parse_listings(page) == [
+        {"finn_id": 1, "address": "Storgata 1, 0155 Oslo", "price": 4250000, "sq_m": 62}]
+
+
+def test_parse_benchmark():
+    report = run([SEARCH_PAGE], repeat=1)
+    assert len(report["results"]) == 2 * len(available_parsers())
+    for result in report["results"]:
+        assert result["items"] == 50
+        assert result["peak_memory_bytes"] > 0
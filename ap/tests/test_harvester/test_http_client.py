@@ -0,0 +1,64 @@
+import gzip
+import zlib
+
+import pytest
+
+from ap.harvester.http_client import HttpClient, HttpError, decode_body
+from ap.harvester.fetcher import PageFetcher
+from ap.tests.test_harvester.finn_pages import FinnServer, listing, search_page
+from ap.tests.test_harvester.test_fetcher import make_activity
+
+
+def test_decode_body():
+    body = b'<html>' * 100
+    assert decode_body(gzip.compress(body), 'gzip') == body
+    assert decode_body(zlib.compress(body), 'deflate') == body
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    assert decode_body(raw.compress(body) + raw.flush(), 'deflate') == body
+    assert decode_body(body, None) == body
+    with pytest.raises(ValueError):
+        decode_body(body, 'br')
+
+
+def test_keep_alive_compression_and_revalidation():
+    pages = [[listing(1)], [listing(2)]]
+    with FinnServer({'0.20003': pages}, compress=True) as server:
+        client = HttpClient()
+        url = f'{server.url}/realestate/homes/search.html?location=0.20003&page=1'
+        first = client.get(url)
+        assert first.body == search_page(pages[0]) and first.headers['Content-Encoding'] == 'gzip'
+        second = client.get(url)
+        assert second.not_modified and second.body is None
+        assert client.get(url, conditional=False).body == search_page(pages[0])
+
+        pages[0].append(listing(3))
+        assert client.fetch(url) == search_page(pages[0])
+        with pytest.raises(HttpError):
+            client.get(f'{server.url}/missing')
+        client.close()
+
+    assert server.statuses == [200, 304, 200, 200, 404]
+    assert 'If-None-Match' not in server.headers[0] and 'If-None-Match' in server.headers[1]
+    # every request went over the same connection
+    assert len(server.connections) == 1
+
+
+def test_unchanged_pages_are_not_parsed():
+    locations = {'0.20003': [[listing(1)], [listing(2)], [listing(3)]]}
+    with FinnServer(locations) as server:
+        activity = make_activity(server, rate=None)
+        parsed = []
+        item_fragments = activity.item_fragments
+        activity.item_fragments = lambda body: parsed.append(body) or item_fragments(body)
+
+        assert len(activity.soup_alchemy()) == 3
+        assert len(parsed) == 4
+        # nothing changed, every page is revalidated and the walk still stops at the empty page
+        assert activity.soup_alchemy() == []
+        assert len(parsed) == 4
+        assert server.statuses.count(304) >= 4
+
+        locations['0.20003'][1][0]['price'] = 3000000
+        assert activity.soup_alchemy() == [listing(2, price=3000000) | {'sq_m': 50}]
+        activity.fetcher.close()
+        activity.http.close()
@@ -0,0 +1,378 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from threading import Event
+
+import pytest
+
+from ap.harvester.harvester import ActivityABC, ActivityBase, AsyncActivityABC
+from ap.harvester.manager import CollectorManager, CollectorMonitor, ExecutionMode, ProcessActivity
+
+
+class CountingActivity(ActivityABC):
+    """Activity counting its actions into a shared dictionary, failing once after fail_after actions."""
+
+    def __init__(self, *, counts, key, fail_after=None, wait=0.01, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.wait = wait
+        self.counts = counts
+        self.key = key
+        self.fail_after = fail_after
+        self.actions = 0
+
+    @property
+    def name(self) -> str:
+        return 'CountingActivity'
+
+    def startup(self) -> None:
+        self.counts.setdefault(f'{self.key}.starts', 0)
+        self.counts[f'{self.key}.starts'] += 1
+
+    def wait_for(self) -> float:
+        return self.wait
+
+    def action(self) -> None:
+        self.counts[self.key] = self.counts.get(self.key, 0) + 1
+        self.actions += 1
+        if self.fail_after is not None and self.actions >= self.fail_after and self.counts[f'{self.key}.starts'] == 1:
+            raise RuntimeError(f'{self.key} failed')
+
+    def cleanup(self, started: bool, graceful: bool) -> None:
+        pass
+
+
+class AsyncCountingActivity(AsyncActivityABC):
+    """Async counterpart of CountingActivity."""
+
+    def __init__(self, *, counts, key, fail_after=None, wait=0.01, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.wait = wait
+        self.counts = counts
+        self.key = key
+        self.fail_after = fail_after
+        self.actions = 0
+
+    @property
+    def name(self) -> str:
+        return 'AsyncCountingActivity'
+
+    async def startup(self) -> None:
+        self.counts[f'{self.key}.starts'] = self.counts.get(f'{self.key}.starts', 0) + 1
+
+    async def wait_for(self) -> float:
+        return self.wait
+
+    async def action(self) -> None:
+        await asyncio.sleep(0)
+        self.counts[self.key] = self.counts.get(self.key, 0) + 1
+        self.actions += 1
+        if self.fail_after is not None and self.actions >= self.fail_after and self.counts[f'{self.key}.starts'] == 1:
+            raise RuntimeError(f'{self.key} failed')
+
+    async def cleanup(self, started: bool, graceful: bool) -> None:
+        self.counts[f'{self.key}.cleanups'] = self.counts.get(f'{self.key}.cleanups', 0) + 1
+
+
+class MarkerActivity(ActivityABC):
+    """Activity recording its starts and actions in files, as it may run in another process."""
+
+    def __init__(self, *, directory, key, fail=False, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.path = os.path.join(directory, key)
+        self.fail = fail
+
+    @property
+    def name(self) -> str:
+        return 'MarkerActivity'
+
+    def startup(self) -> None:
+        with open(self.path + '.starts', 'a') as marker:
+            marker.write(f'{os.getpid()}\n')
+        self.logger.info(f'started {os.path.basename(self.path)}')
+
+    def wait_for(self) -> float:
+        return 0.01
+
+    def action(self) -> None:
+        with open(self.path + '.actions', 'a') as marker:
+            marker.write('.')
+        if self.fail and len(lines(self.path + '.starts')) == 1:
+            raise ValueError('first start fails')
+
+    def cleanup(self, started: bool, graceful: bool) -> None:
+        with open(self.path + '.cleanups', 'a') as marker:
+            marker.write(f'{graceful}\n')
+
+
+def lines(path):
+    try:
+        with open(path) as marker:
+            return marker.read().split()
+    except FileNotFoundError:
+        return []
+
+
+def wait_until(condition, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def make_manager(counts, instances, poll_freq=0.01):
+    return CollectorManager(
+        collectors={}, monitor_poll_freq=poll_freq, default_wait_first=False, default_wakeup_freq=None,
+        logger=logging.getLogger('test_manager'),
+        instances={instance_id: (CountingActivity, dict(counts=counts, key=instance_id, **args))
+                   for instance_id, args in instances.items()},
+    )
+
+
+def test_instances_of_one_collector_run_concurrently():
+    counts = {}
+    manager = make_manager(counts, {'oslo': {}, 'bergen': {}, 'trondheim': {}})
+    manager.start()
+    try:
+        wait_until(lambda: all(counts.get(key, 0) >= 3 for key in ('oslo', 'bergen', 'trondheim')))
+        assert manager.is_running(collector=CountingActivity)
+        assert all(manager.is_running(instance_id=key) for key in ('oslo', 'bergen', 'trondheim'))
+        assert sorted(manager.instances()) == ['bergen', 'oslo', 'trondheim']
+    finally:
+        manager.exit()
+        manager.block_on_monitor(timeout=5.)
+    assert not manager.is_running()
+
+
+def test_instances_are_dropped_and_restarted_independently():
+    counts = {}
+    manager = make_manager(counts, {'oslo': {}, 'bergen': {}, 'tromso': dict(fail_after=2)})
+    manager.start()
+    try:
+        wait_until(lambda: manager.is_running(instance_id='oslo') and manager.is_running(instance_id='bergen'))
+
+        # a failing instance is restarted alone
+        wait_until(lambda: counts.get('tromso.starts', 0) >= 2)
+        assert counts['oslo.starts'] == counts['bergen.starts'] == 1
+
+        # a dropped instance exits, the others keep running
+        manager.exit(instance_id='oslo')
+        wait_until(lambda: not manager.is_running(instance_id='oslo'))
+        before = counts['bergen']
+        wait_until(lambda: counts['bergen'] > before)
+        assert 'oslo' not in manager.instances()
+
+        # a restarted instance starts again with the same arguments
+        manager.restart('bergen')
+        wait_until(lambda: counts['bergen.starts'] == 2 and manager.is_running(instance_id='bergen'))
+        assert counts['tromso.starts'] == 2
+
+        # instances can be added while running
+        manager.add_instance('stavanger', CountingActivity, dict(counts=counts, key='stavanger'))
+        wait_until(lambda: counts.get('stavanger', 0) >= 1)
+        with pytest.raises(ValueError):
+            manager.add_instance('stavanger', CountingActivity, dict(counts=counts, key='stavanger'))
+    finally:
+        manager.exit()
+        manager.block_on_monitor(timeout=5.)
+    assert not manager.is_running()
+
+
+def test_exits_do_not_wait_for_polls_or_waits():
+    counts = {}
+    # neither the monitor poll nor the waits between actions end during the test
+    manager = make_manager(counts, {'oslo': dict(wait=600.), 'bergen': dict(wait=600.)}, poll_freq=600.)
+    manager.start()
+    try:
+        wait_until(lambda: counts.get('oslo') == 1 and counts.get('bergen') == 1)
+
+        t1 = time.monotonic()
+        manager.exit(instance_id='oslo')
+        wait_until(lambda: not manager.is_running(instance_id='oslo'))
+        assert time.monotonic() - t1 < 1.
+        assert manager.is_running(instance_id='bergen')
+
+        manager.restart('bergen')
+        wait_until(lambda: counts['bergen.starts'] == 2 and counts['bergen'] == 2)
+        assert time.monotonic() - t1 < 2.
+    finally:
+        t1 = time.monotonic()
+        manager.exit()
+        manager.block_on_monitor(timeout=5.)
+    assert not manager.is_running()
+    assert time.monotonic() - t1 < 1.
+
+
+def test_monitor_names_threads_and_loggers_by_instance():
+    counts = {}
+    monitor = CollectorMonitor(poll_freq=0.01, exit_event=Event(),
+                               logger=logging.getLogger('test_manager'))
+    monitor.add_collector(collector=CountingActivity, args=dict(
+        counts=counts, key='a', wait_first=False, wakeup_freq=None), instance_id='a')
+    monitor.add_collector(collector=CountingActivity, args=dict(
+        counts=counts, key='b', wait_first=False, wakeup_freq=None))
+    monitor._monitoring_step()
+    try:
+        assert sorted(monitor.running_instances()) == ['CountingActivity', 'a']
+        assert monitor.running_collectors() == [CountingActivity]
+        assert monitor._collectors['a'].thread.name == 'CountingActivity[a]'
+        assert monitor._collectors['a'].activity.logger.name == 'test_manager.a.CountingActivity'
+        # the default instance logs like a single collector
+        assert monitor._collectors['CountingActivity'].activity.logger.name == \
+            'test_manager.CountingActivity'
+    finally:
+        for tup in monitor._collectors.values():
+            tup.activity.exit()
+            tup.thread.join(timeout=5.)
+
+
+def test_process_mode(tmp_path):
+    directory = str(tmp_path)
+    manager = CollectorManager(
+        collectors={}, monitor_poll_freq=0.01, default_wait_first=False, default_wakeup_freq=None,
+        logger=logging.getLogger('test_manager'), mode=ExecutionMode.PROCESS,
+        instances={key: (MarkerActivity, dict(directory=directory, key=key, fail=key == 'tromso'))
+                   for key in ('oslo', 'bergen', 'tromso')},
+    )
+    manager.start()
+    try:
+        wait_until(lambda: all(os.path.exists(os.path.join(directory, key + '.actions'))
+                               for key in ('oslo', 'bergen')), timeout=30.)
+        # one process per instance
+        pids = {lines(os.path.join(directory, key + '.starts'))[0] for key in ('oslo', 'bergen')}
+        assert len(pids) == 2 and str(os.getpid()) not in pids
+
+        # a failing process is restarted
+        wait_until(lambda: len(lines(os.path.join(directory, 'tromso.starts'))) == 2, timeout=30.)
+
+        # exits are signalled across processes
+        manager.exit(instance_id='oslo')
+        wait_until(lambda: not manager.is_running(instance_id='oslo'), timeout=30.)
+        assert lines(os.path.join(directory, 'oslo.cleanups')) == ['True']
+        assert manager.is_running(instance_id='bergen')
+    finally:
+        manager.exit()
+        manager.block_on_monitor(timeout=30.)
+    assert not manager.is_running()
+    assert lines(os.path.join(directory, 'bergen.cleanups')) == ['True']
+
+
+def test_process_errors_are_propagated(tmp_path):
+    monitor = CollectorMonitor(poll_freq=0.01, exit_event=Event(), logger=logging.getLogger('test_manager'),
+                               mode=ExecutionMode.PROCESS)
+    monitor.add_collector(collector=MarkerActivity, args=dict(
+        directory=str(tmp_path), key='a', fail=True, wait_first=False, wakeup_freq=None))
+    monitor._monitoring_step()
+    collector_tup = monitor._collectors['MarkerActivity']
+    collector_tup.thread.join(timeout=30.)
+
+    assert not collector_tup.thread.is_alive()
+    error = collector_tup.activity.get_error()
+    assert isinstance(error, ValueError) and str(error) == 'first start fails'
+    assert lines(os.path.join(str(tmp_path), 'a.cleanups')) == ['False']
+
+
+def test_process_pipes_are_closed(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    activities = []  # kept, so pipes are not closed by garbage collection
+
+    def run_once():
+        activity = ProcessActivity(MarkerActivity, dict(directory=str(tmp_path), key='a', wait_first=False,
+                                                        wakeup_freq=None),
+                                   name='a', exit_event=Event(), logger=logging.getLogger('test_manager'),
+                                   log_queue=log_queue, context=context)
+        activity.start()
+        wait_until(lambda: os.path.exists(os.path.join(str(tmp_path), 'a.actions')), timeout=30.)
+        activity.exit()
+        activity.process.join(timeout=30.)
+        activity.close()
+        assert activity.get_error() is None
+        # the sentinel of the process, released with the process handle by the monitor
+        activity.process.close()
+        activities.append(activity)
+
+    run_once()
+    open_fds = len(os.listdir('/proc/self/fd'))
+    for _ in range(3):
+        run_once()
+    assert len(os.listdir('/proc/self/fd')) == open_fds
+
+
+def test_process_logs_are_forwarded(tmp_path, caplog):
+    manager = CollectorManager(
+        collectors={}, monitor_poll_freq=0.01, default_wait_first=False, default_wakeup_freq=None,
+        logger=logging.getLogger('test_manager'), mode=ExecutionMode.PROCESS,
+        instances={'oslo': (MarkerActivity, dict(directory=str(tmp_path), key='oslo'))},
+    )
+    with caplog.at_level(logging.INFO, logger='test_manager'):
+        manager.start()
+        try:
+            wait_until(lambda: any(record.getMessage() == 'started oslo' for record in caplog.records), timeout=30.)
+        finally:
+            manager.exit()
+            manager.block_on_monitor(timeout=30.)
+    record = next(record for record in caplog.records if record.getMessage() == 'started oslo')
+    assert record.process != os.getpid()
+    assert record.name.startswith('test_manager.')
+
+
+def test_activities_share_exit_and_error_state():
+    for activity_type in (CountingActivity, AsyncCountingActivity):
+        exit_event = Event()
+        activity = activity_type(counts={}, key='a', fail_after=1, wait_first=False, wakeup_freq=None,
+                                 exit_event=exit_event, logger=logging.getLogger('test_manager'))
+        assert isinstance(activity, ActivityBase)
+        activity()
+        assert isinstance(activity.get_error(), RuntimeError) and not activity.exiting()
+        exit_event.set()
+        assert activity.exiting()
+
+
+def test_async_activities_share_one_event_loop():
+    counts = {}
+    keys = [f'search{i}' for i in range(200)]
+    threads = threading.active_count()
+    manager = CollectorManager(
+        collectors={}, monitor_poll_freq=600., default_wait_first=False, default_wakeup_freq=None,
+        logger=logging.getLogger('test_manager'),
+        instances={key: (AsyncCountingActivity, dict(counts=counts, key=key, wait=0.05, fail_after=2 if key == 'search0' else None))
+                   for key in keys},
+    )
+    manager.start()
+    try:
+        wait_until(lambda: all(counts.get(key, 0) >= 2 for key in keys))
+        # the monitor and the event loop
+        assert threading.active_count() <= threads + 2
+        assert manager.is_running(collector=AsyncCountingActivity)
+
+        # a failing activity is restarted
+        wait_until(lambda: counts.get('search0.starts') == 2)
+
+        # waits end as soon as activities are dropped or restarted
+        manager.exit(instance_id='search1')
+        manager.restart('search2')
+        wait_until(lambda: not manager.is_running(instance_id='search1') and counts['search2.starts'] == 2)
+        assert counts['search1.cleanups'] == 1
+    finally:
+        t1 = time.monotonic()
+        manager.exit()
+        manager.block_on_monitor(timeout=5.)
+    assert not manager.is_running()
+    assert time.monotonic() - t1 < 1.
+    assert all(counts[f'{key}.cleanups'] == counts[f'{key}.starts'] for key in keys)
+
+
+def test_async_activity_runs_on_its_own_event_loop():
+    counts = {}
+    activity = AsyncCountingActivity(counts=counts, key='a', wait=600., wait_first=False, wakeup_freq=None,
+                                     exit_event=Event(), logger=logging.getLogger('test_manager'))
+    thread = threading.Thread(target=activity)
+    thread.start()
+    wait_until(lambda: counts.get('a') == 1)
+    activity.exit()
+    thread.join(timeout=1.)
+    assert not thread.is_alive()
+    assert counts['a.cleanups'] == 1 and activity.get_error() is None
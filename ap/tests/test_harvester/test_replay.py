@@ -0,0 +1,94 @@
+import json
+import os
+from threading import Event
+
+import pytest
+
+from ap.harvester import example_harvester, replay_benchmark
+from ap.harvester.http_client import HttpError, set_default_client
+from ap.harvester.replay import RecordingClient, ReplayClient, read_corpus
+from ap.tests.test_harvester.finn_pages import FinnServer, detail_page, listing
+from ap.tests.test_harvester.test_fetcher import make_activity
+
+
+def record(corpus, server, pages):
+    """Record two walks of the search pages, with a price change in between."""
+    activity = make_activity(server, rate=None, http_client=RecordingClient(corpus))
+    activity.soup_alchemy()
+    pages[0][0]['price'] = 3100000
+    activity.soup_alchemy()
+    activity.fetcher.close()
+    return activity
+
+
+def test_record_and_replay(tmp_path):
+    corpus = str(tmp_path / 'corpus')
+    pages = [[listing(1), listing(2)], [listing(3)]]
+    with FinnServer({'0.20003': pages}) as server:
+        record(corpus, server, pages)
+        search_url = server.url + '/realestate/homes/search.html'
+    responses = read_corpus(corpus)
+    assert all(r.status == 200 for r in responses)
+    # two pages with listings and the empty page of the first walk, then only page 1 changed
+    assert len(os.listdir(os.path.join(corpus, 'bodies'))) == 4
+
+    # the server is gone, the activity walks the recorded pages like it did when recording
+    activity = make_activity(server, rate=None, http_client=ReplayClient(corpus))
+    assert sorted(d["finn_id"] for d in activity.soup_alchemy()) == [1, 2, 3]
+    # nothing was written, so listing 2 is parsed again with the changed page 1
+    data = activity.soup_alchemy()
+    assert sorted(d["finn_id"] for d in data) == [1, 2]
+    assert listing(1, price=3100000) | {'sq_m': 50} in data
+    # the corpus is exhausted, the last responses repeat and are not modified
+    assert activity.soup_alchemy() == []
+    with pytest.raises(HttpError):
+        activity.http.get(search_url + '?location=0.1')
+    activity.fetcher.close()
+
+
+def test_replay_speed(tmp_path):
+    corpus = str(tmp_path)
+    os.makedirs(os.path.join(corpus, 'bodies'))
+    with open(os.path.join(corpus, 'responses.jsonl'), 'w') as index_file:
+        for recorded_at, body in ((1000., b'first'), (1100., b'second')):
+            with open(os.path.join(corpus, 'bodies', body.decode()), 'wb') as body_file:
+                body_file.write(body)
+            index_file.write(json.dumps(dict(url='http://finn/a', recorded_at=recorded_at, status=200,
+                                             headers={}, digest=body.decode())) + '\n')
+
+    client = ReplayClient(corpus, speed=1000.)
+    assert client.fetch('http://finn/a') == b'first'
+    assert client.fetch('http://finn/a') is None
+    Event().wait(0.15)
+    # 150 recorded seconds later
+    assert client.fetch('http://finn/a') == b'second'
+    assert client.fetch_always('http://finn/a') == b'second'
+
+
+def test_replay_detail_soup(tmp_path):
+    corpus = str(tmp_path)
+    entry = listing(115039377)
+    with FinnServer({'0.20003': [[entry]]}) as server:
+        client = RecordingClient(corpus)
+        url = server.url + '/realestate/homes/ad.html?finnkode=115039377'
+        assert client.fetch_always(url) == detail_page(entry)
+
+    set_default_client(ReplayClient(corpus))
+    try:
+        client = example_harvester.default_client()
+        assert client.fetch_always(url) == detail_page(entry)
+    finally:
+        set_default_client(None)
+
+
+def test_replay_benchmark(tmp_path):
+    corpus = str(tmp_path / 'corpus')
+    pages = [[listing(1), listing(2)], [listing(3)]]
+    with FinnServer({'0.20003': pages}) as server:
+        record(corpus, server, pages)
+
+    report = replay_benchmark.run(corpus, actions=2, data_dir=str(tmp_path / 'data'))
+    assert report["locations"] == ['0.20003']
+    assert len(report["action_seconds"]) == 2
+    assert report["listings"] == 3
+    assert report["prices"] >= 3
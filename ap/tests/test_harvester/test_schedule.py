@@ -0,0 +1,69 @@
+import random
+import time
+from datetime import datetime
+
+from ap.harvester.schedule import AdaptiveSchedule, TimeOfDayProfile
+
+
+def at(hour, minute=0):
+    return time.mktime(datetime(2020, 3, 2, hour, minute).timetuple())
+
+
+def test_time_of_day_profile():
+    profile = TimeOfDayProfile({0.: 4., 6.5: 1., 22.: 2.})
+    assert profile.factor(at(3)) == 4.
+    assert profile.factor(at(6, 29)) == 4.
+    assert profile.factor(at(6, 30)) == 1.
+    assert profile.factor(at(23)) == 2.
+    # the last factor wraps around midnight
+    assert TimeOfDayProfile({8.: 1., 20.: 3.}).factor(at(2)) == 3.
+
+
+def test_wait_follows_change_rate():
+    schedule = AdaptiveSchedule(min_wait=10., max_wait=600., target_changes=5., smoothing=1., jitter=0.)
+    assert schedule.next_wait() == 10.
+    schedule.record(100, now=0.)
+    # the first action only starts the clock
+    assert schedule.rate is None
+    schedule.record(5, now=100.)
+    assert schedule.next_wait() == 100.
+    schedule.record(50, now=200.)
+    assert schedule.next_wait() == 10.
+    schedule.record(0, now=300.)
+    assert schedule.next_wait() == 600.
+
+
+def test_quiet_source_backs_off_gradually():
+    schedule = AdaptiveSchedule(min_wait=20., max_wait=600., target_changes=5., smoothing=0.5, jitter=0.)
+    schedule.record(0, now=0.)
+    schedule.record(5, now=20.)
+    now, waits = 20., []
+    for _ in range(6):
+        now += schedule.next_wait()
+        schedule.record(0, now=now)
+        waits.append(schedule.next_wait())
+    assert waits == sorted(waits) and waits[0] < waits[-1] == 600.
+
+
+def test_profile_and_jitter():
+    schedule = AdaptiveSchedule(min_wait=20., max_wait=600., smoothing=1., jitter=0.1,
+                                profile=TimeOfDayProfile({0.: 4., 6.: 1.}), rng=random.Random(0))
+    schedule.record(0, now=0.)
+    schedule.record(5, now=50.)
+    waits = [schedule.next_wait(at(12)) for _ in range(100)]
+    assert all(45. <= wait <= 55. for wait in waits) and len(set(waits)) > 1
+    assert all(180. <= schedule.next_wait(at(3)) <= 220. for _ in range(100))
+
+
+def test_profile_stays_within_bounds():
+    schedule = AdaptiveSchedule(min_wait=20., max_wait=600., smoothing=1., jitter=0.,
+                                profile=TimeOfDayProfile({0.: 4., 6.: 0.5}))
+    # a fast source at busy hours is still waited on for min_wait
+    schedule.record(0, now=0.)
+    schedule.record(50, now=50.)
+    assert schedule.next_wait(at(12)) == 20.
+    assert schedule.next_wait(at(3)) == 20.
+    # a quiet source at quiet hours waits max_wait at most
+    schedule.record(0, now=100.)
+    assert schedule.next_wait(at(3)) == 600.
+    assert schedule.next_wait(at(12)) == 300.
@@ -0,0 +1,93 @@
+"""Conformance tests every time series backend in ap.sql_toolbox.backends has to pass."""
+import numpy as np
+import pytest
+
+from ap.sql_toolbox.backends import create_backend, backend_names, register_backend, MemoryTsDb, MmapTsDb
+
+
+@pytest.fixture(params=backend_names())
+def backend(request, tmp_path):
+    if request.param in ('sqlite', 'sqlite_blocks'):
+        kwargs = dict(db_path=str(tmp_path / 'ts.db'), category="price", sql_type="INT")
+        if request.param == 'sqlite_blocks':
+            kwargs['block_size'] = 3
+    elif request.param == 'mmap':
+        kwargs = dict(directory=str(tmp_path / 'columns'), category="price")
+    else:
+        kwargs = dict(category="price")
+    backend = create_backend(request.param, **kwargs)
+    yield backend
+    backend.close()
+
+
+def test_write_and_read(backend):
+    assert backend.send_many([("Finn_1", 10 * t, t) for t in range(1, 8)] + [("Finn/2", 5, 3)]) == 8
+    backend.send_data(input_time=9, series_id="Finn_1", data_value=90)
+
+    times, values = backend.get_series("Finn_1", start=2, end=9)
+    assert times.dtype == np.int64 and values.dtype == np.float64
+    assert times.tolist() == list(range(2, 8))
+    assert values.tolist() == [10. * t for t in range(2, 8)]
+    assert backend.get_series("Finn_1")[0].tolist() == list(range(1, 8)) + [9]
+    assert backend.get_series("missing")[0].size == 0
+    assert backend.series_ids() == ["Finn/2", "Finn_1"]
+
+
+def test_close_keeps_backend_usable(backend):
+    backend.send_many([("Finn_1", 1, 10)])
+    backend.close()
+    backend.send_many([("Finn_1", 2, 20)])
+    assert backend.get_series("Finn_1")[1].tolist() == [1., 2.]
+    with pytest.raises(ValueError):
+        backend.get_many(bucket=0)
+    with pytest.raises(ValueError):
+        backend.get_many(bucket=10, how='median')
+
+
+def test_same_time_keeps_last_value(backend):
+    backend.send_many([("Finn_1", 1, 10), ("Finn_1", 2, 10)])
+    backend.send_many([("Finn_1", 3, 10)])
+    assert backend.get_series("Finn_1")[1].tolist() == [3.]
+
+
+def test_out_of_order_points(backend):
+    backend.send_many([("Finn_1", 10 * t, t) for t in (1, 4, 6)])
+    backend.send_many([("Finn_1", 30, 3), ("Finn_1", 20, 2), ("Finn_1", 41, 4)])
+    backend.send_many([("Finn_1", 50, 5), ("Finn_1", 21, 2)])
+    times, values = backend.get_series("Finn_1")
+    assert times.tolist() == [1, 2, 3, 4, 5, 6]
+    assert values.tolist() == [10., 21., 30., 41., 50., 60.]
+    assert backend.get_series("Finn_1", start=2, end=5)[0].tolist() == [2, 3, 4]
+    if isinstance(backend, MmapTsDb):
+        assert backend.compact() == 1
+        assert backend.get_series("Finn_1")[1].tolist() == [10., 21., 30., 41., 50., 60.]
+
+
+def test_overwrite_after_sealing(backend):
+    # more points than the block size of sqlite_blocks, so the rewritten time is sealed already
+    backend.send_many([("Finn_1", 10 * t, t) for t in range(1, 5)])
+    backend.send_many([("Finn_1", 99, 2)])
+    backend.send_many([("Finn_1", 50, 5), ("Finn_1", 60, 6)])
+    times, values = backend.get_series("Finn_1")
+    assert times.tolist() == [1, 2, 3, 4, 5, 6]
+    assert values.tolist() == [10., 99., 30., 40., 50., 60.]
+
+
+def test_resample(backend):
+    backend.send_many([("Finn_1", v, t) for t, v in ((10, 1), (20, 2), (110, 3), (120, 5))] + [("Finn_2", 7, 50)])
+    series = backend.get_many(bucket=100, how='last')
+    assert series["Finn_1"][0].tolist() == [0, 100]
+    assert series["Finn_1"][1].tolist() == [2., 5.]
+    assert series["Finn_2"][1].tolist() == [7.]
+    for how, expected in (('first', [1., 3.]), ('mean', [1.5, 4.]), ('min', [1., 3.]), ('max', [2., 5.])):
+        assert backend.get_many(["Finn_1"], bucket=100, how=how)["Finn_1"][1].tolist() == expected
+    with pytest.raises(ValueError):
+        backend.get_many(bucket=100, how='median')
+
+
+def test_registry():
+    assert {'sqlite', 'sqlite_blocks', 'memory', 'mmap'} <= set(backend_names())
+    with pytest.raises(ValueError):
+        register_backend('memory', MemoryTsDb)
+    with pytest.raises(ValueError):
+        create_backend('unknown')
@@ -0,0 +1,23 @@
+import json
+
+from ap.sql_toolbox.benchmark import run, synthetic_points
+
+
+def test_synthetic_points():
+    points = synthetic_points(rows=100, series=10)
+    assert len(points) == 100
+    assert len({series_id for series_id, _, _ in points}) == 10
+    assert len(set(points)) == 100
+
+
+def test_benchmark_run(tmp_path):
+    results = run(rows=200, series=20, listings=50, lookups=5, directory=str(tmp_path))
+    json.dumps(results)
+    assert results["table"]["csv_export"]["rows"] == 50
+    assert set(results["backends"]) == {'sqlite', 'sqlite_blocks', 'memory', 'mmap'}
+    for name, result in results["backends"].items():
+        assert result["insert"]["points"] == 200
+        assert result["point_lookup"]["count"] == 5
+        if name != 'memory':
+            assert result["disk_bytes"] > 0
+    assert results["backends"]["sqlite"]["csv_export"]["rows"] == 200
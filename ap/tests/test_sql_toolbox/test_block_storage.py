@@ -0,0 +1,55 @@
+import numpy as np
+
+from ap.sql_toolbox.block_storage import SqlBlockTsDb, encode_block, decode_block
+
+
+def test_block_round_trip():
+    times = np.array([100, 160, 220, 280, 400, 401], dtype=np.int64)
+    for values in (np.array([5000000, 5000000, 5000000, 4900000, 4900000, 5100000]),
+                   np.array([1.5, 2.25, -3., 0., 1e10, 7.])):
+        decoded_times, decoded_values = decode_block(encode_block(times, values))
+        assert decoded_times.tolist() == times.tolist()
+        assert decoded_values.tolist() == values.astype(np.float64).tolist()
+
+    # a constant price sampled regularly compresses to a few bytes
+    times = np.arange(1024, dtype=np.int64) * 20
+    assert len(encode_block(times, np.full(1024, 3500000))) < 64
+
+
+def test_block_ts_db(tmp_path):
+    db_path = str(tmp_path / 'blocks.db')
+    ts_db = SqlBlockTsDb(db_path=db_path, category="price", sql_type="INT", block_size=4)
+    ts_db.send_many([("Finn_1", 10 * t, 100 + t) for t in range(10)] + [("Finn_2", 1, 1)])
+
+    with ts_db.transaction() as cursor:
+        assert cursor.execute("SELECT count(*) FROM price_ts_blocks").fetchone()[0] == 2
+        assert cursor.execute("SELECT count(*) FROM price_ts WHERE series_id='Finn_1'").fetchone()[0] == 2
+
+    times, values = ts_db.get_series("Finn_1", start=102, end=109)
+    assert times.tolist() == list(range(102, 109))
+    assert values.tolist() == [10. * t for t in range(2, 9)]
+    assert ts_db.get_series("Finn_1", bucket=5, how='max')[1].tolist() == [40., 90.]
+    assert ts_db.series_ids() == ["Finn_1", "Finn_2"]
+
+    # dedup warms the last value from sealed blocks too
+    ts_db.disconnect()
+    ts_db = SqlBlockTsDb(db_path=db_path, category="price", sql_type="INT", block_size=4, dedup=True)
+    ts_db.seal_blocks()
+    assert ts_db.send_many([("Finn_1", 90, 200), ("Finn_2", 1, 200)]) == 0
+    ts_db.disconnect()
+
+
+def test_dedup_warms_the_newest_point(tmp_path):
+    db_path = str(tmp_path / 'blocks.db')
+    ts_db = SqlBlockTsDb(db_path=db_path, category="price", sql_type="INT", block_size=3)
+    ts_db.send_many([("Finn_1", 1, 10), ("Finn_1", 2, 20), ("Finn_1", 3, 30)])
+    # a late point stays in the tail, older than the sealed block
+    ts_db.send_many([("Finn_1", 5, 5)])
+    ts_db.disconnect()
+
+    ts_db = SqlBlockTsDb(db_path=db_path, category="price", sql_type="INT", block_size=3, dedup=True)
+    ts_db.warm_last_points()
+    assert ts_db._last_points["Finn_1"][0] == 30
+    assert ts_db.send_many([("Finn_1", 3, 40)]) == 0
+    assert ts_db.send_many([("Finn_1", 5, 50)]) == 1
+    ts_db.disconnect()
@@ -0,0 +1,30 @@
+from ap.sql_toolbox.sql_interface import SqlTsDb
+from ap.sql_toolbox.retention import RollupEngine, RollupPolicy, DAY
+
+
+def test_rollup_and_retention(tmp_path):
+    ts_db = SqlTsDb(db_path=str(tmp_path / 'rollup.db'), category="price", sql_type="INT")
+    # four days of hourly prices for one listing, a single old point for another
+    ts_db.send_many([("Finn_1", 100 + t // 3600, t) for t in range(0, 4 * DAY, 3600)]
+                    + [("Finn_2", 7, 0)])
+
+    engine = RollupEngine(ts_db, rollups=[RollupPolicy(bucket=DAY)], raw_keep=DAY)
+    report = engine.run(now=2 * DAY)
+    assert report.rolled_up == 3
+    assert engine.watermarks() == {DAY: 2 * DAY}
+    # nothing older than the retention, except the latest point of Finn_2
+    assert report.raw_deleted == 24
+    assert ts_db.get_series("Finn_2")[0].tolist() == [0]
+
+    # the next pass only sees the buckets completed since
+    assert engine.run(now=3 * DAY).rolled_up == 1
+
+    for how, expected in (('first', [24., 48., 72.]), ('last', [47., 71., 95.]),
+                          ('max', [47., 71., 95.]), ('mean', [35.5, 59.5, 83.5])):
+        times, values = engine.get_many(["Finn_1"], start=DAY, bucket=DAY, how=how)["Finn_1"]
+        assert times.tolist() == [DAY, 2 * DAY, 3 * DAY]
+        assert values.tolist() == [v + 100 for v in expected]
+
+    # day 0 only survives in the rollup
+    assert engine.get_many(["Finn_1"], bucket=2 * DAY, how='first')["Finn_1"][1].tolist() == [100., 148.]
+    ts_db.disconnect()
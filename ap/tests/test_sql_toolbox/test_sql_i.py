@@ -1,5 +1,14 @@
+import csv
+import logging
 import os
-from ap.sql_toolbox.sql_interface import SqlDb, SqlTsDb, SqlTable
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+from ap.sql_toolbox.sql_interface import SqlDb, SqlTsDb, SqlTable, SqlOptions, connection_pool
+from ap.sql_toolbox.migrate import migrate_table_per_series
 
 
 def test_make_ts_db():
@@ -25,4 +34,218 @@ def test_db_pather():
     sql_db.write_to_table({"sq_m": 10, "price": 123})
 
     csv_path = os.path.join(path_to_folder, 'data', 'test.csv')
-    sql_db.write_to_csv(path=csv_path, table="test")
\ No newline at end of file
+    sql_db.write_to_csv(path=csv_path, table="test")
+
+def test_pooled_connection_shared_per_thread(tmp_path):
+    db_path = str(tmp_path / 'pool.db')
+    ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT")
+    table = SqlTable(db_path=db_path)
+
+    ts_db.connect_db()
+    table.connect_db()
+    assert ts_db.sql_db is table.sql_db
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(connection_pool.get(db_path)))
+    thread.start()
+    thread.join()
+    assert other[0] is not ts_db.sql_db
+
+    ts_db.disconnect()
+    ts_db.connect_db()
+    assert ts_db.sql_db is not table.sql_db
+    ts_db.disconnect()
+
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    db_path = str(tmp_path / 'rollback.db')
+    table = SqlTable(db_path=db_path)
+    table.create_table(table_name="test", categories={"sq_m": "INT"})
+
+    with pytest.raises(RuntimeError):
+        with table.transaction() as cursor:
+            cursor.execute("INSERT INTO test(sq_m) VALUES (1)")
+            raise RuntimeError
+
+    with table.transaction() as cursor:
+        assert cursor.execute("SELECT count(*) FROM test").fetchone()[0] == 0
+    table.disconnect()
+
+
+def test_batched_writes(tmp_path):
+    db_path = str(tmp_path / 'batch.db')
+    table = SqlTable(db_path=db_path)
+    table.create_table(table_name="test", categories={"sq_m": "INT", "price": "INT"})
+    rows = [{"sq_m": i, "price": 10 * i} for i in range(250)] + [{"sq_m": 1}]
+    assert table.write_many(rows, batch_size=100, commit_every=100) == 250
+
+    ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT")
+    points = [("Finn_1", 100, 1), ("Finn_2", 200, 1), ("Finn_1", 110, 2)]
+    assert ts_db.send_many(points, batch_size=2) == 3
+
+    with table.transaction() as cursor:
+        assert cursor.execute("SELECT count(*) FROM test").fetchone()[0] == 250
+        assert cursor.execute("SELECT time, value FROM price_ts WHERE series_id='Finn_1' "
+                              "ORDER BY time").fetchall() == [(1, 100), (2, 110)]
+    table.disconnect()
+
+
+def test_migrate_table_per_series(tmp_path):
+    db_path = str(tmp_path / 'migrate.db')
+    ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT")
+    with ts_db.transaction() as cursor:
+        for finn_id in (1, 2):
+            cursor.execute(f"CREATE TABLE Finn_{finn_id}(id INTEGER PRIMARY KEY, time INT, price INT)")
+            cursor.execute(f"INSERT INTO Finn_{finn_id}(time, price) VALUES (10, {finn_id}), (20, {finn_id * 2})")
+
+    assert migrate_table_per_series(ts_db) == 4
+    ts_db.send_data(input_time=30, table_name="Finn_1", data_value=5)
+
+    with ts_db.transaction() as cursor:
+        assert cursor.execute("SELECT count(*) FROM sqlite_master WHERE name GLOB 'Finn_*'").fetchone()[0] == 0
+        assert cursor.execute("SELECT time, value FROM price_ts WHERE series_id='Finn_1' "
+                              "ORDER BY time").fetchall() == [(10, 1), (20, 2), (30, 5)]
+    ts_db.disconnect()
+
+
+def test_schema_cache_follows_schema_version(tmp_path):
+    db_path = str(tmp_path / 'schema.db')
+    table = SqlTable(db_path=db_path)
+    table.create_table(table_name="test", categories={"sq_m": "INT", "price": "INT"})
+    assert table.tables() == {"test": ["id", "sq_m", "price"]}
+
+    # a schema change from another connection bumps schema_version and reloads the cache
+    other = sqlite3.connect(db_path)
+    other.execute("CREATE TABLE other(a INT)")
+    other.commit()
+    other.close()
+
+    assert table.does_table_exist("other")
+    assert table.tables()["other"] == ["a"]
+    table.disconnect()
+
+
+def test_write_to_csv_quotes_and_filters(tmp_path):
+    db_path = str(tmp_path / 'csv.db')
+    table = SqlTable(db_path=db_path)
+    table.create_table(table_name="test", categories={"address": "TEXT", "price": "INT"})
+    table.write_many([{"address": "Storgata 1, 0155 Oslo", "price": 1},
+                      {"address": 'Gate "2"', "price": 2},
+                      {"address": "Veien 3", "price": 3}])
+
+    csv_path = str(tmp_path / 'test.csv')
+    export = table.write_to_csv(path=csv_path, table="test", chunk_size=2)
+    assert export.rows == 3
+    with open(csv_path, newline="") as read_file:
+        assert list(csv.reader(read_file))[1] == ["1", "Storgata 1, 0155 Oslo", "1"]
+
+    export = table.write_to_csv(path=csv_path, table="test", columns=["address"],
+                                where="price >= ?", parameters=(2,))
+    with open(csv_path, newline="") as read_file:
+        assert list(csv.reader(read_file)) == [["address"], ['Gate "2"'], ["Veien 3"]]
+
+    ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT")
+    ts_db.send_many([("Finn_1", 10, 1), ("Finn_1", 20, 2), ("Finn_1", 30, 3)])
+    assert ts_db.write_to_csv(path=csv_path, table="price_ts", start=2, end=3).rows == 1
+    table.disconnect()
+
+
+def test_read_only_reader_alongside_wal_writer(tmp_path):
+    db_path = str(tmp_path / 'wal.db')
+    writer = SqlTsDb(db_path=db_path, category="price", sql_type="INT",
+                     options=SqlOptions(journal_mode="WAL", synchronous="NORMAL"))
+    writer.send_data(input_time=1, series_id="Finn_1", data_value=10)
+    reader = SqlDb(db_path=db_path, options=SqlOptions(read_only=True))
+
+    # an open write transaction does not block the reader, which sees the last commit
+    with writer.transaction() as cursor:
+        cursor.execute("INSERT INTO price_ts(series_id, time, value) VALUES ('Finn_1', 2, 20)")
+        with reader.transaction() as read_cursor:
+            assert read_cursor.execute("SELECT count(*) FROM price_ts").fetchone()[0] == 1
+
+    with reader.transaction() as read_cursor:
+        assert read_cursor.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        with pytest.raises(sqlite3.OperationalError):
+            read_cursor.execute("DELETE FROM price_ts")
+    reader.disconnect()
+    writer.disconnect()
+
+
+def test_read_series_as_arrays(tmp_path):
+    db_path = str(tmp_path / 'read.db')
+    ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT")
+    ts_db.send_many([("Finn_1", v, t) for t, v in ((10, 1), (20, 2), (110, 3), (120, 5))]
+                    + [("Finn_2", 7, 50)])
+
+    times, values = ts_db.get_series("Finn_1", start=20)
+    assert times.dtype == np.int64 and values.dtype == np.float64
+    assert times.flags['C_CONTIGUOUS'] and values.flags['C_CONTIGUOUS']
+    assert times.tolist() == [20, 110, 120] and values.tolist() == [2., 3., 5.]
+
+    series = ts_db.get_many(bucket=100, how='last')
+    assert series["Finn_1"][0].tolist() == [0, 100]
+    assert series["Finn_1"][1].tolist() == [2., 5.]
+    assert series["Finn_2"][1].tolist() == [7.]
+    assert ts_db.get_many(["Finn_1"], bucket=100, how='mean')["Finn_1"][1].tolist() == [1.5, 4.]
+    assert ts_db.get_many(["Finn_1"], bucket=100, how='first')["Finn_1"][1].tolist() == [1., 3.]
+    assert ts_db.get_series("Finn_3")[0].size == 0
+    assert ts_db.series_ids() == ["Finn_1", "Finn_2"]
+    ts_db.disconnect()
+
+
+def test_upsert_on_unique_key(tmp_path, caplog):
+    db_path = str(tmp_path / 'upsert.db')
+    table = SqlTable(db_path=db_path)
+    categories = {"finn_id": "INT", "price": "INT"}
+    table.create_table(table_name="finn_info", categories=categories)
+    table.write_many([{"finn_id": 1, "price": 10}, {"finn_id": 1, "price": 11}])
+    table.write_many([{"finn_id": 100 + i, "price": 1} for i in range(12)] * 2)
+
+    # declaring the key on a table with duplicates keeps the latest row, and logs the removed ones
+    with caplog.at_level(logging.WARNING, logger='ap.sql_toolbox.sql_interface'):
+        table.create_table(table_name="finn_info", categories=categories, unique_key="finn_id")
+    assert len(caplog.records) == 1
+    assert 'Removed 13 duplicate rows of 13 keys of finn_info' in caplog.text
+    assert '(1,): 1' in caplog.text and '(108,): 1' in caplog.text and '(109,)' not in caplog.text
+    with table.transaction() as cursor:
+        cursor.execute("DELETE FROM finn_info WHERE finn_id >= 100")
+    table.write_many([{"finn_id": 1, "price": 11}, {"finn_id": 2, "price": 20}], upsert=True)
+    table.write_to_table({"finn_id": 2, "price": 21}, upsert=True)
+
+    with table.transaction() as cursor:
+        assert cursor.execute("SELECT id, finn_id, price FROM finn_info ORDER BY finn_id").fetchall() == \
+            [(2, 1, 11), (3, 2, 21)]
+        changes = cursor.connection.total_changes
+
+    # unchanged rows are not touched
+    table.write_to_table({"finn_id": 1, "price": 11}, upsert=True)
+    with table.transaction() as cursor:
+        assert cursor.connection.total_changes == changes
+    table.disconnect()
+
+
+def test_dedup_keeps_the_newest_point_as_baseline(tmp_path):
+    ts_db = SqlTsDb(db_path=str(tmp_path / 'dedup.db'), category="price", sql_type="INT", dedup=True)
+    assert ts_db.send_many([("A", 10, 100)]) == 1
+    # a late point is written, the change at t=110 is still compared against t=100
+    assert ts_db.send_many([("A", 12, 50)]) == 1
+    assert ts_db.send_many([("A", 12, 110)]) == 1
+    assert ts_db.get_series("A")[0].tolist() == [50, 100, 110]
+    ts_db.disconnect()
+
+
+def test_dedup_only_records_changes(tmp_path):
+    db_path = str(tmp_path / 'dedup.db')
+    SqlTsDb(db_path=db_path, category="price", sql_type="INT").send_data(
+        input_time=0, series_id="Finn_1", data_value=10)
+
+    # the last value is warmed from the database
+    ts_db = SqlTsDb(db_path=db_path, category="price", sql_type="INT", dedup=True, heartbeat=100)
+    points = [("Finn_1", 10, 10), ("Finn_1", 10, 20), ("Finn_1", 11, 30), ("Finn_1", 11, 40),
+              ("Finn_1", 11, 130), ("Finn_2", 5, 30), ("Finn_2", 5, 40)]
+    assert ts_db.send_many(points) == 3
+
+    series = ts_db.get_many()
+    assert series["Finn_1"][0].tolist() == [0, 30, 130]
+    assert series["Finn_2"][0].tolist() == [30]
+    ts_db.disconnect()
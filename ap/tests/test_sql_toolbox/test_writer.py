@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from ap.sql_toolbox.sql_interface import SqlTable
+from ap.sql_toolbox.writer import SqlWriter
+
+
+def test_writer_coalesces_and_flushes(tmp_path):
+    db_path = str(tmp_path / 'writer.db')
+    table = SqlTable(db_path=db_path)
+    table.create_table(table_name="test", categories={"sq_m": "INT"})
+
+    writer = SqlWriter(db_path, max_batch=100, max_delay=10.)
+    writer.start()
+    for i in range(150):
+        writer.submit(table.write_many, {"sq_m": i})
+    assert writer.flush(timeout=5.)
+
+    stats = writer.stats()
+    assert stats.records == 150 and stats.batches == 2 and stats.queue_depth == 0
+    with table.transaction() as cursor:
+        assert cursor.execute("SELECT count(*) FROM test").fetchone()[0] == 150
+
+    writer.stop(timeout=5.)
+    assert not writer.is_running()
+    table.disconnect()
+
+
+def test_writer_backpressure_and_errors(tmp_path):
+    release = threading.Event()
+    written = []
+
+    def slow_sink(records):
+        release.wait()
+        written.extend(records)
+
+    def failing_sink(records):
+        raise RuntimeError('disk full')
+
+    writer = SqlWriter(str(tmp_path / 'writer.db'), max_queue=1, max_batch=1, max_delay=0.)
+    writer.start()
+    writer.submit(slow_sink, 1)
+    writer.submit(slow_sink, 2, timeout=1.)
+    with pytest.raises(queue.Full):
+        writer.submit(slow_sink, 3, timeout=0.1)
+
+    release.set()
+    writer.submit(failing_sink, 4, timeout=1.)
+    assert writer.flush(timeout=5.)
+    assert written == [1, 2]
+    assert isinstance(writer.get_error(), RuntimeError)
+    writer.stop(timeout=5.)
+
+
+def test_writer_timeouts_on_full_queue(tmp_path):
+    release = threading.Event()
+
+    def slow_sink(records):
+        release.wait()
+
+    writer = SqlWriter(str(tmp_path / 'writer.db'), max_queue=1, max_batch=1, max_delay=0.)
+    writer.start()
+    writer.submit(slow_sink, 1)
+    writer.submit(slow_sink, 2, timeout=1.)
+    # waiting for room in the queue counts towards the timeout of a flush
+    t1 = time.monotonic()
+    assert not writer.flush(timeout=0.2)
+    assert time.monotonic() - t1 < 1.
+    # stopping does not block on the full queue
+    writer.stop(timeout=0.2)
+    assert time.monotonic() - t1 < 2.
+    assert writer.is_running()
+
+    release.set()
+    writer.stop(timeout=5.)
+    assert not writer.is_running()